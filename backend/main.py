@@ -10,6 +10,10 @@ from fastapi.responses import JSONResponse
 from backend.routers import auth, users, sessions, chat
 from chatbot.core.db import init_db
 from chatbot.core.watcher import app_watcher
+from chatbot.core.write_buffer import app_session_writer
+from chatbot.core.archive import app_session_archiver
+from chatbot.core.orphan_gc import app_orphan_collector
+from chatbot.core.file_events import app_file_status_hub
 
 
 @asynccontextmanager
@@ -21,7 +25,10 @@ async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting Chatbot API Server...")
     init_db()
+    app_session_writer.start()
     app_watcher.start()
+    app_session_archiver.start()
+    app_orphan_collector.start()
     print("✅ API Server ready!")
     
     yield
@@ -29,6 +36,10 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("🛑 Shutting down...")
     app_watcher.stop()
+    app_session_archiver.stop()
+    app_orphan_collector.stop()
+    await app_file_status_hub.close()
+    app_session_writer.stop()  # flush buffered chat turns
     print("👋 Goodbye!")
 
 
@@ -70,6 +81,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges", "Content-Disposition"],
 )
 
 
@@ -59,3 +59,17 @@ class FileUploadResponse(BaseModel):
     filename: str
     status: str
     message: str
+
+
+class BatchUploadItem(BaseModel):
+    """Per-file result of a batch upload"""
+    filename: str
+    file_id: Optional[str] = None
+    status: str  # "processing" | "processed" | "duplicate" | "error"
+    error: Optional[str] = None
+
+
+class BatchUploadResponse(BaseModel):
+    """Schema for batch file upload response"""
+    session_id: str
+    files: List[BatchUploadItem]
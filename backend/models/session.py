@@ -37,3 +37,10 @@ class SessionDetailResponse(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     messages: List[MessageResponse] = []
+
+
+class MessagePageResponse(BaseModel):
+    """Schema for a page of session messages (cursor pagination)"""
+    session_id: str
+    messages: List[MessageResponse] = []
+    next_cursor: Optional[str] = None  # Pass as `before` to load older messages
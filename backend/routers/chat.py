@@ -2,22 +2,28 @@
 Chat Router
 Handles chat interactions with the AI agent
 """
+import asyncio
 import uuid
 import os
+import json
 import base64
 import tempfile
-from typing import Optional
+from typing import Optional, List
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Request, status, UploadFile, File, Form
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from langchain_core.messages import HumanMessage
 
 from backend.models.chat import (
-    ChatRequest, ChatResponse, FileUploadResponse,
+    ChatRequest, ChatResponse, FileUploadResponse, BatchUploadItem, BatchUploadResponse,
     TextChatRequest, PdfChatRequest, ImageChatRequest
 )
 from backend.dependencies import get_current_user, get_app_container
 from chatbot.core.history import save_session_message
-from chatbot.core.file_store import save_pdf_to_mongo
+from chatbot.core.file_store import PdfUploadStream, UploadValidationError, commit_uploads
+from chatbot.core.watcher import app_watcher
+from chatbot.config import config as app_config
 
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
@@ -328,16 +334,23 @@ async def upload_file(
             detail="Only PDF files are supported"
         )
     
-    # Save file temporarily
-    temp_path = None
+    # Stream straight into GridFS: validate, hash and store chunk by chunk
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            temp_path = tmp.name
+        upload = PdfUploadStream(user_id, file.filename)
+    except RuntimeError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    
+    try:
+        while True:
+            chunk = await file.read(app_config.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            upload.write(chunk)
         
-        # Save to MongoDB/GridFS with original filename
-        file_id = save_pdf_to_mongo(temp_path, session_id, user_id, original_filename=file.filename)
+        file_id = upload.commit(session_id)
         
         if not file_id:
             raise HTTPException(
@@ -345,6 +358,9 @@ async def upload_file(
                 detail="Failed to save file"
             )
         
+        # Wake the watcher now instead of waiting for its next scan
+        app_watcher.notify(file_id, user_id)
+        
         return FileUploadResponse(
             file_id=str(file_id),
             filename=file.filename,
@@ -352,20 +368,103 @@ async def upload_file(
             message="File uploaded successfully. Processing in background."
         )
         
+    except UploadValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE if upload.size > upload.max_bytes
+            else status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except HTTPException:
         raise
     except Exception as e:
+        upload.abort()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error uploading file: {str(e)}"
         )
-    finally:
-        # Clean up temp file
-        if temp_path and os.path.exists(temp_path):
+
+
+@router.post(
+    "/upload/batch",
+    response_model=BatchUploadResponse,
+    summary="Upload several PDF files",
+    description="Upload many PDF files in one multipart request"
+)
+async def upload_files_batch(
+    files: List[UploadFile] = File(...),
+    session_id: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Upload a folder of PDFs in one request instead of one `/chat/upload` call per file.
+    
+    Each part is streamed into GridFS and hashed in one pass, then all document rows are
+    inserted together. A file that fails validation does not fail the others.
+    
+    - **files**: PDF files to upload (at most MAX_BATCH_UPLOAD_FILES)
+    - **session_id**: Optional session ID to associate the files with
+    """
+    user_id = str(current_user["_id"])
+    session_id = session_id or str(uuid.uuid4())
+    
+    if len(files) > app_config.MAX_BATCH_UPLOAD_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {app_config.MAX_BATCH_UPLOAD_FILES} files per batch"
+        )
+    
+    items = [BatchUploadItem(filename=file.filename or "", status="error") for file in files]
+    uploads, positions = [], []
+    try:
+        for i, file in enumerate(files):
+            if not (file.filename or "").lower().endswith('.pdf'):
+                items[i].error = "Only PDF files are supported"
+                continue
+            upload = PdfUploadStream(user_id, file.filename)
             try:
-                os.remove(temp_path)
-            except:
-                pass
+                while True:
+                    chunk = await file.read(app_config.UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    upload.write(chunk)
+            except UploadValidationError as e:
+                items[i].error = str(e)
+                continue
+            except Exception:
+                upload.abort()
+                raise
+            uploads.append(upload)
+            positions.append(i)
+        
+        results = commit_uploads(uploads, session_id) if uploads else []
+    except RuntimeError:
+        for upload in uploads:
+            upload.abort()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    except Exception as e:
+        for upload in uploads:
+            upload.abort()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error uploading files: {str(e)}"
+        )
+    
+    notified = set()
+    for i, result in zip(positions, results):
+        if result.get("error"):
+            items[i].error = result["error"]
+            continue
+        items[i].file_id = result["file_id"]
+        items[i].status = "processing" if result["status"] == "uploaded" else result["status"]
+        if result["status"] == "uploaded" and result["file_id"] not in notified:
+            # Wake the watcher now instead of waiting for its next scan
+            app_watcher.notify(result["file_id"], user_id)
+            notified.add(result["file_id"])
+    
+    return BatchUploadResponse(session_id=session_id, files=items)
 
 
 @router.get(
@@ -381,9 +480,11 @@ async def check_file_status(
     Check the status of a file that was uploaded for processing.
     
     Returns:
-    - status: "uploaded" | "processing" | "processed" | "error_processing"
+    - status: "uploaded" | "processing" | "processed" | "dead_letter"
+      (older files may still report "error" / "error_processing")
     - filename: Original filename
     - file_store_name: (only if processed) The file store name
+    - attempts / next_attempt_at: retry state after a transient failure
     """
     from chatbot.core.db import DB_DOCUMENTS_COLLECTION
     from bson import ObjectId
@@ -413,7 +514,9 @@ async def check_file_status(
             "filename": doc.get("filename"),
             "status": doc.get("status", "uploaded"),
             "file_store_name": doc.get("file_store_name"),
-            "error": doc.get("error")
+            "error": doc.get("error") or doc.get("error_msg"),
+            "attempts": doc.get("attempts", 0),
+            "next_attempt_at": doc.get("next_attempt_at")
         }
         
     except HTTPException:
@@ -425,6 +528,166 @@ async def check_file_status(
         )
 
 
+def _sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event, default=str, ensure_ascii=False)}\n\n"
+
+
+@router.get(
+    "/files/events",
+    summary="Stream file status changes",
+    description="Server-Sent Events stream of processing status transitions for the user's files"
+)
+async def file_status_events(
+    request: Request,
+    file_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Push status transitions (uploaded -> processing -> processed / dead_letter) instead
+    of polling `/chat/file/{file_id}/status`.
+    
+    - **file_id**: only stream this file; the stream ends once it reaches a final status
+    
+    The current status of the watched files is sent first, then one `status` event per
+    transition published by the watcher (Redis pub/sub, one shared subscription per
+    process). Comment lines keep the
+    connection alive every 15 seconds.
+    """
+    from chatbot.core.db import DB_DOCUMENTS_COLLECTION
+    from chatbot.core.file_events import app_file_status_hub, TERMINAL_STATUSES
+    from bson import ObjectId
+    from bson.errors import InvalidId
+    
+    user_id = str(current_user["_id"])
+    
+    if DB_DOCUMENTS_COLLECTION is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    
+    query = {"user_id": user_id}
+    if file_id:
+        try:
+            query["_id"] = ObjectId(file_id)
+        except InvalidId:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        if await run_in_threadpool(DB_DOCUMENTS_COLLECTION.count_documents, query, limit=1) == 0:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+    else:
+        query["status"] = {"$nin": list(TERMINAL_STATUSES)}
+    
+    def _snapshot() -> list:
+        projection = {"status": 1, "filename": 1, "error": 1, "attempts": 1, "next_attempt_at": 1}
+        return [
+            {
+                "file_id": str(doc["_id"]),
+                "status": doc.get("status", "uploaded"),
+                "filename": doc.get("filename"),
+                "error": doc.get("error"),
+                "attempts": doc.get("attempts", 0),
+                "next_attempt_at": doc.get("next_attempt_at")
+            }
+            for doc in DB_DOCUMENTS_COLLECTION.find(query, projection)
+        ]
+    
+    async def event_stream():
+        yield "retry: 3000\n\n"
+        # Subscribe before the snapshot so no transition falls in between
+        queue = await app_file_status_hub.subscribe(user_id)
+        try:
+            done = False
+            for event in await run_in_threadpool(_snapshot):
+                yield _sse(event)
+                done = done or (file_id is not None and event["status"] in TERMINAL_STATUSES)
+            if done or queue is None:
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if file_id and event.get("file_id") != file_id:
+                    continue
+                yield _sse(event)
+                if file_id and event.get("status") in TERMINAL_STATUSES:
+                    return
+        except Exception as e:
+            print(f"[backend.chat] Status stream error: {e}")
+        finally:
+            if queue is not None:
+                app_file_status_hub.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post(
+    "/files/{file_id}/requeue",
+    summary="Retry processing a file",
+    description="Put a failed (dead-lettered) file back in the processing queue"
+)
+async def requeue_file(
+    file_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Requeue a file whose processing failed, or retry a file waiting for its
+    next scheduled attempt right away. The attempt counter starts over.
+    """
+    from chatbot.core.db import DB_DOCUMENTS_COLLECTION
+    from chatbot.core.file_store import requeue_document
+    from bson import ObjectId
+    from bson.errors import InvalidId
+
+    user_id = str(current_user["_id"])
+
+    if DB_DOCUMENTS_COLLECTION is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+
+    try:
+        if requeue_document(file_id, user_id):
+            app_watcher.notify(file_id, user_id)
+            return {"file_id": file_id, "status": "uploaded", "message": "File queued for processing."}
+
+        doc = DB_DOCUMENTS_COLLECTION.find_one({"_id": ObjectId(file_id), "user_id": user_id}, {"status": 1})
+        if doc is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"File cannot be requeued while {doc.get('status')}"
+        )
+
+    except HTTPException:
+        raise
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error requeueing file: {str(e)}"
+        )
+
+
 @router.get(
     "/files",
     summary="List all uploaded files",
@@ -460,7 +723,7 @@ async def list_user_files(
         
         # Get files
         cursor = DB_DOCUMENTS_COLLECTION.find(
-            {"user_id": user_id},
+            {"user_id": user_id, "deleted_at": {"$exists": False}},
             {"filename": 1, "status": 1, "session_id": 1, "created_at": 1, "file_gridfs_id": 1}
         ).sort("created_at", -1)
         
@@ -497,20 +760,68 @@ async def list_user_files(
         )
 
 
-from fastapi.responses import StreamingResponse
-import io
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def _parse_range(range_header: str, file_size: int) -> Optional[tuple]:
+    """
+    Parse a single-range `Range: bytes=...` header into an inclusive (start, end).
+    Returns None when the header should be ignored (absent, malformed, multi-range).
+    Raises ValueError when the range is not satisfiable.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, sep, end_str = range_header[len("bytes="):].strip().partition("-")
+    if not sep or not (start_str or end_str):
+        return None
+    if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+        return None
+    if not start_str:
+        # suffix range: last N bytes
+        length = int(end_str)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, file_size - length), file_size - 1
+    start = int(start_str)
+    end = int(end_str) if end_str else file_size - 1
+    if start >= file_size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, file_size - 1)
+
+
+def _iter_grid_file(grid_file, start: int, length: int):
+    """Yield GridFS content chunk by chunk, never holding more than one chunk in memory."""
+    try:
+        grid_file.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = grid_file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        grid_file.close()
+
 
 @router.get(
     "/files/{file_id}/download",
     summary="Download uploaded file",
-    description="Download the original uploaded file"
+    description="Download the original uploaded file (supports HTTP Range and ETag)"
 )
 async def download_file(
     file_id: str,
+    request: Request,
+    inline: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Download the original file from GridFS.
+    
+    - Streams GridFS chunks instead of loading the whole file
+    - Honours `Range: bytes=...` (206 Partial Content) so PDF viewers can fetch pages lazily
+    - Returns 304 when `If-None-Match` matches the file hash ETag
+    - **inline**: show in the browser instead of downloading
     """
     from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS
     from bson import ObjectId
@@ -543,7 +854,15 @@ async def download_file(
                 detail="File content not available"
             )
         
-        # Get file from GridFS
+        etag = f'"{doc["file_hash"]}"' if doc.get("file_hash") else None
+        cache_headers = {"Cache-Control": "private, no-cache"}
+        if etag:
+            cache_headers["ETag"] = etag
+            if_none_match = request.headers.get("if-none-match", "")
+            if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+        
+        # Get file from GridFS (only metadata is loaded here)
         try:
             grid_file = FS.get(ObjectId(gridfs_id))
         except Exception:
@@ -552,8 +871,6 @@ async def download_file(
                 detail="File content not found in storage"
             )
         
-        # Read file content
-        file_content = grid_file.read()
         filename = doc.get("filename", "download.pdf")
         
         # Determine content type
@@ -570,12 +887,41 @@ async def download_file(
         else:
             content_type = "application/octet-stream"
         
+        file_size = grid_file.length
+        headers = {
+            **cache_headers,
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'{"inline" if inline else "attachment"}; filename="{filename}"'
+        }
+        
+        try:
+            byte_range = _parse_range(request.headers.get("range"), file_size)
+        except ValueError:
+            grid_file.close()
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{file_size}"}
+            )
+        
+        # If-Range with a stale validator -> send the full file
+        if_range = request.headers.get("if-range")
+        if byte_range and if_range and if_range != etag:
+            byte_range = None
+        
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+        else:
+            start, end = 0, file_size - 1
+            status_code = status.HTTP_200_OK
+        headers["Content-Length"] = str(end - start + 1)
+        
         return StreamingResponse(
-            io.BytesIO(file_content),
+            _iter_grid_file(grid_file, start, end - start + 1),
+            status_code=status_code,
             media_type=content_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
-            }
+            headers=headers
         )
         
     except HTTPException:
@@ -595,12 +941,17 @@ async def download_file(
 )
 async def delete_file(
     file_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    app = Depends(get_app_container)
 ):
     """
     Delete a file from documents collection and optionally from GridFS.
+    The file is removed from its session's file search store; the store itself
+    is deleted once no other document references it.
     """
     from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS
+    from chatbot.core.file_store import release_file_store
+    from chatbot.core.local_index import delete_document_chunks
     from bson import ObjectId
     
     user_id = str(current_user["_id"])
@@ -638,8 +989,13 @@ async def delete_file(
                 except Exception:
                     pass  # GridFS file may already be deleted
         
-        # Delete the document
+        # Delete the document and its local chunks
         DB_DOCUMENTS_COLLECTION.delete_one({"_id": ObjectId(file_id)})
+        delete_document_chunks([ObjectId(file_id)])
+        
+        # Drop this document's reference to its file search store
+        if doc.get("file_store_name"):
+            release_file_store(doc["file_store_name"], app.genai_client, doc.get("file_store_document"))
         
         return {"message": "File deleted successfully"}
         
@@ -2,15 +2,16 @@
 Sessions Router
 Handles chat session management
 """
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 
 from backend.models.session import (
-    SessionCreate, SessionUpdate, SessionResponse, SessionDetailResponse
+    SessionCreate, SessionUpdate, SessionResponse, SessionDetailResponse,
+    MessagePageResponse
 )
 from backend.dependencies import get_current_user
 from backend.services.session_service import (
-    get_user_sessions, get_session_detail, create_session,
+    get_user_sessions, get_session_detail, get_session_messages_page, create_session,
     update_session_title, delete_session, delete_all_user_sessions
 )
 
@@ -25,20 +26,31 @@ router = APIRouter(prefix="/sessions", tags=["Sessions"])
     description="Get all chat sessions for the current user"
 )
 async def list_sessions(
-    limit: int = 50,
-    skip: int = 0,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Get all chat sessions for the current user.
     
     - **limit**: Maximum number of sessions to return (default: 50)
-    - **skip**: Number of sessions to skip for pagination (default: 0)
+    - **cursor**: Opaque cursor from the `X-Next-Cursor` header of the previous page
     
     Sessions are ordered by most recent activity first.
+    The `X-Next-Cursor` response header is set when more sessions are available.
     """
     user_id = str(current_user["_id"])
-    sessions = get_user_sessions(user_id, limit=limit, skip=skip)
+    try:
+        sessions, next_cursor = get_user_sessions(user_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return [SessionResponse(**s) for s in sessions]
 
@@ -104,6 +116,44 @@ async def get_session(
     return SessionDetailResponse(**session)
 
 
+@router.get(
+    "/{session_id}/messages",
+    response_model=MessagePageResponse,
+    summary="Get session messages (paginated)",
+    description="Get a page of messages older than the given cursor"
+)
+async def get_session_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a page of messages from a chat session, newest page first.
+    
+    - **limit**: Maximum number of messages to return (default: 50)
+    - **before**: Opaque cursor (`next_cursor` of the previous page) to load older messages
+    
+    Messages within a page are in chronological order.
+    """
+    user_id = str(current_user["_id"])
+    try:
+        page = get_session_messages_page(session_id, user_id, limit=limit, before=before)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
+    if page is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    return MessagePageResponse(**page)
+
+
 @router.put(
     "/{session_id}",
     response_model=dict,
@@ -2,11 +2,18 @@
 Session Service
 Handles chat session CRUD operations
 """
+import base64
+import json
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from bson import ObjectId
 
 from chatbot.core.db import get_mongo_collection
+from chatbot.core.write_buffer import app_session_writer
+from chatbot.core.history import get_recent_messages
+from chatbot.core.recent_turns import app_recent_turns
+from chatbot.core.archive import ARCHIVE_COLLECTION, load_archived_session
+from chatbot.core.orphan_gc import mark_documents_deleted
 from pymongo import DESCENDING
 from datetime import timezone, timedelta
 
@@ -18,48 +25,123 @@ def get_vn_now():
     return datetime.now(VN_TIMEZONE)
 
 
-def get_user_sessions(user_id: str, limit: int = 50, skip: int = 0) -> List[dict]:
+def _encode_cursor(payload: dict) -> str:
+    """Encode a cursor payload into an opaque URL-safe token"""
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
     """
-    Get all sessions for a user, ordered by most recent first
+    Decode an opaque cursor token
+    Raises ValueError if the token is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid cursor")
+    return payload
+
+
+def _encode_sort_value(value) -> dict:
+    """Keep the BSON type of updated_at so the keyset comparison matches stored values"""
+    if isinstance(value, datetime):
+        return {"t": "date", "v": value.isoformat()}
+    return {"t": "raw", "v": value}
+
+
+def _decode_sort_value(data: dict):
+    if data.get("t") == "date":
+        return datetime.fromisoformat(data["v"])
+    return data.get("v")
+
+
+def get_user_sessions(
+    user_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Get sessions for a user, ordered by most recent first.
+    Uses keyset pagination on (updated_at, _id); pass the returned
+    next_cursor back in to fetch the following page.
+    Returns (sessions, next_cursor). next_cursor is None on the last page.
+    Raises ValueError if the cursor is malformed.
     """
     coll = get_mongo_collection("sessions")
     if coll is None:
-        return []
+        return [], None
+    
+    query = {"user_id": user_id}
+    if cursor:
+        payload = _decode_cursor(cursor)
+        try:
+            last_updated = _decode_sort_value(payload["u"])
+            last_id = ObjectId(payload["id"])
+        except Exception:
+            raise ValueError("Invalid cursor")
+        query["$or"] = [
+            {"updated_at": {"$lt": last_updated}},
+            {"updated_at": last_updated, "_id": {"$lt": last_id}}
+        ]
     
-    sessions = coll.find(
-        {"user_id": user_id},
+    sort = [("updated_at", DESCENDING), ("_id", DESCENDING)]
+    # Fetch one extra row to know whether another page exists
+    sessions = list(coll.find(
+        query,
         projection={
             "session_id": 1,
             "title": 1,
             "created_at": 1,
             "updated_at": 1,
-            "messages": 1
+            "num_messages": {"$size": {"$ifNull": ["$messages", []]}}
         }
-    ).sort("updated_at", DESCENDING).skip(skip).limit(limit)
+    ).sort(sort).limit(limit + 1))
+    
+    # Archived sessions follow the same keyset; merge both sides of the page
+    archive = get_mongo_collection(ARCHIVE_COLLECTION)
+    if archive is not None:
+        archived = list(archive.find(
+            query,
+            projection={"session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "num_messages": 1}
+        ).sort(sort).limit(limit + 1))
+        if archived:
+            hot_ids = {s["session_id"] for s in sessions}
+            sessions += [s for s in archived if s["session_id"] not in hot_ids]
+            sessions.sort(key=lambda s: (s.get("updated_at") or datetime.min, s["_id"]), reverse=True)
+    
+    next_cursor = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        next_cursor = _encode_cursor({
+            "u": _encode_sort_value(last.get("updated_at")),
+            "id": str(last["_id"])
+        })
     
     return [{
         "session_id": s["session_id"],
         "title": s.get("title"),
         "created_at": s.get("created_at"),
         "updated_at": s.get("updated_at"),
-        "num_messages": len(s.get("messages", []))
-    } for s in sessions]
+        "num_messages": s.get("num_messages", 0)
+    } for s in sessions], next_cursor
 
 
 def get_session_detail(session_id: str, user_id: str) -> Optional[dict]:
     """
     Get a single session with all messages
+    Served from the Redis recent-turns cache when it holds the whole session
     """
-    coll = get_mongo_collection("sessions")
-    if coll is None:
-        return None
-    
-    session = coll.find_one({"session_id": session_id, "user_id": user_id})
-    if not session:
+    session = get_recent_messages(session_id, user_id)
+    if session is None:
         return None
     
     return {
-        "session_id": session["session_id"],
+        "session_id": session_id,
         "title": session.get("title"),
         "created_at": session.get("created_at"),
         "updated_at": session.get("updated_at"),
@@ -67,6 +149,70 @@ def get_session_detail(session_id: str, user_id: str) -> Optional[dict]:
     }
 
 
+def get_session_messages_page(
+    session_id: str,
+    user_id: str,
+    limit: int = 50,
+    before: Optional[str] = None
+) -> Optional[dict]:
+    """
+    Get a page of messages older than the `before` cursor (newest page if omitted).
+    Messages inside the page are returned in chronological order.
+    Returns None if the session does not exist.
+    Raises ValueError if the cursor is malformed.
+    """
+    coll = get_mongo_collection("sessions")
+    if coll is None:
+        return None
+    
+    match = {"session_id": session_id, "user_id": user_id}
+    
+    if before:
+        payload = _decode_cursor(before)
+        end = payload.get("i")
+        if not isinstance(end, int) or end < 0:
+            raise ValueError("Invalid cursor")
+        start = max(0, end - limit)
+        projection = {"session_id": 1}
+        if end > start:
+            projection["messages"] = {"$slice": [start, end - start]}
+        session = coll.find_one(match, projection=projection)
+        if not session:
+            session = load_archived_session(session_id, user_id)
+            if not session:
+                return None
+            session["messages"] = session["messages"][start:end]
+        messages = session.get("messages", []) if end > start else []
+        pending = []
+    else:
+        # Only the tail of the array and its size leave the server
+        result = list(coll.aggregate([
+            {"$match": match},
+            {"$limit": 1},
+            {"$project": {
+                "session_id": 1,
+                "total": {"$size": {"$ifNull": ["$messages", []]}},
+                "messages": {"$slice": [{"$ifNull": ["$messages", []]}, -limit]}
+            }}
+        ]))
+        if not result:
+            archived = load_archived_session(session_id, user_id)
+            if archived:
+                tail = archived["messages"][-limit:]
+                result = [{"total": len(archived["messages"]), "messages": tail}]
+        pending = app_session_writer.pending_messages(session_id, user_id)
+        if not result and not pending:
+            return None
+        messages = result[0].get("messages", []) if result else []
+        start = (result[0].get("total", 0) if result else 0) - len(messages)
+    
+    return {
+        "session_id": session_id,
+        "messages": app_session_writer.merge_pending(session_id, user_id, messages) if pending else messages,
+        "next_cursor": _encode_cursor({"i": start}) if start > 0 else None
+    }
+
+
 def create_session(session_id: str, user_id: str, title: Optional[str] = None) -> dict:
     """
     Create a new chat session
@@ -101,10 +247,14 @@ def update_session_title(session_id: str, user_id: str, title: str) -> bool:
         return False
     
     try:
-        result = coll.update_one(
-            {"session_id": session_id, "user_id": user_id},
-            {"$set": {"title": title, "updated_at": get_vn_now()}}
-        )
+        match = {"session_id": session_id, "user_id": user_id}
+        update = {"$set": {"title": title, "updated_at": get_vn_now()}}
+        result = coll.update_one(match, update)
+        if result.matched_count == 0:
+            # Archived sessions are listed too: rename the cold row in place
+            result = get_mongo_collection(ARCHIVE_COLLECTION).update_one(match, update)
+        if result.modified_count > 0:
+            app_recent_turns.set_title(user_id, session_id, title)
         return result.modified_count > 0
     except Exception as e:
         print(f"[session_service] Error updating session: {e}")
@@ -121,7 +271,11 @@ def delete_session(session_id: str, user_id: str) -> bool:
     
     try:
         result = coll.delete_one({"session_id": session_id, "user_id": user_id})
-        return result.deleted_count > 0
+        archived = get_mongo_collection(ARCHIVE_COLLECTION).delete_one({"session_id": session_id, "user_id": user_id})
+        app_recent_turns.invalidate(user_id, session_id)
+        # Uploaded files, blobs and stores are removed by the orphan GC
+        mark_documents_deleted({"session_id": session_id, "user_id": user_id})
+        return result.deleted_count + archived.deleted_count > 0
     except Exception as e:
         print(f"[session_service] Error deleting session: {e}")
         return False
@@ -138,7 +292,10 @@ def delete_all_user_sessions(user_id: str) -> int:
     
     try:
         result = coll.delete_many({"user_id": user_id})
-        return result.deleted_count
+        archived = get_mongo_collection(ARCHIVE_COLLECTION).delete_many({"user_id": user_id})
+        app_recent_turns.invalidate(user_id)
+        mark_documents_deleted({"user_id": user_id})
+        return result.deleted_count + archived.deleted_count
     except Exception as e:
         print(f"[session_service] Error deleting sessions: {e}")
         return 0
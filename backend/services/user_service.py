@@ -7,6 +7,9 @@ from typing import Optional
 from bson import ObjectId
 
 from chatbot.core.db import DB_USERS_COLLECTION, get_mongo_collection
+from chatbot.core.recent_turns import app_recent_turns
+from chatbot.core.archive import ARCHIVE_COLLECTION
+from chatbot.core.orphan_gc import mark_documents_deleted
 from backend.services.auth_service import hash_password, verify_password
 
 
@@ -155,8 +158,13 @@ def delete_user(user_id: str) -> bool:
         
         # Also delete user's sessions
         sessions_coll = get_mongo_collection("sessions")
-        if sessions_coll:
+        if sessions_coll is not None:
             sessions_coll.delete_many({"user_id": user_id})
+            get_mongo_collection(ARCHIVE_COLLECTION).delete_many({"user_id": user_id})
+        app_recent_turns.invalidate(user_id)
+        
+        # Uploaded files, blobs and stores are removed by the orphan GC
+        mark_documents_deleted({"user_id": user_id})
         
         return result.deleted_count > 0
     except Exception as e:
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -38,3 +39,66 @@ FRONTEND_URL = os.getenv("FRONTEND_URL")
 
 # Verification Token
 VERIFICATION_TOKEN_EXPIRE_HOURS = 24
+
+# Session write-behind buffer (chat turns are acknowledged before reaching Mongo)
+SESSION_WRITE_BUFFER_SIZE = int(os.getenv("SESSION_WRITE_BUFFER_SIZE", "1000"))  # max pending messages
+SESSION_WRITE_BATCH_SIZE = int(os.getenv("SESSION_WRITE_BATCH_SIZE", "200"))  # messages per bulk_write
+SESSION_WRITE_FLUSH_INTERVAL = float(os.getenv("SESSION_WRITE_FLUSH_INTERVAL", "0.5"))  # seconds
+
+# Redis recent-turns cache for active sessions
+RECENT_TURNS_CACHE_SIZE = int(os.getenv("RECENT_TURNS_CACHE_SIZE", "25"))  # turns kept per session
+RECENT_TURNS_TTL = int(os.getenv("RECENT_TURNS_TTL", "1800"))  # seconds of inactivity before expiry
+
+# Session archival (idle sessions move to a compressed cold collection)
+SESSION_ARCHIVE_AFTER_DAYS = int(os.getenv("SESSION_ARCHIVE_AFTER_DAYS", "90"))
+SESSION_ARCHIVE_INTERVAL = int(os.getenv("SESSION_ARCHIVE_INTERVAL", "3600"))  # seconds between runs
+SESSION_ARCHIVE_BATCH_SIZE = int(os.getenv("SESSION_ARCHIVE_BATCH_SIZE", "100"))
+
+# Orphaned uploads GC (chatbot/core/orphan_gc.py)
+GC_INTERVAL = int(os.getenv("GC_INTERVAL", "21600"))  # seconds between runs
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "200"))
+GC_BATCH_PAUSE = float(os.getenv("GC_BATCH_PAUSE", "0.5"))  # seconds between batches, spares Mongo
+GC_GRACE_HOURS = float(os.getenv("GC_GRACE_HOURS", "24"))  # leave recent uploads/stores alone
+GC_STORE_DELETES_PER_MINUTE = float(os.getenv("GC_STORE_DELETES_PER_MINUTE", "30"))
+
+# PDF upload
+MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes read per step when streaming an upload into GridFS
+MAX_BATCH_UPLOAD_FILES = int(os.getenv("MAX_BATCH_UPLOAD_FILES", "50"))  # files per /chat/upload/batch request
+
+# Watcher (background PDF vectorisation)
+WATCHER_WORKERS = int(os.getenv("WATCHER_WORKERS", "4"))  # concurrent processing threads
+WATCHER_MAX_QUEUED = int(os.getenv("WATCHER_MAX_QUEUED", "100"))  # jobs waiting + in flight
+WATCHER_MAX_QUEUED_PER_USER = int(os.getenv("WATCHER_MAX_QUEUED_PER_USER", "10"))  # fairness cap per user
+WATCHER_LEASE_SECONDS = int(os.getenv("WATCHER_LEASE_SECONDS", "120"))  # claim expiry without heartbeat
+WATCHER_MAX_ATTEMPTS = int(os.getenv("WATCHER_MAX_ATTEMPTS", "5"))  # tries before a file is dead-lettered
+WATCHER_RETRY_BASE_SECONDS = float(os.getenv("WATCHER_RETRY_BASE_SECONDS", "30"))  # first retry delay, doubled per attempt
+WATCHER_RETRY_MAX_SECONDS = float(os.getenv("WATCHER_RETRY_MAX_SECONDS", "3600"))  # backoff cap
+WATCHER_POLL_MIN_INTERVAL = float(os.getenv("WATCHER_POLL_MIN_INTERVAL", "1"))  # safety-net scan while busy
+WATCHER_POLL_MAX_INTERVAL = float(os.getenv("WATCHER_POLL_MAX_INTERVAL", "60"))  # scan backs off to this when idle
+WATCHER_SPOOL_DIR = os.getenv("WATCHER_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "lexmind-spool")
+WATCHER_SPOOL_BUFFER_SIZE = int(os.getenv("WATCHER_SPOOL_BUFFER_SIZE", str(1024 * 1024)))  # bytes per GridFS -> disk copy step
+WATCHER_SPOOL_QUOTA_MB = int(os.getenv("WATCHER_SPOOL_QUOTA_MB", "512"))  # disk budget shared by all workers
+
+# Uploaded file_search_store liveness checks
+STORE_LIVENESS_TTL = int(os.getenv("STORE_LIVENESS_TTL", "3600"))  # seconds a successful check stays valid
+
+# Fan-out retrieval over many uploaded stores
+RAG_STORE_GROUP_SIZE = int(os.getenv("RAG_STORE_GROUP_SIZE", "4"))  # stores per FileSearch call
+RAG_FANOUT_WORKERS = int(os.getenv("RAG_FANOUT_WORKERS", "8"))  # concurrent FileSearch calls
+RAG_STORE_TIMEOUT = float(os.getenv("RAG_STORE_TIMEOUT", "8"))  # seconds per group before its results are dropped
+
+# Local chunk index of uploaded PDFs (searchable before the Google store is ready)
+LOCAL_INDEX_CHUNK_CHARS = int(os.getenv("LOCAL_INDEX_CHUNK_CHARS", "1500"))  # max characters per chunk
+LOCAL_INDEX_TOP_K = int(os.getenv("LOCAL_INDEX_TOP_K", "5"))  # chunks returned per query
+LOCAL_INDEX_MIN_SCORE = float(os.getenv("LOCAL_INDEX_MIN_SCORE", "1.5"))  # textScore below this is noise
+
+# Corpus index build over DATA_DIR (python -m chatbot.setup_main_store.build_corpus_index)
+CORPUS_BUILD_WORKERS = int(os.getenv("CORPUS_BUILD_WORKERS", "0"))  # 0 = one process per CPU core
+CORPUS_WRITE_QUEUE_SIZE = int(os.getenv("CORPUS_WRITE_QUEUE_SIZE", "32"))  # extracted files waiting for the writer
+
+# Main law store sync (python -m chatbot.setup_main_store.setup_main_store)
+MAIN_STORE_MANIFEST = os.getenv("MAIN_STORE_MANIFEST") or str(DATA_DIR.parent / "main_store_manifest.json")
+MAIN_STORE_UPLOAD_CONCURRENCY = int(os.getenv("MAIN_STORE_UPLOAD_CONCURRENCY", "8"))  # parallel uploads
+MAIN_STORE_UPLOADS_PER_MINUTE = float(os.getenv("MAIN_STORE_UPLOADS_PER_MINUTE", "60"))  # provider quota
+MAIN_STORE_UPLOAD_RETRIES = int(os.getenv("MAIN_STORE_UPLOAD_RETRIES", "5"))  # per file, on 429 / 5xx
@@ -0,0 +1,164 @@
+"""
+Archival of idle sessions into a compressed cold collection.
+
+A background job moves sessions whose `updated_at` is older than SESSION_ARCHIVE_AFTER_DAYS
+from `sessions` into `sessions_archive`, where the whole `messages` array is stored as one
+zlib-compressed BSON blob. Readers rehydrate archived sessions with `load_archived_session`;
+a new message for an archived session restores it to the hot collection.
+
+Run once: python -m chatbot.core.archive
+"""
+import threading
+import zlib
+from datetime import datetime, timezone, timedelta
+
+import bson
+from bson.binary import Binary
+from pymongo import ReplaceOne, UpdateOne
+
+from chatbot.config import config as app_config
+from chatbot.core.db import get_mongo_collection
+
+ARCHIVE_COLLECTION = "sessions_archive"
+ARCHIVE_CODEC = "zlib+bson"
+
+
+def _compress_messages(messages: list) -> Binary:
+    return Binary(zlib.compress(bson.encode({"messages": messages}), 6))
+
+
+def _decompress_messages(blob) -> list:
+    return bson.decode(zlib.decompress(bytes(blob))).get("messages", [])
+
+
+def _to_archive_doc(session: dict) -> dict:
+    messages = session.get("messages", [])
+    return {
+        "_id": session["_id"],
+        "session_id": session["session_id"],
+        "user_id": session.get("user_id"),
+        "title": session.get("title"),
+        "created_at": session.get("created_at"),
+        "updated_at": session.get("updated_at"),
+        "num_messages": len(messages),
+        "codec": ARCHIVE_CODEC,
+        "messages_blob": _compress_messages(messages),
+        "archived_at": datetime.now(timezone.utc),
+    }
+
+
+def archive_idle_sessions(max_age_days: int = app_config.SESSION_ARCHIVE_AFTER_DAYS,
+                          batch_size: int = app_config.SESSION_ARCHIVE_BATCH_SIZE,
+                          stop_event: threading.Event | None = None) -> int:
+    """
+    Move sessions idle for more than max_age_days into the archive, batch by batch.
+    A session that receives a message while being archived stays hot.
+    Returns the number of archived sessions.
+    """
+    hot = get_mongo_collection("sessions")
+    cold = get_mongo_collection(ARCHIVE_COLLECTION)
+    if hot is None or cold is None:
+        return 0
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    archived = 0
+    while stop_event is None or not stop_event.is_set():
+        batch = list(hot.find({"updated_at": {"$lt": cutoff}}).limit(batch_size))
+        if not batch:
+            break
+        ids = [s["_id"] for s in batch]
+
+        # 1. Write cold copies first so a crash never loses a session
+        cold.bulk_write([
+            ReplaceOne({"_id": s["_id"]}, _to_archive_doc(s), upsert=True) for s in batch
+        ], ordered=False)
+
+        # 2. Remove hot copies that are still idle
+        result = hot.delete_many({"_id": {"$in": ids}, "updated_at": {"$lt": cutoff}})
+        archived += result.deleted_count
+
+        # 3. Sessions touched in the meantime stay hot: drop their cold copies
+        if result.deleted_count < len(ids):
+            still_hot = [s["_id"] for s in hot.find({"_id": {"$in": ids}}, {"_id": 1})]
+            if still_hot:
+                cold.delete_many({"_id": {"$in": still_hot}})
+
+        if len(batch) < batch_size:
+            break
+    return archived
+
+
+def load_archived_session(session_id: str, user_id: str) -> dict | None:
+    """Rehydrate an archived session into the same shape as a `sessions` document."""
+    cold = get_mongo_collection(ARCHIVE_COLLECTION)
+    if cold is None:
+        return None
+    doc = cold.find_one({"session_id": session_id, "user_id": user_id})
+    if not doc:
+        return None
+    doc["messages"] = _decompress_messages(doc.pop("messages_blob", b""))
+    doc["archived"] = True
+    return doc
+
+
+def restore_sessions(session_ids: list[str]) -> int:
+    """
+    Move archived sessions back into the hot collection, ahead of any messages that were
+    just written for them (called when a new turn upserts a session that is archived).
+    Returns the number of restored sessions.
+    """
+    hot = get_mongo_collection("sessions")
+    cold = get_mongo_collection(ARCHIVE_COLLECTION)
+    if hot is None or cold is None or not session_ids:
+        return 0
+    docs = list(cold.find({"session_id": {"$in": list(session_ids)}}))
+    if not docs:
+        return 0
+    ops = []
+    for doc in docs:
+        messages = _decompress_messages(doc.get("messages_blob", b""))
+        ops.append(UpdateOne(
+            {"session_id": doc["session_id"]},
+            {
+                "$push": {"messages": {"$each": messages, "$position": 0}},
+                "$set": {"title": doc.get("title"), "created_at": doc.get("created_at")}
+            },
+            upsert=True
+        ))
+    hot.bulk_write(ops, ordered=False)
+    cold.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    return len(docs)
+
+
+class SessionArchiver:
+    def __init__(self, interval: int = app_config.SESSION_ARCHIVE_INTERVAL):
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                count = archive_idle_sessions(stop_event=self._stop_event)
+                if count:
+                    print(f"🗄️ [Archive] Đã lưu trữ {count} phiên không hoạt động.")
+            except Exception as e:
+                print(f"❌ [Archive] Lỗi lưu trữ phiên: {e}")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread and self.thread.is_alive(): return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="session-archiver")
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# Singleton
+app_session_archiver = SessionArchiver()
+
+
+if __name__ == "__main__":
+    print(f"[core.archive] Archived {archive_idle_sessions()} sessions.")
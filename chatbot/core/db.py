@@ -1,6 +1,7 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient
 import gridfs
 from chatbot.config import config as app_config
+from chatbot.core.indexes import ensure_indexes
 
 _mongo_client = None
 _mongo_db = None
@@ -16,42 +17,11 @@ def init_db():
         _mongo_client.admin.command('ping')
         _mongo_db = _mongo_client[app_config.MONGO_DB_NAME]
         DB_COLLECTION = _mongo_db.get_collection("sessions")
-        FS = gridfs.GridFS(_mongo_db)
-        # safe index ops
-        try:
-            DB_COLLECTION.create_index([("session_id", ASCENDING)], unique=True)
-        except Exception:
-            pass
-        try:
-            DB_COLLECTION.create_index([("updated_at", DESCENDING)])
-        except Exception:
-            pass
-        # documents collection
         DB_DOCUMENTS_COLLECTION = _mongo_db.get_collection("documents")
-        try:
-            existing_indexes = DB_DOCUMENTS_COLLECTION.index_information()
-            for idx_name, idx_info in existing_indexes.items():
-                # remove legacy unique file_hash if exists
-                if idx_name.startswith("file_hash_") and idx_info.get("unique", False):
-                    try:
-                        DB_DOCUMENTS_COLLECTION.drop_index(idx_name)
-                    except Exception:
-                        pass
-            # create non-unique file_hash index
-            try:
-                DB_DOCUMENTS_COLLECTION.create_index([("file_hash", 1)], name="file_hash_idx", background=True)
-            except Exception:
-                pass
-        except Exception:
-            # if documents collection not ready, ignore
-            pass
-        
-        # users collection
         DB_USERS_COLLECTION = _mongo_db.get_collection("users")
-        try:
-            DB_USERS_COLLECTION.create_index([("email", ASCENDING)], unique=True)
-        except Exception:
-            pass
+        FS = gridfs.GridFS(_mongo_db)
+        # safe index ops (see chatbot.core.indexes)
+        ensure_indexes(_mongo_db)
         
         print("[core.db] MongoDB initialized.")
     except Exception as e:
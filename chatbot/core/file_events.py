@@ -0,0 +1,159 @@
+"""
+File status events over Redis pub/sub.
+
+Every status transition of a `documents` row (uploaded -> processing -> processed /
+retry / dead_letter) is published on `file_status:{user_id}`, so SSE clients waiting
+on their uploads are pushed updates instead of polling the status endpoint.
+
+Each API process holds a single Redis subscription (FileStatusHub) and fans events out
+to per-client asyncio queues, so open SSE streams do not each cost a Redis connection.
+"""
+import asyncio
+import json
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from chatbot.config import config as app_config
+from chatbot.core.cache import app_cache
+from chatbot.core.db import get_mongo_collection
+
+TERMINAL_STATUSES = ("processed", "dead_letter", "error", "error_processing")
+CHANNEL_PREFIX = "file_status:"
+SUBSCRIBER_QUEUE_SIZE = 100  # events buffered per SSE client before the oldest is dropped
+
+
+def file_status_channel(user_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def publish_file_status(doc_id, status: str, user_id: str | None = None, **fields):
+    """
+    Publish a status transition. user_id is looked up when the caller does not have it.
+    Never raises: a missing event only means clients fall back to their next poll.
+    """
+    client = getattr(app_cache, "client", None)
+    if client is None:
+        return
+    try:
+        if user_id is None:
+            coll = get_mongo_collection("documents")
+            oid = ObjectId(doc_id) if isinstance(doc_id, str) else doc_id
+            doc = coll.find_one({"_id": oid}, {"user_id": 1}) if coll is not None else None
+            if not doc:
+                return
+            user_id = doc.get("user_id")
+        event = {"file_id": str(doc_id), "status": status, **{k: v for k, v in fields.items() if v is not None}}
+        client.publish(file_status_channel(user_id), json.dumps(event, default=_json_default, ensure_ascii=False))
+    except Exception as e:
+        print(f"[core.file_events] Publish error: {e}")
+
+
+class FileStatusHub:
+    def __init__(self, redis_url: str | None):
+        self.redis_url = redis_url
+        self._subscribers = {}  # user_id -> set of asyncio.Queue
+        self._redis = None
+        self._task = None
+        self._ready = None
+        self._lock = None
+
+    async def _ensure_listener(self) -> bool:
+        if self._task is not None and not self._task.done():
+            return True
+        if not self.redis_url:
+            return False
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._task is None or self._task.done():
+                self._ready = asyncio.Event()
+                self._task = asyncio.create_task(self._listen())
+        try:
+            # Subscribed before the caller reads its snapshot, so no transition is missed
+            await asyncio.wait_for(self._ready.wait(), timeout=5.0)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _listen(self):
+        import redis.asyncio as aioredis
+
+        backoff = 1.0
+        while True:  # lives as long as the process: one connection, however many clients
+            pubsub = None
+            try:
+                if self._redis is None:
+                    self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+                pubsub = self._redis.pubsub()
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        self._ready.set()
+                        backoff = 1.0
+                    elif message["type"] == "pmessage":
+                        self._dispatch(message["channel"][len(CHANNEL_PREFIX):], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[core.file_events] Subscriber error: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, user_id: str, data: str):
+        try:
+            event = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        for queue in list(self._subscribers.get(user_id, ())):
+            if queue.full():
+                queue.get_nowait()  # slow client: drop its oldest event
+            queue.put_nowait(event)
+
+    async def subscribe(self, user_id: str) -> asyncio.Queue | None:
+        """Queue receiving the user's status events, or None when Redis is unavailable."""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        if await self._ensure_listener():
+            return queue
+        self.unsubscribe(user_id, queue)
+        return None
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    async def close(self):
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._redis is not None:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
+            self._redis = None
+
+
+# Singleton (one subscription per API process)
+app_file_status_hub = FileStatusHub(app_config.REDIS_URL)
@@ -1,54 +1,550 @@
 import os
+import time
 import uuid
-from datetime import datetime
+import random
+import hashlib
+from datetime import datetime, timezone, timedelta
 from bson.objectid import ObjectId
-from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS
-from chatbot.core.utils import compute_file_hash
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, AutoReconnect, BulkWriteError
+from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS, get_mongo_collection
+from chatbot.core.local_index import copy_document_chunks
+from chatbot.core.utils import is_retryable_error, is_not_found_error
+from chatbot.core.file_events import publish_file_status
+from chatbot.config import config as app_config
+
+PDF_MAGIC = b"%PDF-"
+
+# Ingestion failures: transient ones are retried with backoff, the rest are dead-lettered
+DEAD_LETTER_STATUS = "dead_letter"
+FAILED_STATUSES = (DEAD_LETTER_STATUS, "error", "error_processing")  # last two: legacy terminal states
+
+# One consolidated file_search_store per session: session_id -> store_name
+SESSION_STORES_COLLECTION = "session_stores"
+SESSION_STORE_KIND = "session"
+STORE_OPERATION_POLL_INTERVAL = 2  # seconds between upload operation checks
+STORE_OPERATION_TIMEOUT = 600
+SESSION_STORE_ACQUIRE_ATTEMPTS = 5  # mapping re-reads when the store is released meanwhile
+# Bytes uploaded once to the Files API can be imported into other session stores until
+# the file expires (48 h); the margin keeps an import from racing the expiry
+FILE_RESOURCE_TTL = timedelta(hours=48)
+FILE_RESOURCE_MARGIN = timedelta(hours=1)
+
+
+class UploadValidationError(ValueError):
+    """Upload rejected while streaming (not a PDF, too large, empty)."""
+
+
+class FileResourceUnavailable(RuntimeError):
+    """An earlier Files API upload could not be imported and there is no local copy to send."""
+
+
+def find_reusable_store(file_hash: str) -> str | None:
+    """
+    Return a processed single-file file_search_store that already indexes these exact
+    bytes, if any. Session stores are never shared: they hold other files of the session;
+    duplicates going into a session store reuse the uploaded bytes instead (find_file_resource).
+    """
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None or not file_hash:
+        return None
+    doc = coll.find_one(
+        {
+            "file_hash": file_hash,
+            "status": "processed",
+            "file_store_name": {"$exists": True, "$ne": None},
+            "store_kind": {"$ne": SESSION_STORE_KIND},
+            "store_dead": {"$ne": True}
+        },
+        {"file_store_name": 1}
+    )
+    return doc.get("file_store_name") if doc else None
+
+
+def acquire_file_store(store_name: str, file_hash: str | None = None):
+    """
+    Add one reference to a file_search_store (call before a document starts pointing at it).
+    Stores created before ref-counting are registered with their current document count.
+    """
+    registry = get_mongo_collection("file_stores")
+    if registry is None or not store_name:
+        return
+    if registry.find_one({"_id": store_name}, {"_id": 1}) is None:
+        existing_refs = DB_DOCUMENTS_COLLECTION.count_documents({"file_store_name": store_name})
+        try:
+            registry.insert_one({
+                "_id": store_name,
+                "file_hash": file_hash,
+                "ref_count": existing_refs,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            pass
+    registry.update_one({"_id": store_name}, {"$inc": {"ref_count": 1}})
+
+
+def release_file_store(store_name: str, genai_client=None, document_name: str | None = None) -> bool:
+    """
+    Drop one reference to a file_search_store (call after the referencing document is gone).
+    When no document uses the store any more it is deleted on Google and unregistered;
+    otherwise `document_name` (the file inside a shared session store) is removed from it.
+    Returns True if the store was deleted.
+    """
+    registry = get_mongo_collection("file_stores")
+    if registry is None or not store_name:
+        return False
+    entry = registry.find_one_and_update(
+        {"_id": store_name},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if entry is not None:
+        if entry.get("ref_count", 0) > 0:
+            if document_name and genai_client is not None:
+                try:
+                    genai_client.file_search_stores.documents.delete(name=document_name, config={"force": True})
+                except Exception as e:
+                    print(f"[core.file_store.release_file_store] {document_name}: {e}")
+            return False
+    elif DB_DOCUMENTS_COLLECTION.count_documents({"file_store_name": store_name}) > 0:
+        # Unregistered legacy store still referenced
+        return False
+    if genai_client is not None:
+        try:
+            genai_client.file_search_stores.delete(name=store_name, config={"force": True})
+        except Exception as e:
+            print(f"[core.file_store.release_file_store] {store_name}: {e}")
+            return False
+    registry.delete_one({"_id": store_name, "ref_count": {"$lte": 0}})
+    session_stores = get_mongo_collection(SESSION_STORES_COLLECTION)
+    if session_stores is not None:
+        session_stores.delete_one({"store_name": store_name})
+    print(f"[core.file_store] Deleted unused store {store_name}")
+    return True
+
+
+def _acquire_live_store(registry, store_name: str, file_hash: str | None) -> bool:
+    """
+    Add one reference to a store that still holds one. At zero a concurrent
+    release_file_store may already be deleting it, so it is never revived.
+    An unregistered store still used by documents is registered with that count.
+    """
+    if registry.find_one_and_update({"_id": store_name, "ref_count": {"$gt": 0}}, {"$inc": {"ref_count": 1}}):
+        return True
+    if registry.find_one({"_id": store_name}, {"_id": 1}) is not None:
+        return False
+    existing_refs = DB_DOCUMENTS_COLLECTION.count_documents({"file_store_name": store_name})
+    if existing_refs == 0:
+        return False
+    try:
+        registry.insert_one({
+            "_id": store_name,
+            "file_hash": file_hash,
+            "ref_count": existing_refs + 1,
+            "created_at": datetime.now(timezone.utc)
+        })
+        return True
+    except DuplicateKeyError:
+        return registry.find_one_and_update(
+            {"_id": store_name, "ref_count": {"$gt": 0}}, {"$inc": {"ref_count": 1}}
+        ) is not None
+
+
+def acquire_session_store(genai_client, session_id: str, file_hash: str | None = None) -> str:
+    """
+    Return the consolidated file_search_store of a session with one reference already held
+    (drop it with release_file_store), creating the store on first use. The reference is
+    taken before the store is used: a store whose last reference is being released is
+    replaced by a new one instead of being written to after its deletion.
+    Concurrent creators race on the session_stores _id; the loser deletes its store.
+    """
+    coll = get_mongo_collection(SESSION_STORES_COLLECTION)
+    registry = get_mongo_collection("file_stores")
+    if coll is None or registry is None:
+        raise RuntimeError("session_stores collection missing")
+    for _ in range(SESSION_STORE_ACQUIRE_ATTEMPTS):
+        entry = coll.find_one({"_id": session_id}, {"store_name": 1})
+        if entry:
+            if _acquire_live_store(registry, entry["store_name"], file_hash):
+                return entry["store_name"]
+            # Released meanwhile: drop the mapping so the session gets a new store
+            coll.delete_one({"_id": session_id, "store_name": entry["store_name"]})
+            continue
+        display_name = f"session-{session_id[:8]}-{uuid.uuid4().hex[:8]}"
+        store = genai_client.file_search_stores.create(config={"display_name": display_name})
+        now = datetime.now(timezone.utc)
+        registry.insert_one({"_id": store.name, "file_hash": file_hash, "ref_count": 1, "created_at": now})
+        try:
+            coll.insert_one({"_id": session_id, "store_name": store.name, "created_at": now})
+            return store.name
+        except DuplicateKeyError:
+            registry.delete_one({"_id": store.name})
+            try:
+                genai_client.file_search_stores.delete(name=store.name, config={"force": True})
+            except Exception:
+                pass
+    raise RuntimeError(f"Could not acquire a file_search_store for session {session_id}")
+
+
+def upload_to_store(genai_client, store_name: str, file_path: str, display_name: str) -> str | None:
+    """
+    Upload a file into a file_search_store and wait until it is indexed.
+    Returns the name of the document created inside the store (needed to remove it later).
+    """
+    operation = genai_client.file_search_stores.upload_to_file_search_store(
+        file=file_path,
+        file_search_store_name=store_name,
+        config={"display_name": display_name}
+    )
+    return _wait_store_operation(genai_client, operation, store_name, display_name)
+
+
+def import_to_store(genai_client, store_name: str, file_resource: str, display_name: str) -> str | None:
+    """Import a Files API file into a file_search_store and wait until it is indexed."""
+    operation = genai_client.file_search_stores.import_file(
+        file_search_store_name=store_name,
+        file_name=file_resource
+    )
+    return _wait_store_operation(genai_client, operation, store_name, display_name)
+
+
+def find_file_resource(file_hash: str) -> str | None:
+    """A Files API upload of these exact bytes that is still importable, if any."""
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None or not file_hash:
+        return None
+    doc = coll.find_one(
+        {
+            "file_hash": file_hash,
+            "file_resource": {"$exists": True},
+            "file_resource_expires_at": {"$gt": datetime.now(timezone.utc) + FILE_RESOURCE_MARGIN}
+        },
+        {"file_resource": 1},
+        sort=[("file_resource_expires_at", -1)]
+    )
+    return doc.get("file_resource") if doc else None
+
+
+def forget_file_resource(file_resource: str):
+    """Stop handing out a Files API upload that Google no longer has."""
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None or not file_resource:
+        return
+    coll.update_many(
+        {"file_resource": file_resource},
+        {"$unset": {"file_resource": "", "file_resource_expires_at": ""}}
+    )
+
+
+def index_into_store(genai_client, store_name: str, file_hash: str | None, file_path: str | None,
+                     display_name: str) -> tuple[str | None, dict]:
+    """
+    Index a file into a session store, importing an earlier upload of the same bytes when
+    one is still live so they are sent to Google only once. Without a live upload the file
+    at file_path goes to the Files API first and is then imported.
+    An upload Google reports as gone is forgotten; if the import fails without file_path,
+    FileResourceUnavailable tells the caller to fetch a local copy and try again.
+    Returns (document_name, fields to $set on the documents row).
+    """
+    file_resource = find_file_resource(file_hash)
+    if file_resource:
+        try:
+            return import_to_store(genai_client, store_name, file_resource, display_name), {}
+        except Exception as e:
+            if is_not_found_error(e):
+                forget_file_resource(file_resource)
+            if file_path is None:
+                raise FileResourceUnavailable(f"Import of {file_resource} failed: {e}") from e
+            print(f"[core.file_store] Import of {file_resource} failed, uploading again: {e}")
+    if file_path is None:
+        raise FileNotFoundError(f"No local copy of {display_name} to upload")
+    uploaded = genai_client.files.upload(
+        file=file_path,
+        config={"display_name": display_name, "mime_type": "application/pdf"}
+    )
+    expires_at = getattr(uploaded, "expiration_time", None) or datetime.now(timezone.utc) + FILE_RESOURCE_TTL
+    document_name = import_to_store(genai_client, store_name, uploaded.name, display_name)
+    return document_name, {"file_resource": uploaded.name, "file_resource_expires_at": expires_at}
+
+
+def _wait_store_operation(genai_client, operation, store_name: str, display_name: str) -> str | None:
+    deadline = time.monotonic() + STORE_OPERATION_TIMEOUT
+    while not operation.done:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Indexing {display_name} into {store_name} timed out")
+        time.sleep(STORE_OPERATION_POLL_INTERVAL)
+        operation = genai_client.operations.get(operation)
+    if getattr(operation, "error", None):
+        raise RuntimeError(f"Indexing {display_name} failed: {operation.error}")
+    return getattr(getattr(operation, "response", None), "document_name", None)
+
+
+def link_duplicate_store(doc_id: str, file_hash: str) -> str | None:
+    """
+    If another document with the same hash is already vectorised, point `doc_id` at
+    that store and mark it processed without re-uploading. Return the store name or None.
+    """
+    store_name = find_reusable_store(file_hash)
+    if not store_name:
+        return None
+    acquire_file_store(store_name, file_hash)
+    result = DB_DOCUMENTS_COLLECTION.update_one(
+        {"_id": ObjectId(doc_id), "status": {"$ne": "processed"}},
+        {
+            "$set": {"status": "processed", "file_store_name": store_name, "reused_store": True},
+            "$unset": {"lease_owner": "", "lease_expires_at": ""}
+        }
+    )
+    if result.modified_count == 0:
+        release_file_store(store_name)
+        return None
+    publish_file_status(doc_id, "processed", file_store_name=store_name)
+    return store_name
+
+
+class PdfUploadStream:
+    """
+    Stream a PDF into GridFS in one pass: each chunk is validated, hashed and written
+    as a GridFS chunk right away, so memory per upload stays constant.
+    The GridFS file is only committed by `commit()`, after the duplicate check.
+    """
+
+    def __init__(self, user_id: str, filename: str, max_bytes: int | None = None):
+        if FS is None or DB_DOCUMENTS_COLLECTION is None:
+            raise RuntimeError("DB or FS not ready.")
+        self.user_id = user_id
+        self.filename = filename
+        self.max_bytes = max_bytes or app_config.MAX_UPLOAD_SIZE_MB * 1024 * 1024
+        self.size = 0
+        self._hasher = hashlib.md5()
+        self._header = b""
+        self._grid_in = FS.new_file(filename=filename, metadata={"original_user": user_id})
+
+    def write(self, chunk: bytes):
+        """Raises UploadValidationError (after aborting the GridFS write) on a bad upload."""
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise UploadValidationError(f"File vượt quá giới hạn {self.max_bytes // (1024 * 1024)} MB")
+        if len(self._header) < len(PDF_MAGIC):
+            self._header += chunk[:len(PDF_MAGIC) - len(self._header)]
+            if not PDF_MAGIC.startswith(self._header):
+                self.abort()
+                raise UploadValidationError("File không phải PDF hợp lệ")
+        self._hasher.update(chunk)
+        self._grid_in.write(chunk)
+
+    @property
+    def file_hash(self) -> str:
+        return self._hasher.hexdigest()
+
+    def abort(self):
+        """Discard any GridFS chunks written so far."""
+        try:
+            self._grid_in.abort()
+        except Exception:
+            pass
+
+    def check_complete(self):
+        """Raises UploadValidationError if the stream ended before a full PDF header."""
+        if self._header != PDF_MAGIC:
+            self.abort()
+            raise UploadValidationError("File không phải PDF hợp lệ")
+
+    def close(self) -> str:
+        """Commit the streamed GridFS file and return its id as string."""
+        self._grid_in.close()
+        return str(self._grid_in._id)
+
+    def document(self, session_id: str, file_gridfs_id: str) -> dict:
+        """The documents row for this upload (not inserted)."""
+        return {
+            "user_id": self.user_id,
+            "session_id": session_id,
+            "filename": self.filename,
+            "file_gridfs_id": file_gridfs_id,
+            "file_hash": self.file_hash,
+            "file_size": self.size,
+            "created_at": datetime.now(timezone.utc),
+            "status": "uploaded"
+        }
+
+    def commit(self, session_id: str) -> str | None:
+        """
+        Finish the upload and insert the documents row. Return documents._id as string.
+        Deduplicate by file_hash per user: a known hash drops the streamed chunks and
+        reuses the existing GridFS blob.
+        """
+        self.check_complete()
+        coll = DB_DOCUMENTS_COLLECTION
+        file_hash = self.file_hash
+        try:
+            # check if same file already uploaded in this session
+            existing = coll.find_one({"file_hash": file_hash, "user_id": self.user_id, "session_id": session_id})
+            if existing:
+                self.abort()
+                return str(existing["_id"])
+            # reuse per-user same hash if exists
+            hash_existing = coll.find_one({"file_hash": file_hash, "user_id": self.user_id})
+            if hash_existing:
+                self.abort()
+                file_gridfs_id = hash_existing["file_gridfs_id"]
+            else:
+                file_gridfs_id = self.close()
+            doc = self.document(session_id, file_gridfs_id)
+            # Same bytes already vectorised: link the existing store, nothing to re-index
+            store_name = find_reusable_store(file_hash)
+            if store_name:
+                acquire_file_store(store_name, file_hash)
+                doc.update({"status": "processed", "file_store_name": store_name, "reused_store": True})
+            try:
+                result = coll.insert_one(doc)
+            except Exception:
+                if store_name:
+                    release_file_store(store_name)
+                raise
+            if store_name:
+                # Never goes through the watcher: reuse the local chunks of the same bytes
+                try:
+                    copy_document_chunks(file_hash, doc)
+                except Exception as e:
+                    print(f"[core.file_store.PdfUploadStream.commit] Copy chunks: {e}")
+            return str(result.inserted_id)
+        except Exception as e:
+            print(f"[core.file_store.PdfUploadStream.commit] {e}")
+            self.abort()
+            return None
+
+
+def commit_uploads(uploads: list[PdfUploadStream], session_id: str) -> list[dict]:
+    """
+    Batch counterpart of PdfUploadStream.commit for uploads of one user: known hashes are
+    looked up with a single query and all new rows are written with one insert_many.
+    Returns one result per upload, in order: {"file_id", "status"} or {"error"}.
+    `status` is "uploaded" (queued for the watcher), "processed" (store reused) or
+    "duplicate" (already in this session).
+    """
+    results = [None] * len(uploads)
+    complete = []
+    for i, upload in enumerate(uploads):
+        try:
+            upload.check_complete()
+            complete.append((i, upload))
+        except UploadValidationError as e:
+            results[i] = {"error": str(e)}
+    if not complete:
+        return results
+
+    coll = DB_DOCUMENTS_COLLECTION
+    user_id = complete[0][1].user_id
+    hashes = list({upload.file_hash for _, upload in complete})
+    in_session, blobs = {}, {}
+    for doc in coll.find({"user_id": user_id, "file_hash": {"$in": hashes}},
+                         {"file_hash": 1, "session_id": 1, "file_gridfs_id": 1}):
+        blobs.setdefault(doc["file_hash"], doc["file_gridfs_id"])
+        if doc.get("session_id") == session_id:
+            in_session.setdefault(doc["file_hash"], str(doc["_id"]))
+
+    rows, owners, new_blobs = [], [], []
+    row_by_hash = {}  # the same bytes twice in one batch share a row
+    for i, upload in complete:
+        file_hash = upload.file_hash
+        if file_hash in in_session:
+            upload.abort()
+            results[i] = {"file_id": in_session[file_hash], "status": "duplicate"}
+            continue
+        if file_hash in row_by_hash:
+            upload.abort()
+            owners[row_by_hash[file_hash]].append(i)
+            continue
+        try:
+            if file_hash in blobs:
+                upload.abort()
+                file_gridfs_id = blobs[file_hash]
+            else:
+                file_gridfs_id = upload.close()
+                new_blobs.append(file_gridfs_id)
+        except Exception as e:
+            upload.abort()
+            results[i] = {"error": str(e)}
+            continue
+        doc = upload.document(session_id, file_gridfs_id)
+        store_name = find_reusable_store(file_hash)
+        if store_name:
+            acquire_file_store(store_name, file_hash)
+            doc.update({"status": "processed", "file_store_name": store_name, "reused_store": True})
+        row_by_hash[file_hash] = len(rows)
+        rows.append(doc)
+        owners.append([i])
+
+    failed = {}  # row index -> error
+    if rows:
+        try:
+            coll.insert_many(rows, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed[err["index"]] = err.get("errmsg", "insert failed")
+        except Exception as e:
+            print(f"[core.file_store.commit_uploads] {e}")
+            failed = {k: str(e) for k in range(len(rows))}
+
+    for k, doc in enumerate(rows):
+        if k in failed:
+            if doc.get("file_store_name"):
+                release_file_store(doc["file_store_name"])
+            if doc["file_gridfs_id"] in new_blobs:
+                try:
+                    FS.delete(ObjectId(doc["file_gridfs_id"]))
+                except Exception:
+                    pass
+            result = {"error": failed[k]}
+        else:
+            if doc.get("reused_store"):
+                try:
+                    copy_document_chunks(doc["file_hash"], doc)
+                except Exception as e:
+                    print(f"[core.file_store.commit_uploads] Copy chunks: {e}")
+            result = {"file_id": str(doc["_id"]), "status": doc["status"]}
+        for i in owners[k]:
+            results[i] = result
+    return results
+
 
 def save_pdf_to_mongo(file_path: str, session_id: str, user_id: str, original_filename: str = None) -> str | None:
     """
     Save PDF into GridFS + documents collection. Return documents._id as string.
     Deduplicate by file_hash per user.
     """
-    fs_client = FS
-    coll = DB_DOCUMENTS_COLLECTION
-    if fs_client is None or coll is None:
+    if FS is None or DB_DOCUMENTS_COLLECTION is None:
         print("[core.file_store] DB or FS not ready.")
         return None
     try:
-        file_hash = compute_file_hash(file_path)
         # Use original filename if provided, otherwise fallback to basename
         file_name = original_filename or os.path.basename(file_path)
-        # check if same file already uploaded in this session
-        existing = coll.find_one({"file_hash": file_hash, "user_id": user_id, "session_id": session_id})
-        if existing:
-            return str(existing["_id"])
-        # reuse per-user same hash if exists
-        hash_existing = coll.find_one({"file_hash": file_hash, "user_id": user_id})
-        if hash_existing:
-            file_gridfs_id = hash_existing["file_gridfs_id"]
-        else:
-            with open(file_path, "rb") as f:
-                file_id = fs_client.put(f, filename=file_name, metadata={"original_user": user_id})
-            file_gridfs_id = str(file_id)
-        result = coll.insert_one({
-            "user_id": user_id,
-            "session_id": session_id,
-            "filename": file_name,
-            "file_gridfs_id": file_gridfs_id,
-            "file_hash": file_hash,
-            "created_at": datetime.now().isoformat(),
-            "status": "uploaded"
-        })
-        return str(result.inserted_id)
+        upload = PdfUploadStream(user_id, file_name)
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(app_config.UPLOAD_CHUNK_SIZE), b""):
+                upload.write(chunk)
+        return upload.commit(session_id)
     except Exception as e:
         print(f"[core.file_store.save_pdf_to_mongo] {e}")
         return None
 
-def process_and_vectorize_pdf(file_path: str, session_id: str, doc_id: str, genai_client):
+def process_and_vectorize_pdf(file_path: str | None, session_id: str, doc_id: str, genai_client,
+                              file_hash: str | None = None, lease_owner: str | None = None,
+                              display_name: str | None = None):
     """
-    Use Google GenAI client to create a file_search_store and upload file.
-    On success update doc.status -> processed and set file_store_name.
+    Use Google GenAI client to index the file into the session's file_search_store
+    (one store per session, created on the first upload). Bytes already uploaded for
+    another document with the same hash are imported instead; file_path may then be None,
+    and if that import fails FileResourceUnavailable is raised (nothing recorded) so the
+    caller can retry with a local copy.
+    On success update doc.status -> processed and set file_store_name; on failure the
+    attempt is recorded and retried later or dead-lettered (see record_processing_failure).
+    If a legacy single-file store for the same file_hash exists it is reused instead.
+    lease_owner: watcher claim; results are only written while the claim is still held.
     genai_client: instance genai.Client
     """
     coll = DB_DOCUMENTS_COLLECTION
@@ -56,33 +552,155 @@ def process_and_vectorize_pdf(file_path: str, session_id: str, doc_id: str, gena
     if coll is None or client is None:
         print("[core.file_store] DB or genai client not ready.")
         return
-    file_name = os.path.basename(file_path)
+    file_name = display_name or os.path.basename(file_path)
+    owned_filter = {"_id": ObjectId(doc_id)}
+    if lease_owner:
+        owned_filter["lease_owner"] = lease_owner
+    store_name = None
+    document_name = None
+    acquired = False
     try:
-        store_display_name = f"session-{session_id[:8]}-file-{doc_id[:8]}-{uuid.uuid4().hex[:8]}"
-        file_store = client.file_search_stores.create(config={'display_name': store_display_name})
-        client.file_search_stores.upload_to_file_search_store(
-            file=file_path,
-            file_search_store_name=file_store.name,
-            config={'display_name': file_name}
+        reused = link_duplicate_store(doc_id, file_hash) if file_hash else None
+        if reused:
+            print(f"[core.file_store] Reused store {reused} for {file_name}")
+            return
+        # Holds a reference while uploading so the store cannot be deleted under us
+        store_name = acquire_session_store(client, session_id, file_hash)
+        acquired = True
+        document_name, resource_fields = index_into_store(client, store_name, file_hash, file_path, file_name)
+        result = coll.update_one(
+            owned_filter,
+            {
+                "$set": {
+                    "status": "processed",
+                    "file_store_name": store_name,
+                    "file_store_document": document_name,
+                    "store_kind": SESSION_STORE_KIND,
+                    **resource_fields
+                },
+                "$unset": {"lease_owner": "", "lease_expires_at": "", "next_attempt_at": "", "error": ""}
+            }
         )
-        coll.update_one({"_id": ObjectId(doc_id)}, {"$set": {"status": "processed", "file_store_name": file_store.name}})
-        print(f"[core.file_store] Processed {file_name} -> {file_store.name}")
+        if result.matched_count == 0:
+            # Lease lost to another worker: drop the copy we just indexed
+            print(f"[core.file_store] Lease lost for {file_name}, removing it from {store_name}")
+            release_file_store(store_name, client, document_name)
+            return
+        publish_file_status(doc_id, "processed", file_store_name=store_name)
+        print(f"[core.file_store] Processed {file_name} -> {store_name}")
     except Exception as e:
         print(f"[core.file_store.process_and_vectorize_pdf] {e}")
+        if acquired:
+            release_file_store(store_name, client, document_name)
+        if isinstance(e, FileResourceUnavailable):
+            raise
         try:
-            coll.update_one({"_id": ObjectId(doc_id)}, {"$set": {"status": "error_processing", "error": str(e)}})
+            new_status = record_processing_failure(doc_id, e, lease_owner)
+            if new_status:
+                print(f"[core.file_store] {file_name} -> {new_status}")
         except Exception:
             pass
 
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff for the given attempt number, with jitter in [delay/2, delay]."""
+    delay = min(
+        app_config.WATCHER_RETRY_MAX_SECONDS,
+        app_config.WATCHER_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1))
+    )
+    return random.uniform(delay / 2, delay)
+
+
+def record_processing_failure(doc_id, error, lease_owner: str | None = None) -> str | None:
+    """
+    Record a failed processing attempt. Retryable errors put the document back to
+    'uploaded' with `next_attempt_at` in the future until WATCHER_MAX_ATTEMPTS is reached;
+    fatal errors and exhausted retries move it to the dead-letter status.
+    `attempts` is counted when the watcher claims the document.
+    Returns the new status, or None if the document (or its lease) is gone.
+    """
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None:
+        return None
+    owned_filter = {"_id": ObjectId(doc_id) if isinstance(doc_id, str) else doc_id}
+    if lease_owner:
+        owned_filter["lease_owner"] = lease_owner
+    doc = coll.find_one(owned_filter, {"attempts": 1, "user_id": 1})
+    if doc is None:
+        return None
+    attempts = max(1, doc.get("attempts", 0))
+    retryable = isinstance(error, AutoReconnect) or (isinstance(error, Exception) and is_retryable_error(error))
+    now = datetime.now(timezone.utc)
+    update = {"error": str(error), "last_error_at": now, "attempts": attempts}
+    if retryable and attempts < app_config.WATCHER_MAX_ATTEMPTS:
+        update.update({"status": "uploaded", "next_attempt_at": now + timedelta(seconds=retry_delay(attempts))})
+        unset = {"lease_owner": "", "lease_expires_at": ""}
+    else:
+        update["status"] = DEAD_LETTER_STATUS
+        unset = {"lease_owner": "", "lease_expires_at": "", "next_attempt_at": ""}
+    result = coll.update_one(owned_filter, {"$set": update, "$unset": unset})
+    if result.matched_count == 0:
+        return None
+    publish_file_status(
+        owned_filter["_id"], update["status"], doc.get("user_id"),
+        error=update["error"], attempts=attempts, next_attempt_at=update.get("next_attempt_at")
+    )
+    return update["status"]
+
+
+def requeue_document(doc_id: str, user_id: str) -> bool:
+    """
+    Put a failed document (or one waiting for its next retry) back in the queue right away,
+    with a fresh attempt budget. Returns False if it is not in a requeueable state.
+    """
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None:
+        return False
+    result = coll.update_one(
+        {
+            "_id": ObjectId(doc_id),
+            "user_id": user_id,
+            "$or": [{"status": {"$in": list(FAILED_STATUSES)}}, {"status": "uploaded"}]
+        },
+        {
+            "$set": {"status": "uploaded", "attempts": 0},
+            "$unset": {"next_attempt_at": "", "error": "", "error_msg": "", "last_error_at": ""}
+        }
+    )
+    if result.matched_count == 0:
+        return False
+    publish_file_status(doc_id, "uploaded", user_id, attempts=0)
+    return True
+
+
+def get_session_pending_documents(session_id: str) -> list:
+    """_id of the session's files whose store is not ready yet (still queued, processing or failed)."""
+    coll = DB_DOCUMENTS_COLLECTION
+    if coll is None:
+        return []
+    try:
+        cursor = coll.find(
+            {"session_id": session_id, "status": {"$ne": "processed"}, "deleted_at": {"$exists": False}},
+            {"_id": 1}
+        )
+        return [doc["_id"] for doc in cursor]
+    except Exception:
+        return []
+
+
 def get_session_file_stores(session_id: str) -> list[str]:
     """
-    Return list of file_store_name for the given session (processed files).
+    Return the distinct file_store_name values for the given session (processed files).
+    Usually a single consolidated session store, plus any reused single-file stores.
+    Stores found dead by the liveness check (store_dead) are left out.
     """
     coll = DB_DOCUMENTS_COLLECTION
     if coll is None:
         return []
     try:
-        cursor = coll.find({"session_id": session_id, "status": "processed"}, {"file_store_name": 1})
-        return [doc.get("file_store_name") for doc in cursor if doc.get("file_store_name")]
+        cursor = coll.find(
+            {"session_id": session_id, "status": "processed", "store_dead": {"$ne": True}},
+            {"file_store_name": 1}
+        )
+        return list(dict.fromkeys(doc.get("file_store_name") for doc in cursor if doc.get("file_store_name")))
     except Exception:
         return []
@@ -1,5 +1,9 @@
-from datetime import datetime
+import uuid
+from datetime import datetime, timezone
 from chatbot.core.db import get_mongo_collection
+from chatbot.core.write_buffer import app_session_writer
+from chatbot.core.recent_turns import app_recent_turns
+from chatbot.core.archive import load_archived_session, restore_sessions
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.chat_history import InMemoryChatMessageHistory
 
@@ -15,20 +19,35 @@ def save_session_message(
     image_gridfs_id: str | None = None,
     thinking_steps: list | None = None
 ):
-    coll = get_mongo_collection("sessions")
-    if coll is None:
-        print("[core.history] sessions collection missing.")
-        return
-    now = datetime.now().isoformat()
+    """
+    Record a chat turn. When the write-behind buffer is running the turn is queued and
+    flushed in batches; when the buffer is full it is written at once together with the
+    session's queued turns; without a running buffer it is written directly.
+    """
+    now = datetime.now(timezone.utc)
     message_data = {
+        "message_id": uuid.uuid4().hex,
         "question": question,
         "answer": answer,
         "image_gridfs_id": image_gridfs_id,
         "thinking_steps": thinking_steps,
         "timestamp": now
     }
+    if app_session_writer.enqueue(session_id, user_id, message_data):
+        app_recent_turns.append(user_id, session_id, message_data)
+        return
+    if app_session_writer.running:
+        # Buffer full: write now, behind this session's queued turns
+        app_session_writer.write_through(session_id, user_id, message_data)
+        app_recent_turns.append(user_id, session_id, message_data)
+        return
+
+    coll = get_mongo_collection("sessions")
+    if coll is None:
+        print("[core.history] sessions collection missing.")
+        return
     try:
-        coll.update_one(
+        result = coll.update_one(
             {"session_id": session_id},
             {
                 "$push": {"messages": message_data},
@@ -37,21 +56,78 @@ def save_session_message(
             },
             upsert=True
         )
+        if result.upserted_id is not None:
+            try:
+                restore_sessions([session_id])
+            except Exception as ex:
+                print(f"[core.history.save_session_message restore] {ex}")
     except Exception as e:
         print(f"[core.history.save_session_message] {e}")
         try:
             coll.update_one({"session_id": session_id}, {"$push": {"messages": message_data}, "$set": {"updated_at": now}}, upsert=True)
         except Exception as ex:
             print(f"[core.history.save_session_message fallback] {ex}")
+    app_recent_turns.append(user_id, session_id, message_data)
+
+def get_recent_messages(session_id: str, user_id: str, limit: int | None = None) -> dict | None:
+    """
+    Read a session's turns from the Redis recent-turns cache, falling back to Mongo
+    (and refilling the cache) on a miss. limit=None asks for the full history.
+    Returns {"messages", "total", "title", "created_at", "updated_at"} or None if the session does not exist.
+    """
+    cached = app_recent_turns.get(user_id, session_id)
+    if cached is not None:
+        num_cached = len(cached["messages"])
+        if num_cached >= cached["total"] or (limit is not None and num_cached >= limit):
+            return cached
 
-def load_session_messages(session_id: str, user_id: str, limit: int = 25):
     coll = get_mongo_collection("sessions")
     if coll is None:
-        return InMemoryChatMessageHistory()
-    session = coll.find_one({"session_id": session_id, "user_id": user_id})
+        return None
+    match = {"session_id": session_id, "user_id": user_id}
+    if limit is None:
+        session = coll.find_one(match)
+        if session:
+            session["total"] = len(session.get("messages", []))
+    else:
+        window = max(limit, app_recent_turns.max_turns)
+        result = list(coll.aggregate([
+            {"$match": match},
+            {"$limit": 1},
+            {"$project": {
+                "title": 1, "created_at": 1, "updated_at": 1,
+                "total": {"$size": {"$ifNull": ["$messages", []]}},
+                "messages": {"$slice": [{"$ifNull": ["$messages", []]}, -window]}
+            }}
+        ]))
+        session = result[0] if result else None
+
+    if session is None:
+        # Cold session: rehydrate from the compressed archive
+        session = load_archived_session(session_id, user_id)
+        if session:
+            session["total"] = len(session["messages"])
+
+    stored = session.get("messages", []) if session else []
+    messages = app_session_writer.merge_pending(session_id, user_id, stored)
+    if session is None and not messages:
+        return None
+
+    recent = {
+        "messages": messages,
+        "total": (session.get("total", 0) if session else 0) + len(messages) - len(stored),
+        "title": session.get("title") if session else None,
+        "created_at": session.get("created_at") if session else messages[0]["timestamp"],
+        "updated_at": messages[-1]["timestamp"] if len(messages) > len(stored) else session.get("updated_at"),
+    }
+    app_recent_turns.fill(user_id, session_id, **recent)
+    return recent
+
+def load_session_messages(session_id: str, user_id: str, limit: int = 25):
+    recent = get_recent_messages(session_id, user_id, limit=limit)
     memory = InMemoryChatMessageHistory()
-    if session and "messages" in session:
-        for msg in session["messages"][-limit:]:
+    if recent:
+        for msg in recent["messages"][-limit:]:
             if msg.get("question"):
                 memory.add_message(HumanMessage(content=msg.get("question")))
             if msg.get("answer"):
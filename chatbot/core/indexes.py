@@ -0,0 +1,173 @@
+"""
+Index management: one place that declares the indexes backing every hot query shape,
+plus an explain-based check that those queries are actually served by an index.
+
+Run `python -m chatbot.core.indexes` to (re)create indexes and print the plan report.
+"""
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# collection -> list of (keys, options)
+INDEX_SPECS = {
+    "sessions": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        # GET /sessions: filter by user, keyset sort on (updated_at, _id)
+        ([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+         {"name": "user_updated_idx"}),
+        # CLI list_sessions without a user filter
+        ([("updated_at", DESCENDING)], {}),
+    ],
+    "sessions_archive": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        # archived sessions are listed after the hot ones with the same keyset
+        ([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+         {"name": "user_updated_idx"}),
+    ],
+    "documents": [
+        ([("file_hash", ASCENDING)], {"name": "file_hash_idx"}),
+        # get_session_file_stores
+        ([("session_id", ASCENDING), ("status", ASCENDING)], {"name": "session_status_idx"}),
+        # GET /chat/files, tool_list_uploaded_files
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {"name": "user_created_idx"}),
+        # watcher polling + expired lease recovery
+        ([("status", ASCENDING), ("lease_expires_at", ASCENDING)], {"name": "status_lease_idx"}),
+        # store reference counting
+        ([("file_store_name", ASCENDING)], {"name": "file_store_name_idx", "sparse": True}),
+        # orphan GC: rows handed over by delete_session / delete_user, blob reference checks
+        ([("deleted_at", ASCENDING)], {"name": "deleted_at_idx", "sparse": True}),
+        ([("file_gridfs_id", ASCENDING)], {"name": "file_gridfs_id_idx"}),
+    ],
+    "document_chunks": [
+        # per-session lexical search (text index: one per collection, no stemming for Vietnamese)
+        ([("session_id", ASCENDING), ("text", TEXT)], {"name": "session_text_idx", "default_language": "none"}),
+        ([("doc_id", ASCENDING), ("seq", ASCENDING)], {"name": "doc_seq_idx"}),
+    ],
+    "corpus_chunks": [
+        ([("text", TEXT)], {"name": "text_idx", "default_language": "none"}),
+        # build_corpus_index replaces a file's chunks by source path
+        ([("source", ASCENDING), ("seq", ASCENDING)], {"name": "source_seq_idx"}),
+    ],
+    "fs.chunks": [
+        # orphan GC scans first chunks by file id (files_id_1_n_1 is created by GridFS itself)
+        ([("n", ASCENDING), ("files_id", ASCENDING)], {"name": "n_files_idx"}),
+    ],
+    "session_stores": [
+        # release_file_store unregisters a deleted session store by name
+        ([("store_name", ASCENDING)], {"name": "store_name_idx"}),
+    ],
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# name -> (collection, filter, sort) for the queries that must never collection-scan
+HOT_QUERIES = {
+    "sessions.list_by_user": (
+        "sessions", {"user_id": "__probe__"}, [("updated_at", DESCENDING), ("_id", DESCENDING)]
+    ),
+    "sessions.by_session_id": ("sessions", {"session_id": "__probe__"}, None),
+    "sessions.archive_candidates": (
+        "sessions", {"updated_at": {"$lt": datetime(1970, 1, 1, tzinfo=timezone.utc)}}, None
+    ),
+    "sessions_archive.list_by_user": (
+        "sessions_archive", {"user_id": "__probe__"}, [("updated_at", DESCENDING), ("_id", DESCENDING)]
+    ),
+    "documents.session_stores": ("documents", {"session_id": "__probe__", "status": "processed"}, None),
+    "documents.list_by_user": ("documents", {"user_id": "__probe__"}, [("created_at", DESCENDING)]),
+    "documents.watcher_pending": (
+        "documents", {"status": "uploaded", "next_attempt_at": {"$not": {"$gt": datetime(1970, 1, 1, tzinfo=timezone.utc)}}}, None
+    ),
+    "documents.watcher_expired_leases": (
+        "documents", {"status": "processing", "lease_expires_at": {"$lt": datetime(1970, 1, 1, tzinfo=timezone.utc)}}, None
+    ),
+}
+
+
+# documents indexes superseded by INDEX_SPECS entries
+SUPERSEDED_INDEXES = ("status_idx",)  # prefix of status_lease_idx
+
+
+def _drop_legacy_indexes(db):
+    """
+    Remove the legacy unique file_hash index (documents may now share a hash) and indexes
+    replaced by a wider one, which would only cost writes.
+    """
+    coll = db.get_collection("documents")
+    try:
+        existing_indexes = coll.index_information()
+    except Exception:
+        return
+    for idx_name, idx_info in existing_indexes.items():
+        if (idx_name.startswith("file_hash_") and idx_info.get("unique", False)) or idx_name in SUPERSEDED_INDEXES:
+            try:
+                coll.drop_index(idx_name)
+            except Exception:
+                pass
+
+
+def ensure_indexes(db):
+    """
+    Create every index declared in INDEX_SPECS. Safe to call on each startup.
+    """
+    if db is None:
+        return
+    _drop_legacy_indexes(db)
+    for coll_name, specs in INDEX_SPECS.items():
+        coll = db.get_collection(coll_name)
+        for keys, options in specs:
+            try:
+                coll.create_index(keys, background=True, **options)
+            except Exception as e:
+                print(f"[core.indexes] Could not create index {coll_name}{keys}: {e}")
+
+
+def _plan_stages(plan: dict) -> list[str]:
+    """Flatten the stage names of a (possibly nested) winning plan."""
+    stages = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        if "queryPlan" in node:
+            stack.append(node["queryPlan"])
+        if "inputStage" in node:
+            stack.append(node["inputStage"])
+        stack.extend(node.get("inputStages", []))
+    return stages
+
+
+def check_query_plans(db) -> dict:
+    """
+    Explain each HOT_QUERIES entry and report whether the winning plan uses an index.
+    Returns {query_name: {"indexed": bool, "stages": [...]}}.
+    """
+    report = {}
+    if db is None:
+        return report
+    for name, (coll_name, query, sort) in HOT_QUERIES.items():
+        try:
+            cursor = db.get_collection(coll_name).find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = cursor.limit(1).explain()
+            stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+            indexed = "COLLSCAN" not in stages and "SORT" not in stages
+            report[name] = {"indexed": indexed, "stages": stages}
+        except Exception as e:
+            report[name] = {"indexed": False, "stages": [], "error": str(e)}
+    return report
+
+
+if __name__ == "__main__":
+    from chatbot.core import db as core_db
+
+    ensure_indexes(core_db._mongo_db)
+    all_ok = True
+    for query_name, result in check_query_plans(core_db._mongo_db).items():
+        mark = "✅" if result["indexed"] else "❌"
+        all_ok = all_ok and result["indexed"]
+        print(f"{mark} {query_name}: {' <- '.join(result['stages']) or result.get('error')}")
+    raise SystemExit(0 if all_ok else 1)
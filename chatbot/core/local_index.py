@@ -0,0 +1,213 @@
+"""
+Local chunk index of uploaded PDFs.
+
+The watcher extracts each uploaded PDF with pymupdf4llm (Markdown, one entry per page),
+splits pages by heading and size, and stores the chunks in `document_chunks`. A compound
+text index (session_id + text) serves per-session lexical search straight from Mongo, so
+files are searchable a few seconds after upload without a generate_content call.
+
+Extracted pages are cached in `extraction_cache` by file_hash + extractor version
+(zlib-compressed JSON, like archived sessions), so the same bytes are parsed only once
+across users, re-ingestion and index rebuilds.
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+
+from bson.binary import Binary
+from pymongo.errors import DocumentTooLarge
+
+from chatbot.config import config as app_config
+from chatbot.core.db import get_mongo_collection
+from chatbot.core.pdf_text import EXTRACTOR_VERSION, extract_pdf_pages, chunk_pages
+
+CHUNKS_COLLECTION = "document_chunks"
+EXTRACTION_CACHE_COLLECTION = "extraction_cache"
+
+
+def _cache_key(file_hash: str) -> str:
+    return f"{file_hash}:{EXTRACTOR_VERSION}"
+
+
+def get_cached_pages(file_hash: str) -> list[dict] | None:
+    """Pages extracted earlier from the same bytes with the current extractor, or None."""
+    coll = get_mongo_collection(EXTRACTION_CACHE_COLLECTION)
+    if coll is None or not file_hash:
+        return None
+    try:
+        entry = coll.find_one({"_id": _cache_key(file_hash)}, {"pages_blob": 1})
+        if not entry:
+            return None
+        return json.loads(zlib.decompress(bytes(entry["pages_blob"])).decode("utf-8"))
+    except Exception as e:
+        print(f"[core.local_index] Extraction cache read error: {e}")
+        return None
+
+
+def get_cached_pages_many(file_hashes: list[str]) -> dict[str, list[dict]]:
+    """get_cached_pages for many hashes with one $in query: {file_hash: pages} for the hits."""
+    coll = get_mongo_collection(EXTRACTION_CACHE_COLLECTION)
+    hashes = [h for h in dict.fromkeys(file_hashes) if h]
+    if coll is None or not hashes:
+        return {}
+    found = {}
+    try:
+        for entry in coll.find({"_id": {"$in": [_cache_key(h) for h in hashes]}}, {"file_hash": 1, "pages_blob": 1}):
+            try:
+                found[entry["file_hash"]] = json.loads(zlib.decompress(bytes(entry["pages_blob"])).decode("utf-8"))
+            except Exception as e:
+                print(f"[core.local_index] Extraction cache entry {entry['_id']} unreadable: {e}")
+    except Exception as e:
+        print(f"[core.local_index] Extraction cache read error: {e}")
+    return found
+
+
+def store_cached_pages(file_hash: str, pages: list[dict]):
+    coll = get_mongo_collection(EXTRACTION_CACHE_COLLECTION)
+    if coll is None or not file_hash:
+        return
+    raw = json.dumps(pages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    try:
+        coll.replace_one(
+            {"_id": _cache_key(file_hash)},
+            {
+                "file_hash": file_hash,
+                "version": EXTRACTOR_VERSION,
+                "num_pages": len(pages),
+                "raw_size": len(raw),
+                "pages_blob": Binary(zlib.compress(raw, 6)),
+                "created_at": datetime.now(timezone.utc)
+            },
+            upsert=True
+        )
+    except DocumentTooLarge:
+        print(f"[core.local_index] Extraction of {file_hash} too large to cache")
+    except Exception as e:
+        print(f"[core.local_index] Extraction cache write error: {e}")
+
+
+def extract_pdf_pages_cached(file_path: str | None, file_hash: str | None) -> list[dict]:
+    """
+    Cached extract_pdf_pages: identical bytes (same file_hash) are parsed once per
+    extractor version. file_path may be None when the cache is known to be warm.
+    """
+    pages = get_cached_pages(file_hash) if file_hash else None
+    if pages is not None:
+        return pages
+    if not file_path:
+        raise RuntimeError(f"No cached extraction for {file_hash} and no file to parse")
+    pages = extract_pdf_pages(file_path)
+    if file_hash:
+        store_cached_pages(file_hash, pages)
+    return pages
+
+
+def has_cached_pages(file_hash: str) -> bool:
+    coll = get_mongo_collection(EXTRACTION_CACHE_COLLECTION)
+    if coll is None or not file_hash:
+        return False
+    return coll.count_documents({"_id": _cache_key(file_hash)}, limit=1) > 0
+
+
+def index_document(doc: dict, file_path: str | None = None) -> int:
+    """
+    (Re)build the chunks of one documents row, from the extraction cache when the same
+    bytes were parsed before, otherwise from its PDF on disk.
+    Returns the number of chunks stored.
+    """
+    chunks_coll = get_mongo_collection(CHUNKS_COLLECTION)
+    docs_coll = get_mongo_collection("documents")
+    if chunks_coll is None or docs_coll is None:
+        return 0
+    chunks = chunk_pages(extract_pdf_pages_cached(file_path, doc.get("file_hash")))
+    rows = [
+        {
+            "doc_id": doc["_id"],
+            "session_id": doc.get("session_id"),
+            "user_id": doc.get("user_id"),
+            "filename": doc.get("filename"),
+            "file_hash": doc.get("file_hash"),
+            "seq": i,
+            **chunk
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    chunks_coll.delete_many({"doc_id": doc["_id"]})
+    if rows:
+        chunks_coll.insert_many(rows, ordered=False)
+    docs_coll.update_one(
+        {"_id": doc["_id"]},
+        {"$set": {"local_index_status": "indexed", "chunk_count": len(rows),
+                  "local_indexed_at": datetime.now(timezone.utc)}}
+    )
+    return len(rows)
+
+
+def copy_document_chunks(file_hash: str, doc: dict) -> int:
+    """
+    Give a new documents row the chunks of an already indexed file with the same bytes
+    (duplicate uploads skip the watcher). Returns the number of chunks copied.
+    """
+    chunks_coll = get_mongo_collection(CHUNKS_COLLECTION)
+    docs_coll = get_mongo_collection("documents")
+    if chunks_coll is None or docs_coll is None or not file_hash:
+        return 0
+    source = docs_coll.find_one({"file_hash": file_hash, "local_index_status": "indexed"}, {"_id": 1})
+    if not source:
+        return 0
+    rows = [
+        {**chunk, "doc_id": doc["_id"], "session_id": doc.get("session_id"),
+         "user_id": doc.get("user_id"), "filename": doc.get("filename")}
+        for chunk in chunks_coll.find({"doc_id": source["_id"]}, {"_id": 0})
+    ]
+    if rows:
+        chunks_coll.insert_many(rows, ordered=False)
+    docs_coll.update_one(
+        {"_id": doc["_id"]},
+        {"$set": {"local_index_status": "indexed", "chunk_count": len(rows),
+                  "local_indexed_at": datetime.now(timezone.utc)}}
+    )
+    return len(rows)
+
+
+def search_session_chunks(session_id: str, query: str, limit: int = app_config.LOCAL_INDEX_TOP_K,
+                          doc_ids: list | None = None,
+                          min_score: float = app_config.LOCAL_INDEX_MIN_SCORE) -> list[dict]:
+    """
+    Text search over the session's chunks, best textScore first.
+    doc_ids restricts the search to those documents; hits below min_score are dropped
+    (without stemming, common syllables match almost any query).
+    """
+    coll = get_mongo_collection(CHUNKS_COLLECTION)
+    if coll is None or not query or doc_ids == []:
+        return []
+    flt = {"session_id": session_id, "$text": {"$search": query}}
+    if doc_ids is not None:
+        flt["doc_id"] = {"$in": list(doc_ids)}
+    try:
+        cursor = coll.find(
+            flt,
+            {"filename": 1, "page": 1, "heading": 1, "text": 1, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit)
+        return [hit for hit in cursor if hit.get("score", 0) >= min_score]
+    except Exception as e:
+        print(f"[core.local_index] Search error: {e}")
+        return []
+
+
+def format_chunks(chunks: list[dict]) -> str:
+    """Render search hits as cited excerpts for the agent."""
+    blocks = []
+    for chunk in chunks:
+        source = f"[{chunk.get('filename')} - trang {chunk.get('page')}]"
+        if chunk.get("heading"):
+            source += f" {chunk['heading']}"
+        blocks.append(f"{source}\n{chunk['text']}")
+    return "\n\n---\n\n".join(blocks)
+
+
+def delete_document_chunks(doc_ids: list) -> int:
+    coll = get_mongo_collection(CHUNKS_COLLECTION)
+    if coll is None or not doc_ids:
+        return 0
+    return coll.delete_many({"doc_id": {"$in": list(doc_ids)}}).deleted_count
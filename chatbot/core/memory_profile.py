@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from chatbot.core.db import get_mongo_collection
@@ -23,6 +24,8 @@ KẾT QUẢ (Chỉ trả về nội dung hồ sơ mới hoặc "SKIP"):
 class UserProfileMemory:
     def __init__(self, llm):
         self.llm = llm
+        # 1 worker: các lần cập nhật profile chạy tuần tự, không chặn luồng trả lời
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-update")
         # Tên collection lưu profile user
         self.collection = get_mongo_collection("users")
         self.chain = (
@@ -43,11 +46,20 @@ class UserProfileMemory:
 
     def update_profile_background(self, user_id: str, user_message: str):
         """
-        Hàm này phân tích tin nhắn để cập nhật profile user.
+        Đưa việc cập nhật profile vào luồng nền, trả về ngay.
         """
         if self.collection is None:
             return
+        try:
+            self._executor.submit(self._update_profile, user_id, user_message)
+        except RuntimeError:
+            # Executor đã shutdown (đang tắt ứng dụng)
+            pass
 
+    def _update_profile(self, user_id: str, user_message: str):
+        """
+        Hàm này phân tích tin nhắn để cập nhật profile user.
+        """
         current_profile = self.get_profile(user_id)
 
         try:
@@ -0,0 +1,184 @@
+"""
+One-off data migrations.
+
+normalize_timestamps: older code wrote `updated_at`, `created_at` and message `timestamp`
+as ISO strings while newer code writes BSON dates. Mixed BSON types sort inconsistently
+(all strings order after all dates), so convert every string timestamp to a BSON date.
+
+consolidate_session_stores: older code created one file_search_store per uploaded file.
+Re-index those files into the session's consolidated store and release the old stores.
+
+Run: python -m chatbot.core.migrations [timestamps|stores]
+"""
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone, timedelta
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+# Legacy strings came from naive datetime.now() on servers running in Vietnam time (UTC+7)
+LEGACY_TIMEZONE = timezone(timedelta(hours=7))
+BATCH_SIZE = 500
+
+
+def _to_date(value, source_tz=LEGACY_TIMEZONE):
+    """Parse an ISO string into a tz-aware datetime; return the value unchanged otherwise."""
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=source_tz)
+    return parsed
+
+
+def _flush(coll, ops: list) -> int:
+    if not ops:
+        return 0
+    result = coll.bulk_write(ops, ordered=False)
+    ops.clear()
+    return result.modified_count
+
+
+def _normalize_sessions(coll, source_tz) -> int:
+    modified = 0
+    ops = []
+    query = {"$or": [
+        {"updated_at": {"$type": "string"}},
+        {"created_at": {"$type": "string"}},
+        {"messages.timestamp": {"$type": "string"}},
+    ]}
+    for doc in coll.find(query, {"updated_at": 1, "created_at": 1, "messages": 1}):
+        update = {}
+        for field in ("updated_at", "created_at"):
+            if isinstance(doc.get(field), str):
+                update[field] = _to_date(doc[field], source_tz)
+        messages = doc.get("messages") or []
+        if any(isinstance(m.get("timestamp"), str) for m in messages):
+            update["messages"] = [
+                {**m, "timestamp": _to_date(m.get("timestamp"), source_tz)} for m in messages
+            ]
+        if update:
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if len(ops) >= BATCH_SIZE:
+            modified += _flush(coll, ops)
+    modified += _flush(coll, ops)
+    return modified
+
+
+def _normalize_documents(coll, source_tz) -> int:
+    modified = 0
+    ops = []
+    for doc in coll.find({"created_at": {"$type": "string"}}, {"created_at": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"created_at": _to_date(doc["created_at"], source_tz)}}))
+        if len(ops) >= BATCH_SIZE:
+            modified += _flush(coll, ops)
+    modified += _flush(coll, ops)
+    return modified
+
+
+def normalize_timestamps(db, source_tz=LEGACY_TIMEZONE) -> dict:
+    """
+    Convert string timestamps in `sessions` and `documents` into BSON dates.
+    Idempotent: only documents that still hold strings are touched.
+    Returns {collection_name: modified_count}.
+    """
+    if db is None:
+        return {}
+    return {
+        "sessions": _normalize_sessions(db.get_collection("sessions"), source_tz),
+        "documents": _normalize_documents(db.get_collection("documents"), source_tz),
+    }
+
+
+def _consolidate_document(coll, fs, doc, genai_client) -> bool:
+    from chatbot.core.file_store import (
+        acquire_session_store, release_file_store, upload_to_store, SESSION_STORE_KIND
+    )
+    from chatbot.config import config as app_config
+
+    old_store = doc["file_store_name"]
+    temp_path = None
+    try:
+        grid_out = fs.get(ObjectId(doc["file_gridfs_id"]))
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+            temp_path = tmp_file.name
+            shutil.copyfileobj(grid_out, tmp_file, app_config.WATCHER_SPOOL_BUFFER_SIZE)
+        # Hold a reference while uploading so the store cannot be deleted under us
+        store_name = acquire_session_store(genai_client, doc["session_id"], doc.get("file_hash"))
+        try:
+            document_name = upload_to_store(genai_client, store_name, temp_path, doc.get("filename") or temp_path)
+        except Exception:
+            release_file_store(store_name, genai_client)
+            raise
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+    result = coll.update_one(
+        {"_id": doc["_id"], "file_store_name": old_store},
+        {"$set": {
+            "file_store_name": store_name,
+            "file_store_document": document_name,
+            "store_kind": SESSION_STORE_KIND
+        }, "$unset": {"reused_store": ""}}
+    )
+    if result.matched_count == 0:
+        # Deleted or changed meanwhile: undo the copy
+        release_file_store(store_name, genai_client, document_name)
+        return False
+    release_file_store(old_store, genai_client)
+    return True
+
+
+def consolidate_session_stores(db, genai_client, session_id: str | None = None) -> dict:
+    """
+    Move processed files that still live in per-file stores into their session's store.
+    The old store is deleted once no document references it any more (stores shared by
+    duplicate uploads go away after the last session using them is migrated).
+    Idempotent: migrated documents carry store_kind="session".
+    Returns {"sessions": n, "documents": migrated, "failed": failed}.
+    """
+    from chatbot.core.db import FS
+    from chatbot.core.file_store import SESSION_STORE_KIND
+
+    counts = {"sessions": 0, "documents": 0, "failed": 0}
+    if db is None or genai_client is None or FS is None:
+        return counts
+    coll = db.get_collection("documents")
+    query = {
+        "status": "processed",
+        "file_store_name": {"$exists": True, "$ne": None},
+        "store_kind": {"$ne": SESSION_STORE_KIND}
+    }
+    if session_id:
+        query["session_id"] = session_id
+    for sid in coll.distinct("session_id", query):
+        counts["sessions"] += 1
+        for doc in coll.find({**query, "session_id": sid}):
+            try:
+                if _consolidate_document(coll, FS, doc, genai_client):
+                    counts["documents"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"[core.migrations] {doc.get('filename')} ({doc['_id']}): {e}")
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+    from chatbot.core import db as core_db
+
+    task = sys.argv[1] if len(sys.argv) > 1 else "timestamps"
+    if task == "stores":
+        import google.genai as genai
+        from chatbot.config import config as app_config
+
+        counts = consolidate_session_stores(core_db._mongo_db, genai.Client(api_key=app_config.GOOGLE_API_KEY))
+        print(f"[core.migrations] stores: {counts}")
+    else:
+        counts = normalize_timestamps(core_db._mongo_db)
+        for name, count in counts.items():
+            print(f"[core.migrations] {name}: normalized {count} documents")
@@ -0,0 +1,389 @@
+"""
+Garbage collection of orphaned upload data.
+
+Deleting a user or a session only marks its `documents` rows with `deleted_at`; this job
+does the expensive part in batches:
+- documents marked deleted (delete_session / delete_user) or owned by a user that no
+  longer exists. A missing session row alone is not enough: files are uploaded before
+  the session's first turn creates it, or without any session at all
+- their local chunks, their GridFS blobs once no document references them, and their
+  reference on the file_search_store (the store is deleted with its last reference)
+- GridFS uploads never committed to a documents row, chunks of deleted documents, and
+  session stores left without any document
+
+Remote store deletions are rate limited (GC_STORE_DELETES_PER_MINUTE). With dry_run
+nothing is written; the report counts what would be deleted.
+
+Run once: python -m chatbot.core.orphan_gc [--dry-run]
+"""
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+from chatbot.config import config as app_config
+from chatbot.core.db import get_mongo_collection
+
+SAMPLE_SIZE = 10  # ids kept per category in the report
+
+
+def mark_documents_deleted(query: dict) -> int:
+    """Hand documents matching `query` over to the collector. Returns the number marked."""
+    coll = get_mongo_collection("documents")
+    if coll is None:
+        return 0
+    result = coll.update_many(
+        {**query, "deleted_at": {"$exists": False}},
+        {"$set": {"deleted_at": datetime.now(timezone.utc)}}
+    )
+    return result.modified_count
+
+
+class _Throttle:
+    """Space out calls to at most `per_minute` per minute."""
+
+    def __init__(self, per_minute: float, stop_event: threading.Event | None = None):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.stop_event = stop_event
+        self._next = 0.0
+
+    def wait(self):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            if self.stop_event is not None:
+                self.stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+        self._next = time.monotonic() + self.interval
+
+
+class OrphanCollector:
+    def __init__(self, interval: int = app_config.GC_INTERVAL,
+                 batch_size: int = app_config.GC_BATCH_SIZE,
+                 grace_hours: float = app_config.GC_GRACE_HOURS,
+                 store_deletes_per_minute: float = app_config.GC_STORE_DELETES_PER_MINUTE,
+                 batch_pause: float = app_config.GC_BATCH_PAUSE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace_hours = grace_hours
+        self.store_deletes_per_minute = store_deletes_per_minute
+        self.batch_pause = batch_pause
+        self.genai_client = None
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    # ---------- helpers ----------
+
+    def _stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def _pause(self):
+        if self.batch_pause > 0:
+            self._stop_event.wait(self.batch_pause)
+
+    @staticmethod
+    def _count(report: dict, key: str, items: list):
+        report[key] += len(items)
+        samples = report["samples"].setdefault(key, [])
+        samples.extend(str(i) for i in items[:SAMPLE_SIZE - len(samples)])
+
+    def _get_genai_client(self):
+        if self.genai_client is None and app_config.GOOGLE_API_KEY:
+            import google.genai as genai
+            self.genai_client = genai.Client(api_key=app_config.GOOGLE_API_KEY)
+        return self.genai_client
+
+    def _live_values(self, docs, field: str):
+        """
+        Distinct `field` values of live documents, batch_size per page in ascending order.
+        Keyset paging on an aggregation keeps each reply small, unlike one distinct().
+        """
+        last = ""  # also skips missing / empty values
+        while not self._stopped():
+            page = [d["_id"] for d in docs.aggregate([
+                {"$match": {field: {"$gt": last}, "deleted_at": {"$exists": False}}},
+                {"$sort": {field: 1}},
+                {"$group": {"_id": f"${field}"}},
+                {"$sort": {"_id": 1}},
+                {"$limit": self.batch_size}
+            ], allowDiskUse=True)]
+            if not page:
+                break
+            last = page[-1]
+            yield page
+
+    def _missing_users(self, docs):
+        """Pages of document owners that are not in the users collection any more."""
+        users = get_mongo_collection("users")
+        for chunk in self._live_values(docs, "user_id"):
+            oids = []
+            for user_id in chunk:
+                try:
+                    oids.append(ObjectId(user_id))
+                except (InvalidId, TypeError):
+                    pass  # CLI users are not in the users collection
+            found = {str(u["_id"]) for u in users.find({"_id": {"$in": oids}}, {"_id": 1})}
+            missing = [str(o) for o in oids if str(o) not in found]
+            if missing:
+                yield missing
+            self._pause()
+
+    def _check_sessionless(self, docs, query: dict, report: dict):
+        """
+        Dry-run check: live uploads whose session has no row (no chat turn yet, or uploaded
+        without a session) must survive. Counts them, and any the sweep would still take.
+        """
+        for chunk in self._live_values(docs, "session_id"):
+            found = set()
+            for coll_name in ("sessions", "sessions_archive"):
+                found.update(s["session_id"] for s in get_mongo_collection(coll_name).find(
+                    {"session_id": {"$in": chunk}}, {"session_id": 1}
+                ))
+            missing = [s for s in chunk if s not in found]
+            if not missing:
+                continue
+            live = {"session_id": {"$in": missing}, "deleted_at": {"$exists": False}}
+            report["sessionless_kept"] += docs.count_documents({"$and": [live, {"$nor": [query]}]})
+            report["sessionless_collected"] += docs.count_documents({"$and": [live, query]})
+        if report["sessionless_collected"]:
+            print(f"[core.orphan_gc] {report['sessionless_collected']} session-less uploads would be "
+                  f"collected (owner missing?)")
+
+    # ---------- phases ----------
+
+    def _orphan_filter(self, docs, report: dict, dry_run: bool) -> dict:
+        """
+        Mark documents whose owner is gone; return the filter of collectable rows.
+        Deleted sessions are only known through the deleted_at marker set by delete_session.
+        """
+        orphaned = []
+        for missing_users in self._missing_users(docs):
+            report["missing_users"] += len(missing_users)
+            if dry_run:
+                orphaned.append({"user_id": {"$in": missing_users}})
+            else:
+                report["marked"] += mark_documents_deleted({"user_id": {"$in": missing_users}})
+        # 'processing' rows are left until the watcher lets go of them
+        return {"$or": [{"deleted_at": {"$exists": True}}, *orphaned], "status": {"$ne": "processing"}}
+
+    def _sweep_documents(self, docs, query: dict, report: dict, dry_run: bool, throttle: _Throttle):
+        from chatbot.core.db import FS
+        from chatbot.core.file_store import release_file_store
+        from chatbot.core.local_index import delete_document_chunks
+
+        last_id = None
+        while not self._stopped():
+            page = {**query, "_id": {"$gt": last_id}} if last_id else query
+            batch = list(docs.find(
+                page, {"file_gridfs_id": 1, "file_store_name": 1, "file_store_document": 1}
+            ).sort("_id", 1).limit(self.batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            ids = [d["_id"] for d in batch]
+
+            # Blobs and stores still used by a document outside this batch are kept
+            gridfs_ids = list({d["file_gridfs_id"] for d in batch if d.get("file_gridfs_id")})
+            shared = set(docs.distinct("file_gridfs_id", {"file_gridfs_id": {"$in": gridfs_ids}, "_id": {"$nin": ids}}))
+            blobs = [g for g in gridfs_ids if g not in shared]
+            store_refs = [d for d in batch if d.get("file_store_name")]
+
+            self._count(report, "documents", ids)
+            self._count(report, "blobs", blobs)
+            if dry_run:
+                chunks = get_mongo_collection("document_chunks")
+                report["chunks"] += chunks.count_documents({"doc_id": {"$in": ids}}) if chunks is not None else 0
+                stores = {d["file_store_name"] for d in store_refs}
+                in_use = set(docs.distinct("file_store_name", {"file_store_name": {"$in": list(stores)}, "_id": {"$nin": ids}}))
+                self._count(report, "stores", sorted(stores - in_use))
+                self._pause()
+                continue
+
+            # Rows first: a crash afterwards only leaves blobs/stores for the orphan scans
+            docs.delete_many({"_id": {"$in": ids}, "status": {"$ne": "processing"}})
+            report["chunks"] += delete_document_chunks(ids)
+            for gridfs_id in blobs:
+                try:
+                    FS.delete(ObjectId(gridfs_id))
+                except Exception:
+                    pass  # already gone
+            genai_client = self._get_genai_client()
+            for doc in store_refs:
+                throttle.wait()
+                if self._stopped():
+                    return
+                if release_file_store(doc["file_store_name"], genai_client, doc.get("file_store_document")):
+                    self._count(report, "stores", [doc["file_store_name"]])
+            self._pause()
+
+    def _sweep_blobs(self, cutoff, report: dict, dry_run: bool):
+        """Uploaded PDFs in GridFS that no documents row points at (upload died before insert)."""
+        from chatbot.core.db import FS
+
+        files = get_mongo_collection("fs.files")
+        docs = get_mongo_collection("documents")
+        query = {"metadata.original_user": {"$exists": True}, "uploadDate": {"$lt": cutoff}}
+        last_id = None
+        while not self._stopped():
+            page = {**query, "_id": {"$gt": last_id}} if last_id else query
+            batch = [f["_id"] for f in files.find(page, {"_id": 1}).sort("_id", 1).limit(self.batch_size)]
+            if not batch:
+                break
+            last_id = batch[-1]
+            referenced = set(docs.distinct("file_gridfs_id", {"file_gridfs_id": {"$in": [str(b) for b in batch]}}))
+            orphans = [b for b in batch if str(b) not in referenced]
+            self._count(report, "blobs", orphans)
+            if not dry_run:
+                for blob_id in orphans:
+                    try:
+                        FS.delete(blob_id)
+                    except Exception:
+                        pass
+            self._pause()
+
+        # Chunks of aborted uploads whose files entry was never written
+        chunks = get_mongo_collection("fs.chunks")
+        oldest = ObjectId.from_datetime(cutoff)
+        last_id = None
+        while not self._stopped():
+            query = {"n": 0, "files_id": {"$lt": oldest, **({"$gt": last_id} if last_id else {})}}
+            batch = [c["files_id"] for c in chunks.find(query, {"files_id": 1}).sort("files_id", 1).limit(self.batch_size)]
+            if not batch:
+                break
+            last_id = batch[-1]
+            known = {f["_id"] for f in files.find({"_id": {"$in": batch}}, {"_id": 1})}
+            orphans = [b for b in batch if b not in known]
+            self._count(report, "blob_chunks", orphans)
+            if orphans and not dry_run:
+                chunks.delete_many({"files_id": {"$in": orphans}})
+            self._pause()
+
+    def _sweep_chunks(self, report: dict, dry_run: bool):
+        """Local index chunks whose document row is gone."""
+        chunks = get_mongo_collection("document_chunks")
+        docs = get_mongo_collection("documents")
+        if chunks is None:
+            return
+        last_id = None
+        while not self._stopped():
+            query = {"seq": 0, **({"doc_id": {"$gt": last_id}} if last_id else {})}
+            batch = [c["doc_id"] for c in chunks.find(query, {"doc_id": 1}).sort("doc_id", 1).limit(self.batch_size)]
+            if not batch:
+                break
+            last_id = batch[-1]
+            known = {d["_id"] for d in docs.find({"_id": {"$in": batch}}, {"_id": 1})}
+            orphans = [b for b in batch if b not in known]
+            if orphans:
+                if dry_run:
+                    report["chunks"] += chunks.count_documents({"doc_id": {"$in": orphans}})
+                else:
+                    report["chunks"] += chunks.delete_many({"doc_id": {"$in": orphans}}).deleted_count
+            self._pause()
+
+    def _sweep_session_stores(self, cutoff, report: dict, dry_run: bool, throttle: _Throttle):
+        """Session stores that no document references any more (e.g. every upload failed)."""
+        from chatbot.core.file_store import SESSION_STORES_COLLECTION
+
+        mappings = get_mongo_collection(SESSION_STORES_COLLECTION)
+        registry = get_mongo_collection("file_stores")
+        docs = get_mongo_collection("documents")
+        if mappings is None:
+            return
+        query = {"created_at": {"$lt": cutoff}}
+        last_id = None
+        while not self._stopped():
+            page = {**query, "_id": {"$gt": last_id}} if last_id else query
+            batch = list(mappings.find(page, {"store_name": 1}).sort("_id", 1).limit(self.batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            names = [m["store_name"] for m in batch]
+            in_use = set(docs.distinct("file_store_name", {"file_store_name": {"$in": names}}))
+            # A positive ref_count means an upload into the store is in flight
+            in_use.update(r["_id"] for r in registry.find({"_id": {"$in": names}, "ref_count": {"$gt": 0}}, {"_id": 1}))
+            orphans = [m for m in batch if m["store_name"] not in in_use]
+            self._count(report, "session_stores", [m["store_name"] for m in orphans])
+            if not dry_run and orphans:
+                genai_client = self._get_genai_client()
+                for mapping in orphans:
+                    throttle.wait()
+                    if self._stopped():
+                        return
+                    if genai_client is not None:
+                        try:
+                            genai_client.file_search_stores.delete(name=mapping["store_name"], config={"force": True})
+                        except Exception as e:
+                            print(f"[core.orphan_gc] {mapping['store_name']}: {e}")
+                            continue
+                    mappings.delete_one({"_id": mapping["_id"], "store_name": mapping["store_name"]})
+                    registry.delete_one({"_id": mapping["store_name"], "ref_count": {"$lte": 0}})
+            self._pause()
+
+    # ---------- entry points ----------
+
+    def collect(self, dry_run: bool = False) -> dict:
+        """
+        Run every phase once. Returns a report:
+        {"documents", "chunks", "blobs", "blob_chunks", "stores", "session_stores", "marked",
+         "missing_users", "dry_run", "samples": {category: [ids]}}
+        A dry run also reports "sessionless_kept" / "sessionless_collected" (see _check_sessionless).
+        """
+        report = {
+            "documents": 0, "chunks": 0, "blobs": 0, "blob_chunks": 0, "stores": 0,
+            "session_stores": 0, "marked": 0, "missing_users": 0,
+            "dry_run": dry_run, "samples": {}
+        }
+        docs = get_mongo_collection("documents")
+        if docs is None:
+            return report
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.grace_hours)
+        throttle = _Throttle(self.store_deletes_per_minute, self._stop_event)
+
+        query = self._orphan_filter(docs, report, dry_run)
+        if dry_run:
+            report.update(sessionless_kept=0, sessionless_collected=0)
+            self._check_sessionless(docs, query, report)
+        self._sweep_documents(docs, query, report, dry_run, throttle)
+        self._sweep_blobs(cutoff, report, dry_run)
+        self._sweep_chunks(report, dry_run)
+        self._sweep_session_stores(cutoff, report, dry_run, throttle)
+        return report
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                report = self.collect()
+                removed = report["documents"] + report["blobs"] + report["stores"] + report["session_stores"]
+                if removed:
+                    print(f"🧹 [GC] Đã dọn {report['documents']} file, {report['blobs']} blob, "
+                          f"{report['stores'] + report['session_stores']} store mồ côi.")
+            except Exception as e:
+                print(f"❌ [GC] Lỗi dọn dữ liệu mồ côi: {e}")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread and self.thread.is_alive(): return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="orphan-gc")
+        self.thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# Singleton
+app_orphan_collector = OrphanCollector()
+
+
+if __name__ == "__main__":
+    import sys
+
+    dry_run = "--dry-run" in sys.argv
+    result = app_orphan_collector.collect(dry_run=dry_run)
+    samples = result.pop("samples")
+    print(f"[core.orphan_gc] {'Would delete' if dry_run else 'Deleted'}: {result}")
+    for category, ids in samples.items():
+        if ids:
+            print(f"[core.orphan_gc]   {category}: {', '.join(ids)}")
@@ -0,0 +1,81 @@
+"""
+PDF text extraction and chunking, free of DB/network imports so it can run in
+worker processes (corpus builds) as well as in the watcher.
+"""
+import re
+
+try:
+    import pymupdf4llm
+except ImportError:  # optional: without it uploads are only searchable through Google stores
+    pymupdf4llm = None
+
+from chatbot.config import config as app_config
+
+HEADING_RE = re.compile(r"^#{1,6}\s+(.*)$")
+# Bump the trailing number when extract_pdf_pages changes its output
+EXTRACTOR_VERSION = "pymupdf4llm-{}-md-pages-1".format(
+    getattr(pymupdf4llm, "__version__", getattr(pymupdf4llm, "version", "none"))
+)
+
+
+def extract_pdf_pages(file_path: str) -> list[dict]:
+    """Return [{"page": n (1-based), "text": markdown}] for every non-empty page."""
+    if pymupdf4llm is None:
+        raise RuntimeError("pymupdf4llm is not installed")
+    pages = []
+    for i, page in enumerate(pymupdf4llm.to_markdown(file_path, page_chunks=True, show_progress=False)):
+        text = (page.get("text") or "").strip()
+        if text:
+            pages.append({"page": page.get("metadata", {}).get("page", i + 1), "text": text})
+    return pages
+
+
+def _split_long(text: str, max_chars: int) -> list[str]:
+    """Split on paragraph boundaries, hard-cutting paragraphs longer than max_chars."""
+    parts, current = [], ""
+    for para in re.split(r"\n\s*\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            while len(para) > max_chars:
+                parts.append(para[:max_chars])
+                para = para[max_chars:]
+        if current and len(current) + len(para) + 2 > max_chars:
+            parts.append(current)
+            current = para
+        else:
+            current = f"{current}\n\n{para}" if current else para
+    if current:
+        parts.append(current)
+    return parts
+
+
+def chunk_pages(pages: list[dict], max_chars: int = app_config.LOCAL_INDEX_CHUNK_CHARS) -> list[dict]:
+    """
+    Split pages into chunks at Markdown headings, then by size.
+    Each chunk keeps its page number and the nearest heading above it.
+    """
+    chunks = []
+    heading = None
+    for page in pages:
+        section_heading, lines = heading, []
+        sections = []
+        for line in page["text"].splitlines():
+            match = HEADING_RE.match(line.strip())
+            if match:
+                if lines:
+                    sections.append((section_heading, "\n".join(lines)))
+                section_heading, lines = match.group(1).strip(), [line]
+            else:
+                lines.append(line)
+        if lines:
+            sections.append((section_heading, "\n".join(lines)))
+        heading = section_heading  # a section can continue on the next page
+        for section_heading, text in sections:
+            for part in _split_long(text, max_chars):
+                chunks.append({"page": page["page"], "heading": section_heading, "text": part})
+    return chunks
@@ -0,0 +1,179 @@
+"""
+Hot cache of the last N turns of active sessions, kept in Redis.
+
+Per session two keys are stored (both expire after RECENT_TURNS_TTL of inactivity):
+- turns:{user_id}:{session_id}       LIST of compact JSON turns (oldest first, capped at N)
+- turns:{user_id}:{session_id}:meta  HASH with total message count, title, created_at, updated_at
+
+save_session_message writes through to an existing list; history loaders read from here
+first and fill the cache from Mongo on a miss.
+"""
+import json
+from datetime import datetime, timezone
+
+from chatbot.config import config as app_config
+from chatbot.core.cache import app_cache
+
+
+def _encode_time(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return value
+
+
+def _decode_time(value):
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    return value
+
+
+def _dump_turn(message: dict) -> str:
+    compact = {
+        "i": message.get("message_id"),
+        "q": message.get("question"),
+        "a": message.get("answer"),
+        "t": _encode_time(message.get("timestamp")),
+    }
+    if message.get("image_gridfs_id"):
+        compact["g"] = message["image_gridfs_id"]
+    if message.get("thinking_steps"):
+        compact["s"] = message["thinking_steps"]
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+
+def _load_turn(raw: str) -> dict:
+    compact = json.loads(raw)
+    return {
+        "message_id": compact.get("i"),
+        "question": compact.get("q"),
+        "answer": compact.get("a"),
+        "image_gridfs_id": compact.get("g"),
+        "thinking_steps": compact.get("s"),
+        "timestamp": _decode_time(compact.get("t")),
+    }
+
+
+class RecentTurnsCache:
+    def __init__(self, cache, max_turns: int, ttl: int):
+        self.client = getattr(cache, "client", None)
+        self.max_turns = max_turns
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(user_id: str, session_id: str) -> tuple[str, str]:
+        list_key = f"turns:{user_id}:{session_id}"
+        return list_key, f"{list_key}:meta"
+
+    def get(self, user_id: str, session_id: str) -> dict | None:
+        """
+        Return {"messages", "total", "title", "created_at", "updated_at"} or None on a miss.
+        `messages` holds at most max_turns entries; it is the full history iff len == total.
+        """
+        if self.client is None:
+            return None
+        list_key, meta_key = self._keys(user_id, session_id)
+        try:
+            pipe = self.client.pipeline()
+            pipe.lrange(list_key, 0, -1)
+            pipe.hgetall(meta_key)
+            pipe.expire(list_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            raw_turns, meta = pipe.execute()[:2]
+            if not meta:
+                return None
+            # A fill racing with a write-through can leave the same turn twice
+            messages, seen = [], set()
+            for raw in raw_turns:
+                turn = _load_turn(raw)
+                if turn["message_id"] and turn["message_id"] in seen:
+                    continue
+                seen.add(turn["message_id"])
+                messages.append(turn)
+            return {
+                "messages": messages,
+                "total": int(meta.get("n", 0)),
+                "title": meta.get("title") or None,
+                "created_at": _decode_time(float(meta["c"])) if meta.get("c") else None,
+                "updated_at": _decode_time(float(meta["u"])) if meta.get("u") else None,
+            }
+        except Exception as e:
+            print(f"[core.recent_turns] Get error: {e}")
+            return None
+
+    def fill(self, user_id: str, session_id: str, messages: list[dict], total: int,
+             title: str | None = None, created_at=None, updated_at=None):
+        """Replace the cached window with the last max_turns of `messages` read from Mongo."""
+        if self.client is None:
+            return
+        list_key, meta_key = self._keys(user_id, session_id)
+        meta = {"n": total, "title": title or ""}
+        if isinstance(created_at, datetime):
+            meta["c"] = _encode_time(created_at)
+        if isinstance(updated_at, datetime):
+            meta["u"] = _encode_time(updated_at)
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(list_key, meta_key)
+            window = messages[-self.max_turns:]
+            if window:
+                pipe.rpush(list_key, *[_dump_turn(m) for m in window])
+            pipe.hset(meta_key, mapping=meta)
+            pipe.expire(list_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"[core.recent_turns] Fill error: {e}")
+
+    def append(self, user_id: str, session_id: str, message: dict):
+        """Write a new turn through to an already cached session (no-op on a cold session)."""
+        if self.client is None:
+            return
+        list_key, meta_key = self._keys(user_id, session_id)
+        try:
+            if not self.client.exists(meta_key):
+                return
+            pipe = self.client.pipeline()
+            pipe.rpush(list_key, _dump_turn(message))
+            pipe.ltrim(list_key, -self.max_turns, -1)
+            pipe.hincrby(meta_key, "n", 1)
+            if isinstance(message.get("timestamp"), datetime):
+                pipe.hset(meta_key, "u", _encode_time(message["timestamp"]))
+            pipe.expire(list_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"[core.recent_turns] Append error: {e}")
+
+    def set_title(self, user_id: str, session_id: str, title: str):
+        if self.client is None:
+            return
+        _, meta_key = self._keys(user_id, session_id)
+        try:
+            if self.client.exists(meta_key):
+                self.client.hset(meta_key, "title", title)
+        except Exception as e:
+            print(f"[core.recent_turns] Set title error: {e}")
+
+    def invalidate(self, user_id: str, session_id: str | None = None):
+        """Drop one session, or every session of the user when session_id is None."""
+        if self.client is None:
+            return
+        try:
+            if session_id is not None:
+                self.client.delete(*self._keys(user_id, session_id))
+                return
+            keys = list(self.client.scan_iter(match=f"turns:{user_id}:*", count=500))
+            for i in range(0, len(keys), 500):
+                self.client.delete(*keys[i:i + 500])
+        except Exception as e:
+            print(f"[core.recent_turns] Invalidate error: {e}")
+
+
+# Singleton
+app_recent_turns = RecentTurnsCache(
+    app_cache,
+    max_turns=app_config.RECENT_TURNS_CACHE_SIZE,
+    ttl=app_config.RECENT_TURNS_TTL
+)
@@ -0,0 +1,107 @@
+"""
+Liveness of uploaded file_search_stores, checked off the query path.
+
+Each processed document row carries `last_verified_at` (last successful
+`file_search_stores.get`) and `store_dead` (the store is gone on Google).
+Queries only read these fields; stale stores are re-checked in a background thread
+and dead ones drop out of `get_session_file_stores`.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+from chatbot.config import config as app_config
+from chatbot.core.db import DB_DOCUMENTS_COLLECTION, get_mongo_collection
+from chatbot.core.file_store import SESSION_STORES_COLLECTION
+from chatbot.core.utils import is_not_found_error
+
+
+class StoreLivenessChecker:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        # 1 worker: kiểm tra tuần tự, không chặn luồng trả lời
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store-liveness")
+        self._pending = set()  # session_id đang chờ kiểm tra
+        self._lock = threading.Lock()
+
+    def stale_stores(self, session_id: str, max_age: float | None = None) -> list[str]:
+        """Stores of a session never verified, or verified more than max_age seconds ago."""
+        coll = DB_DOCUMENTS_COLLECTION
+        if coll is None:
+            return []
+        max_age = self.ttl if max_age is None else max_age
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+        cursor = coll.find(
+            {
+                "session_id": session_id,
+                "status": "processed",
+                "store_dead": {"$ne": True},
+                "$or": [{"last_verified_at": {"$exists": False}}, {"last_verified_at": {"$lt": cutoff}}]
+            },
+            {"file_store_name": 1}
+        )
+        return list(dict.fromkeys(d["file_store_name"] for d in cursor if d.get("file_store_name")))
+
+    def verify(self, store_names: list[str], genai_client) -> dict:
+        """
+        Check stores on Google and persist the result on every document using them.
+        Only 404 / NOT_FOUND marks a store dead; other errors (throttling, bad key, quota,
+        permissions) say nothing about the store and leave it unknown.
+        Returns {store_name: True (alive) | False (dead) | None (unknown)}.
+        """
+        coll = DB_DOCUMENTS_COLLECTION
+        results = {}
+        if coll is None or genai_client is None:
+            return results
+        for name in store_names:
+            now = datetime.now(timezone.utc)
+            try:
+                genai_client.file_search_stores.get(name=name)
+                results[name] = True
+                coll.update_many({"file_store_name": name}, {"$set": {"last_verified_at": now}})
+            except Exception as e:
+                if not is_not_found_error(e):
+                    print(f"[core.store_liveness] Không kiểm tra được store '{name}': {e}")
+                    results[name] = None
+                    continue
+                print(f"[core.store_liveness] Store '{name}' không còn trên Google: {e}")
+                results[name] = False
+                coll.update_many(
+                    {"file_store_name": name},
+                    {"$set": {"store_dead": True, "store_dead_at": now, "store_dead_reason": str(e)}}
+                )
+                # Upload mới của phiên sẽ tạo store mới thay vì ghi vào store đã mất
+                session_stores = get_mongo_collection(SESSION_STORES_COLLECTION)
+                if session_stores is not None:
+                    session_stores.delete_one({"store_name": name})
+        return results
+
+    def _revalidate(self, session_id: str, genai_client, max_age: float | None):
+        try:
+            stores = self.stale_stores(session_id, max_age)
+            if stores:
+                self.verify(stores, genai_client)
+        except Exception as e:
+            print(f"[core.store_liveness] Revalidate error: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def schedule(self, session_id: str, genai_client, max_age: float | None = None):
+        """Re-check the session's stale stores in the background (at most one run queued per session)."""
+        if genai_client is None:
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        try:
+            self._executor.submit(self._revalidate, session_id, genai_client, max_age)
+        except RuntimeError:
+            # Executor đã shutdown (đang tắt ứng dụng)
+            with self._lock:
+                self._pending.discard(session_id)
+
+
+# Singleton
+app_store_liveness = StoreLivenessChecker(ttl=app_config.STORE_LIVENESS_TTL)
@@ -13,6 +13,10 @@ from PIL import Image
 SEARCH_CACHE = {}
 CACHE_TTL = 3600  # seconds
 
+# Provider errors worth retrying (throttling, 5xx, timeouts)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "429", "503", "timed out", "Timeout")
+
 def cache_key(prefix: str, session_or_user: str, query: str) -> str:
     h = hashlib.md5(query.encode('utf-8')).hexdigest()
     return f"{prefix}:{session_or_user}:{h}"
@@ -80,12 +84,38 @@ def compute_file_hash(file_path: str) -> str:
     MD5 of file bytes. Use for dedup checks.
     """
     try:
+        hasher = hashlib.md5()
         with open(file_path, "rb") as f:
-            return hashlib.md5(f.read()).hexdigest()
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
     except Exception as e:
         print(f"[core.utils.compute_file_hash] {e}")
         return ""
 
+def is_retryable_error(exc: Exception) -> bool:
+    """
+    Transient errors (provider throttling, 5xx, timeouts, dropped connections) are worth
+    retrying; anything else (bad request, invalid PDF, permission) fails the same way again.
+    """
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int) and 100 <= code < 600:
+        return code in RETRYABLE_STATUS_CODES
+    name = type(exc).__name__
+    if "Timeout" in name or "Connect" in name or "Network" in name:
+        return True
+    message = str(exc)
+    return any(marker in message for marker in RETRYABLE_MARKERS)
+
+def is_not_found_error(exc: Exception) -> bool:
+    """The resource is gone on Google (404 / NOT_FOUND), as opposed to a key, quota or config problem."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int) and 100 <= code < 600:
+        return code == 404
+    return "NOT_FOUND" in str(exc)
+
 def extract_citations(response, show_details: bool = False) -> str:
     """
     Extract simple grounding citations from Google GenAI response object.
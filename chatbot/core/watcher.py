@@ -1,26 +1,227 @@
 import threading
 import time
+import json
 import os
+import shutil
+import socket
 import tempfile
+import uuid
+import atexit
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 from pymongo.errors import OperationFailure
 import google.genai as genai
 
-from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS
-from chatbot.core.file_store import process_and_vectorize_pdf
+from chatbot.core.db import DB_DOCUMENTS_COLLECTION, FS, get_mongo_collection
+from chatbot.core.cache import app_cache
+from chatbot.core.file_store import (
+    process_and_vectorize_pdf, link_duplicate_store, record_processing_failure, DEAD_LETTER_STATUS,
+    find_file_resource, FileResourceUnavailable
+)
+from chatbot.core.local_index import index_document, has_cached_pages
+from chatbot.core.file_events import publish_file_status
 from chatbot.config import config as app_config
 
+# Kênh Redis báo file mới cho watcher của các replica khác
+UPLOAD_CHANNEL = "watcher:uploads"
+
+# Checkpoint change stream: collection watcher_state, 1 document cho stream của `documents`
+STREAM_STATE_COLLECTION = "watcher_state"
+STREAM_STATE_ID = "documents_stream"
+STREAM_MAX_BACKOFF = 60  # giây giữa các lần kết nối lại
+# 260 InvalidResumeToken, 280 ChangeStreamFatalError, 286 ChangeStreamHistoryLost
+RESUME_TOKEN_LOST_CODES = {260, 280, 286}
+
+
+class FairJobQueue:
+    """
+    Hàng đợi job theo user, lấy xoay vòng (round-robin) giữa các user để một người
+    upload hàng loạt không chặn người khác.
+    - capacity: tổng số job đang chờ + đang xử lý
+    - per_user: số job tối đa đang chờ của 1 user
+    """
+
+    def __init__(self, capacity: int, per_user: int):
+        self.capacity = capacity
+        self.per_user = per_user
+        self._by_user = {}  # user_id -> deque[doc]
+        self._users = deque()  # thứ tự xoay vòng
+        self._keys = set()  # _id của job đang chờ hoặc đang xử lý
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, doc) -> bool:
+        """Thêm job (không chặn). False nếu đã có, hàng đợi đầy hoặc user đã đủ hạn mức."""
+        with self._cond:
+            key = doc["_id"]
+            user = doc.get("user_id") or ""
+            if self._closed or key in self._keys or len(self._keys) >= self.capacity:
+                return False
+            if len(self._by_user.get(user, ())) >= self.per_user:
+                return False
+            if user not in self._by_user:
+                self._by_user[user] = deque()
+                self._users.append(user)
+            self._by_user[user].append(doc)
+            self._keys.add(key)
+            self._cond.notify()
+            return True
+
+    def get(self, timeout: float = 1.0):
+        """Lấy job của user kế tiếp. None nếu hết thời gian chờ hoặc hàng đợi đã đóng."""
+        with self._cond:
+            if not self._users and not self._closed:
+                self._cond.wait(timeout)
+            if self._closed or not self._users:
+                return None
+            user = self._users.popleft()
+            jobs = self._by_user[user]
+            doc = jobs.popleft()
+            if jobs:
+                self._users.append(user)
+            else:
+                del self._by_user[user]
+            return doc
+
+    def done(self, doc):
+        with self._cond:
+            self._keys.discard(doc["_id"])
+
+    def __contains__(self, key) -> bool:
+        with self._cond:
+            return key in self._keys
+
+    def has_room(self) -> bool:
+        with self._cond:
+            return len(self._keys) < self.capacity
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        with self._cond:
+            self._closed = False
+            self._by_user.clear()
+            self._users.clear()
+            self._keys.clear()
+
+
+class SpoolQuota:
+    """
+    Hạn mức dung lượng thư mục tạm dùng chung cho các worker: file chỉ được ghi ra đĩa
+    khi còn đủ chỗ, nếu không thì chờ worker khác dọn xong.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int, timeout: float):
+        if size > self.limit_bytes:
+            raise ValueError(f"File {size} bytes vượt hạn mức thư mục tạm {self.limit_bytes} bytes")
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.used + size > self.limit_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Hết thời gian chờ dung lượng thư mục tạm")
+                self._cond.wait(remaining)
+            self.used += size
+
+    def release(self, size: int):
+        with self._cond:
+            self.used = max(0, self.used - size)
+            self._cond.notify_all()
+
 
 class DatabaseWatcher:
-    def __init__(self):
+    def __init__(self, num_workers: int = app_config.WATCHER_WORKERS):
         self._stop_event = threading.Event()
         self.thread = None
+        self.num_workers = max(1, num_workers)
+        self.workers = []
+        self.jobs = FairJobQueue(app_config.WATCHER_MAX_QUEUED, app_config.WATCHER_MAX_QUEUED_PER_USER)
+        self._backlog = False  # còn file 'uploaded' chưa vào được hàng đợi
+        # Lease: mỗi tiến trình/replica có owner riêng, claim file nguyên tử trước khi xử lý
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = app_config.WATCHER_LEASE_SECONDS
+        self._claimed = set()  # _id đang giữ lease (để heartbeat)
+        self._claimed_lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.notify_thread = None
+        self.spool_dir = app_config.WATCHER_SPOOL_DIR
+        self.spool_quota = SpoolQuota(app_config.WATCHER_SPOOL_QUOTA_MB * 1024 * 1024)
+        self._wake = threading.Event()  # đánh thức vòng polling (dừng / hàng đợi trống chỗ)
+        self._next_retry_at = None  # lần thử lại sớm nhất đã hẹn (backoff sau lỗi tạm thời)
         try:
             self.genai_client = genai.Client(api_key=app_config.GOOGLE_API_KEY)
         except Exception as e:
             print(f"❌ [Watcher] Lỗi khởi tạo GenAI Client: {e}")
             self.genai_client = None
 
+    def _spool_prefix(self) -> str:
+        return f"{os.getpid()}-"
+
+    def _sweep_spool(self, max_age: float = 3600):
+        """
+        Xóa file tạm mồ côi: của tiến trình này (atexit) hoặc của tiến trình đã chết
+        (bị kill nên không kịp chạy finally) và đã cũ hơn max_age giây.
+        """
+        if not os.path.isdir(self.spool_dir):
+            return
+        own = self._spool_prefix()
+        now = time.time()
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if name.startswith(own) or now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def _spool_grid_file(self, grid_out):
+        """
+        Chép file GridFS ra đĩa theo từng khối WATCHER_SPOOL_BUFFER_SIZE (không đọc cả file
+        vào RAM), trong hạn mức thư mục tạm. File tạm luôn bị xóa khi ra khỏi context.
+        """
+        size = grid_out.length
+        self.spool_quota.acquire(size, timeout=max(30.0, self.lease_seconds / 2))
+        temp_path = None
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                delete=False, suffix=".pdf", prefix=self._spool_prefix(), dir=self.spool_dir
+            ) as tmp_file:
+                temp_path = tmp_file.name
+                shutil.copyfileobj(grid_out, tmp_file, app_config.WATCHER_SPOOL_BUFFER_SIZE)
+            yield temp_path
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except Exception:
+                    pass
+            self.spool_quota.release(size)
+
+    def _index_locally(self, doc, file_path=None):
+        """Trích xuất + chia chunk vào index cục bộ; lỗi ở đây không chặn bước Google."""
+        try:
+            started = time.monotonic()
+            count = index_document(doc, file_path)
+            print(f"📑 [Watcher] Index cục bộ {doc.get('filename')}: {count} chunk ({time.monotonic() - started:.1f}s)")
+        except Exception as e:
+            print(f"⚠️ [Watcher] Lỗi index cục bộ {doc.get('filename')}: {e}")
+            DB_DOCUMENTS_COLLECTION.update_one(
+                {"_id": doc["_id"]}, {"$set": {"local_index_status": "failed", "local_index_error": str(e)}}
+            )
+
     def _process_single_file(self, doc):
         """Logic xử lý 1 file: Tải từ GridFS -> Upload Google -> Clean"""
         filename = doc.get("filename", "unknown.pdf")
@@ -31,113 +232,486 @@ class DatabaseWatcher:
 
         if not gridfs_id:
             print(f"⚠️ [Watcher] File {filename} thiếu GridFS ID. Bỏ qua.")
+            record_processing_failure(doc["_id"], "Missing GridFS ID", self.owner_id)
             return
 
-        temp_path = None
+        needs_local_index = doc.get("local_index_status") not in ("indexed", "failed")
+        if needs_local_index and has_cached_pages(doc.get("file_hash")):
+            # Cùng nội dung đã được trích xuất: index từ cache, không cần tải file ra đĩa
+            self._index_locally(doc, None)
+            needs_local_index = False
+
+        # File trùng hash đã có store -> liên kết luôn, không tải lại lên Google
+        if doc.get("file_hash") and not needs_local_index:
+            reused = link_duplicate_store(str(doc["_id"]), doc["file_hash"])
+            if reused:
+                print(f"♻️ [Watcher] Dùng lại store {reused} cho file trùng: {filename}")
+                return
+
+        if not self.genai_client and not needs_local_index:
+            print("❌ [Watcher] GenAI Client chưa sẵn sàng.")
+            return
+
+        # Cùng nội dung vừa được upload lên Google (Files API còn hạn) -> import vào store
+        # của phiên, không cần tải file từ GridFS ra đĩa
+        # Import lỗi (file đã hết hạn/bị xóa trên Google) -> quay về tải từ GridFS bên dưới
+        if self.genai_client and not needs_local_index and find_file_resource(doc.get("file_hash")):
+            try:
+                process_and_vectorize_pdf(
+                    file_path=None,
+                    session_id=session_id,
+                    doc_id=str(doc["_id"]),
+                    genai_client=self.genai_client,
+                    file_hash=doc.get("file_hash"),
+                    lease_owner=self.owner_id,
+                    display_name=filename
+                )
+                print(f"♻️ [Watcher] Import lại nội dung đã upload cho file trùng: {filename}")
+                return
+            except FileResourceUnavailable as e:
+                print(f"⚠️ [Watcher] Không import được {filename}, tải lại từ GridFS: {e}")
+
         try:
             # 1. Lấy file từ GridFS
             grid_out = FS.get(ObjectId(gridfs_id))
 
-            # 2. Ghi ra file tạm
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(grid_out.read())
-                temp_path = tmp_file.name
+            # 2. Ghi ra file tạm theo từng khối, 3. Xử lý, 4. Dọn dẹp (khi ra khỏi with)
+            with self._spool_grid_file(grid_out) as temp_path:
+                # 3a. Index cục bộ trước: tìm kiếm được ngay, không chờ Google
+                if needs_local_index:
+                    self._index_locally(doc, temp_path)
 
-            # 3. Xử lý
-            if self.genai_client:
+                if doc.get("file_hash") and needs_local_index:
+                    reused = link_duplicate_store(str(doc["_id"]), doc["file_hash"])
+                    if reused:
+                        print(f"♻️ [Watcher] Dùng lại store {reused} cho file trùng: {filename}")
+                        return
+
+                if not self.genai_client:
+                    print("❌ [Watcher] GenAI Client chưa sẵn sàng.")
+                    return
+
+                # 3b. Google file search store
                 process_and_vectorize_pdf(
                     file_path=temp_path,
                     session_id=session_id,
                     doc_id=str(doc["_id"]),
-                    genai_client=self.genai_client
+                    genai_client=self.genai_client,
+                    file_hash=doc.get("file_hash"),
+                    lease_owner=self.owner_id,
+                    display_name=filename
                 )
                 print(f"✅ [Watcher] Xử lý hoàn tất: {filename}")
-            else:
-                print("❌ [Watcher] GenAI Client chưa sẵn sàng.")
 
         except Exception as e:
             print(f"❌ [Watcher] Lỗi khi xử lý file {filename}: {e}")
-            # Cập nhật trạng thái lỗi để không retry vô tận
+            # Lỗi tạm thời -> hẹn giờ thử lại (backoff); lỗi cố định/hết lượt -> dead-letter
+            new_status = record_processing_failure(doc["_id"], e, self.owner_id)
+            if new_status == DEAD_LETTER_STATUS:
+                print(f"☠️ [Watcher] {filename} chuyển sang dead-letter sau {doc.get('attempts', 1)} lần thử.")
+
+    def _claimable_filter(self, now):
+        """
+        File chờ xử lý (đã tới giờ thử lại nếu có `next_attempt_at`) hoặc đang 'processing'
+        nhưng lease đã hết hạn (replica chết giữa chừng). File đã bị xóa (chờ GC) bị bỏ qua.
+        Không có GenAI client thì chỉ nhận file còn cần index cục bộ: file khác không làm
+        được gì, claim rồi trả lại sẽ lặp vô ích mỗi lượt quét.
+        """
+        query = {"deleted_at": {"$exists": False}, "$or": [
+            {"status": "uploaded", "next_attempt_at": {"$not": {"$gt": now}}},
+            {"status": "processing", "lease_expires_at": {"$lt": now}}
+        ]}
+        if not self.genai_client:
+            query["local_index_status"] = {"$nin": ["indexed", "failed"]}
+        return query
+
+    def _claim(self, doc_id):
+        """
+        Claim nguyên tử: chỉ một replica chuyển được file sang 'processing'.
+        Mỗi lần claim tính là một lần thử (kể cả khi worker chết giữa chừng).
+        """
+        now = datetime.now(timezone.utc)
+        query = {"_id": doc_id, **self._claimable_filter(now)}
+        claimed = DB_DOCUMENTS_COLLECTION.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "processing",
+                    "lease_owner": self.owner_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                    "processing_started_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not claimed:
+            return None
+        if claimed.get("attempts", 1) > app_config.WATCHER_MAX_ATTEMPTS:
+            # File làm worker chết nhiều lần (lease hết hạn liên tục) -> dead-letter
             DB_DOCUMENTS_COLLECTION.update_one(
-                {"_id": doc["_id"]},
-                {"$set": {"status": "error", "error_msg": str(e)}}
+                {"_id": doc_id, "lease_owner": self.owner_id},
+                {
+                    "$set": {"status": DEAD_LETTER_STATUS, "error": "Vượt quá số lần thử (lease hết hạn)"},
+                    "$unset": {"lease_owner": "", "lease_expires_at": "", "next_attempt_at": ""}
+                }
             )
-        finally:
-            # 4. Dọn dẹp
-            if temp_path and os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except Exception:
-                    pass
+            print(f"☠️ [Watcher] {claimed.get('filename')} chuyển sang dead-letter.")
+            publish_file_status(doc_id, DEAD_LETTER_STATUS, claimed.get("user_id"), attempts=claimed.get("attempts"))
+            return None
+        with self._claimed_lock:
+            self._claimed.add(doc_id)
+        publish_file_status(doc_id, "processing", claimed.get("user_id"), attempts=claimed.get("attempts"))
+        return claimed
+
+    def _release_claim(self, doc_id):
+        """
+        Bỏ lease; nếu file vẫn 'processing' (chưa xử lý xong, vd. thiếu GenAI client)
+        thì trả về 'uploaded' và không tính lần thử này.
+        """
+        with self._claimed_lock:
+            self._claimed.discard(doc_id)
+        try:
+            result = DB_DOCUMENTS_COLLECTION.update_one(
+                {"_id": doc_id, "status": "processing", "lease_owner": self.owner_id},
+                {
+                    "$set": {"status": "uploaded"},
+                    "$inc": {"attempts": -1},
+                    "$unset": {"lease_owner": "", "lease_expires_at": ""}
+                }
+            )
+            if result.modified_count:
+                publish_file_status(doc_id, "uploaded")
+        except Exception as e:
+            print(f"❌ [Watcher] Lỗi trả lease: {e}")
+
+    def _heartbeat_loop(self):
+        """Gia hạn lease cho các file đang xử lý (mỗi 1/3 thời gian lease)."""
+        interval = max(1.0, self.lease_seconds / 3)
+        while True:
+            if self._stop_event.is_set():
+                # Vẫn gia hạn cho các file đang dở trong lúc stop() chờ worker
+                time.sleep(interval)
+            else:
+                self._stop_event.wait(interval)
+            with self._claimed_lock:
+                ids = list(self._claimed)
+            if not ids:
+                if self._stop_event.is_set():
+                    break
+                continue
+            try:
+                DB_DOCUMENTS_COLLECTION.update_many(
+                    {"_id": {"$in": ids}, "status": "processing", "lease_owner": self.owner_id},
+                    {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                print(f"❌ [Watcher] Heartbeat Error: {e}")
+
+    def _worker_loop(self):
+        """Worker: lấy job từ hàng đợi công bằng và xử lý cho tới khi dừng."""
+        while not self._stop_event.is_set():
+            doc = self.jobs.get(timeout=1.0)
+            if doc is None:
+                continue
+            try:
+                # Job có thể đã cũ hoặc đã bị replica khác claim
+                claimed = self._claim(doc["_id"])
+                if claimed:
+                    try:
+                        self._process_single_file(claimed)
+                    finally:
+                        self._release_claim(doc["_id"])
+            except Exception as e:
+                print(f"❌ [Watcher] Worker Error: {e}")
+            finally:
+                self.jobs.done(doc)
+                if self._backlog:
+                    self._wake.set()  # còn file chờ vì hàng đợi từng đầy
+
+    def _enqueue(self, doc) -> bool:
+        if self.jobs.put(doc):
+            return True
+        if doc["_id"] not in self.jobs:
+            self._backlog = True  # hàng đợi đầy, không phải job trùng
+        return False
+
+    def notify(self, doc_id, user_id: str | None = None):
+        """
+        Gọi ngay sau khi upload: đưa file vào hàng đợi của tiến trình này và báo cho
+        watcher của các replica khác qua Redis pub/sub, không phải chờ lượt quét kế tiếp.
+        """
+        doc_id = ObjectId(doc_id) if isinstance(doc_id, str) else doc_id
+        if self.thread and self.thread.is_alive():
+            self._enqueue({"_id": doc_id, "user_id": user_id})
+        client = getattr(app_cache, "client", None)
+        if client is None:
+            return
+        try:
+            message = {"id": str(doc_id), "u": user_id, "o": self.owner_id}
+            client.publish(UPLOAD_CHANNEL, json.dumps(message, separators=(",", ":")))
+        except Exception as e:
+            print(f"❌ [Watcher] Lỗi publish thông báo upload: {e}")
+
+    def _listen_notifications(self):
+        """Nhận thông báo upload từ replica khác (Redis pub/sub)."""
+        client = getattr(app_cache, "client", None)
+        if client is None:
+            return
+        while not self._stop_event.is_set():
+            pubsub = None
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(UPLOAD_CHANNEL)
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if not message:
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if data.get("o") == self.owner_id or not data.get("id"):
+                        continue  # tự mình đã enqueue lúc notify
+                    self._enqueue({"_id": ObjectId(data["id"]), "user_id": data.get("u")})
+            except Exception as e:
+                print(f"❌ [Watcher] Lỗi kênh thông báo Redis: {e}")
+                self._stop_event.wait(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _enqueue_pending(self) -> int:
+        """Quét các file 'uploaded' và đưa vào hàng đợi (cũ nhất trước). Trả về số job mới."""
+        self._backlog = False
+        now = datetime.now(timezone.utc)
+        added = 0
+        cursor = DB_DOCUMENTS_COLLECTION.find(self._claimable_filter(now)).sort("created_at", 1)
+        for doc in cursor:
+            if self._stop_event.is_set() or not self.jobs.has_room():
+                self._backlog = True
+                break
+            if self._enqueue(doc):
+                added += 1
+        self._refresh_next_retry(now)
+        return added
+
+    def _refresh_next_retry(self, now=None):
+        """Lần thử lại đã hẹn sớm nhất, để quét đúng lúc thay vì chờ hết chu kỳ."""
+        retry = DB_DOCUMENTS_COLLECTION.find_one(
+            {"status": "uploaded", "next_attempt_at": {"$gt": now or datetime.now(timezone.utc)}},
+            {"next_attempt_at": 1},
+            sort=[("next_attempt_at", 1)]
+        )
+        self._next_retry_at = retry["next_attempt_at"] if retry else None
+
+    def _seconds_until_retry(self):
+        if self._next_retry_at is None:
+            return None
+        due = self._next_retry_at
+        if due.tzinfo is None:
+            due = due.replace(tzinfo=timezone.utc)
+        return max(0.0, (due - datetime.now(timezone.utc)).total_seconds())
 
     def _poll_documents(self):
-        """Chế độ Fallback: Quét DB mỗi 5 giây (Dùng cho Standalone Mongo)"""
-        print("⚠️ [Watcher] Chuyển sang chế độ POLLING (Quét định kỳ 5s)...")
+        """
+        Chế độ Fallback (Standalone Mongo): file mới đến qua notify(), polling chỉ là lưới an toàn.
+        Quét dày khi có việc, giãn dần (x2) tới WATCHER_POLL_MAX_INTERVAL khi rảnh.
+        """
+        min_interval = app_config.WATCHER_POLL_MIN_INTERVAL
+        max_interval = max(min_interval, app_config.WATCHER_POLL_MAX_INTERVAL)
+        print(f"⚠️ [Watcher] Chuyển sang chế độ POLLING (quét thích ứng {min_interval:g}-{max_interval:g}s)...")
+        interval = min_interval
         while not self._stop_event.is_set():
             try:
-                # Tìm các file có status = 'uploaded'
-                cursor = DB_DOCUMENTS_COLLECTION.find({"status": "uploaded"})
-                for doc in cursor:
-                    if self._stop_event.is_set(): break
-                    self._process_single_file(doc)
-
-                # Ngủ 5 giây rồi quét tiếp
-                time.sleep(5)
+                found = self._enqueue_pending()
+                if found or self._backlog:
+                    interval = min_interval
+                else:
+                    interval = min(max_interval, interval * 2)
             except Exception as e:
                 print(f"❌ [Watcher] Polling Error: {e}")
-                time.sleep(5)
+                interval = max_interval
+            wait = interval
+            retry_in = self._seconds_until_retry()
+            if retry_in is not None:
+                wait = min(wait, max(min_interval, retry_in))
+            self._wake.wait(wait)
+            self._wake.clear()
 
-    def _watch_documents(self):
-        """Chế độ Chính: Lắng nghe sự kiện Realtime (Cần Replica Set)"""
-        print("👀 [Watcher] Đang thử kích hoạt chế độ Realtime Stream...")
+    def _load_resume_token(self):
+        state = get_mongo_collection(STREAM_STATE_COLLECTION)
+        if state is None:
+            return None
+        try:
+            doc = state.find_one({"_id": STREAM_STATE_ID}, {"resume_token": 1})
+            return doc.get("resume_token") if doc else None
+        except Exception as e:
+            print(f"❌ [Watcher] Lỗi đọc resume token: {e}")
+            return None
 
-        if DB_DOCUMENTS_COLLECTION is None or FS is None:
-            print("❌ [Watcher] Lỗi: Không kết nối được DB/GridFS.")
+    def _save_resume_token(self, token):
+        """Checkpoint vị trí stream; dùng chung cho mọi replica (sự kiện chỉ là tín hiệu đánh thức)."""
+        state = get_mongo_collection(STREAM_STATE_COLLECTION)
+        if state is None or token is None:
             return
+        try:
+            state.update_one(
+                {"_id": STREAM_STATE_ID},
+                {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc), "owner": self.owner_id}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"❌ [Watcher] Lỗi lưu resume token: {e}")
 
-        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update"]}}}]
-
+    def _clear_resume_token(self):
+        state = get_mongo_collection(STREAM_STATE_COLLECTION)
+        if state is None:
+            return
         try:
-            with DB_DOCUMENTS_COLLECTION.watch(pipeline) as stream:
+            state.delete_one({"_id": STREAM_STATE_ID})
+        except Exception:
+            pass
+
+    def _handle_change(self, change):
+        doc = change.get("fullDocument")
+        if not doc:
+            try:
+                doc_id = change["documentKey"]["_id"]
+                doc = DB_DOCUMENTS_COLLECTION.find_one({"_id": doc_id})
+            except Exception:
+                return
+        if doc and doc.get("status") == "uploaded":
+            self._enqueue(doc)
+
+    def _stream_once(self, resume_token):
+        """
+        Mở change stream (tiếp tục từ resume_token nếu có) và xử lý cho tới khi dừng hoặc lỗi.
+        Trả về resume token cuối cùng đã checkpoint.
+        """
+        # Chỉ nhận sự kiện có thể sinh việc: file mới, hoặc file quay về 'uploaded' (thử lại).
+        # Heartbeat lease, attempts/error, deleted_at... không qua được bộ lọc này
+        pipeline = [{"$match": {"$or": [
+            {"operationType": "insert", "fullDocument.status": "uploaded"},
+            {"operationType": "update", "updateDescription.updatedFields.status": "uploaded"}
+        ]}}]
+        options = {"max_await_time_ms": 1000}
+        if resume_token is not None:
+            options["resume_after"] = resume_token
+        with DB_DOCUMENTS_COLLECTION.watch(pipeline, **options) as stream:
+            if resume_token is None:
                 print("✅ [Watcher] Đã kết nối Realtime Stream thành công.")
-                for change in stream:
-                    if self._stop_event.is_set(): break
-
-                    doc = change.get("fullDocument")
-                    if not doc:
-                        try:
-                            doc_id = change["documentKey"]["_id"]
-                            doc = DB_DOCUMENTS_COLLECTION.find_one({"_id": doc_id})
-                        except Exception:
-                            continue
-
-                    if doc and doc.get("status") == "uploaded":
-                        self._process_single_file(doc)
-
-        except OperationFailure as e:
-            # Mã lỗi 40573: The $changeStream stage is only supported on replica sets
-            if e.code == 40573:
-                print(f"ℹ️ [Watcher] MongoDB đang chạy Standalone (không hỗ trợ Stream).")
-                self._poll_documents()  # <-- Fallback sang Polling
+                # Không có điểm tiếp tục: quét bù các file upload lúc watcher chưa chạy
+                self._enqueue_pending()
             else:
-                print(f"❌ [Watcher] Lỗi Stream khác: {e}")
-                time.sleep(5)
-                self._poll_documents()  # Fallback an toàn
+                print("✅ [Watcher] Đã tiếp tục Realtime Stream từ resume token.")
+                self._refresh_next_retry()
+            last_catch_up = time.monotonic()
+            last_checkpoint = time.monotonic()
+            saved_token = resume_token
+            while not self._stop_event.is_set():
+                change = stream.try_next()
+                if change is None:
+                    # Quét bù khi hàng đợi từng bị đầy, và định kỳ để thu hồi lease hết hạn
+                    since = time.monotonic() - last_catch_up
+                    retry_in = self._seconds_until_retry()
+                    if ((self._backlog and self.jobs.has_room() and since >= 5)
+                            or since >= self.lease_seconds
+                            or (retry_in == 0 and since >= 1)):
+                        self._enqueue_pending()
+                        last_catch_up = time.monotonic()
+                    # Lúc rảnh token vẫn tiến (postBatchResumeToken): checkpoint thưa để không bị quá hạn oplog
+                    token = stream.resume_token
+                    if token is not None and token != saved_token and time.monotonic() - last_checkpoint >= 30:
+                        self._save_resume_token(token)
+                        saved_token, last_checkpoint = token, time.monotonic()
+                    continue
 
-        except Exception as e:
-            print(f"❌ [Watcher] Lỗi không xác định: {e}")
-            self._poll_documents()
+                self._handle_change(change)
+                saved_token = stream.resume_token or change.get("_id")
+                self._save_resume_token(saved_token)
+                last_checkpoint = time.monotonic()
+            return saved_token
+
+    def _watch_documents(self):
+        """
+        Chế độ Chính: Lắng nghe sự kiện Realtime (Cần Replica Set).
+        Resume token được lưu vào Mongo sau mỗi sự kiện; khi mất kết nối hoặc khởi động lại,
+        stream tiếp tục từ token đó (kết nối lại với backoff), không chuyển hẳn sang polling.
+        """
+        print("👀 [Watcher] Đang thử kích hoạt chế độ Realtime Stream...")
+
+        if DB_DOCUMENTS_COLLECTION is None or FS is None:
+            print("❌ [Watcher] Lỗi: Không kết nối được DB/GridFS.")
+            return
+
+        resume_token = self._load_resume_token()
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            opened_at = time.monotonic()
+            try:
+                resume_token = self._stream_once(resume_token)
+            except OperationFailure as e:
+                # Mã lỗi 40573: The $changeStream stage is only supported on replica sets
+                if e.code == 40573:
+                    print(f"ℹ️ [Watcher] MongoDB đang chạy Standalone (không hỗ trợ Stream).")
+                    self._poll_documents()  # <-- Fallback sang Polling
+                    return
+                if e.code in RESUME_TOKEN_LOST_CODES:
+                    # Token đã trôi khỏi oplog: mở stream mới và quét bù toàn bộ
+                    print(f"⚠️ [Watcher] Resume token không còn dùng được, mở stream mới: {e}")
+                    resume_token = None
+                    self._clear_resume_token()
+                    continue
+                print(f"❌ [Watcher] Lỗi Stream, kết nối lại sau {backoff:g}s: {e}")
+            except Exception as e:
+                print(f"❌ [Watcher] Lỗi Stream, kết nối lại sau {backoff:g}s: {e}")
+            if self._stop_event.is_set():
+                break
+            # Tiếp tục từ checkpoint cuối cùng đã ghi trong lúc stream chạy
+            resume_token = self._load_resume_token() or resume_token
+            if time.monotonic() - opened_at > 60:
+                backoff = 1.0  # stream đã chạy ổn một lúc: lỗi mới, bắt đầu lại backoff
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, STREAM_MAX_BACKOFF)
 
     def start(self):
         if self.thread and self.thread.is_alive(): return
         self._stop_event.clear()
+        self._wake.clear()
+        self.jobs.reopen()
+        self._sweep_spool()
+        self.workers = [
+            threading.Thread(target=self._worker_loop, daemon=True, name=f"watcher-worker-{i}")
+            for i in range(self.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True, name="watcher-heartbeat")
+        self.heartbeat_thread.start()
+        self.notify_thread = threading.Thread(target=self._listen_notifications, daemon=True, name="watcher-notify")
+        self.notify_thread.start()
         self.thread = threading.Thread(target=self._watch_documents, daemon=True)
         self.thread.start()
 
-    def stop(self):
+    def stop(self, timeout: float = 30.0):
+        """Dừng nhận job mới, chờ các worker xử lý xong file đang dở (tối đa `timeout` giây)."""
         self._stop_event.set()
+        self._wake.set()
+        self.jobs.close()
         print("🛑 [Watcher] Đang dừng dịch vụ...")
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        busy = sum(1 for w in self.workers if w.is_alive())
+        if busy:
+            print(f"⚠️ [Watcher] {busy} worker chưa xử lý xong khi dừng.")
 
 
 # Singleton
-app_watcher = DatabaseWatcher()
\ No newline at end of file
+app_watcher = DatabaseWatcher()
+# Thread daemon bị dừng đột ngột khi thoát tiến trình: dọn file tạm còn sót
+atexit.register(app_watcher._sweep_spool)
@@ -0,0 +1,253 @@
+"""
+Write-behind buffer for chat session messages.
+
+save_session_message enqueues each turn here and returns immediately; a background thread
+groups pending messages per session and writes them with a single bulk_write. Messages that
+are not yet flushed stay visible to readers of the same session through `merge_pending`.
+
+Each $push is guarded on the turns' message_id, so a batch retried after a partial failure
+or an ambiguous timeout never appends the same turn twice.
+"""
+import threading
+import time
+from collections import deque
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from chatbot.config import config as app_config
+from chatbot.core.db import get_mongo_collection
+from chatbot.core.archive import restore_sessions
+
+
+class SessionWriteBuffer:
+    def __init__(self, max_pending: int, batch_size: int, flush_interval: float):
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque()  # (session_id, user_id, message_data)
+        self._overlay = {}  # session_id -> {"user_id": str, "messages": [message_data]}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def enqueue(self, session_id: str, user_id: str, message_data: dict, timeout: float = 1.0) -> bool:
+        """
+        Add a message to the buffer. Blocks up to `timeout` seconds while the buffer is full.
+        Returns False if the buffer is not running or still full; the caller should write directly.
+        """
+        if not self.running:
+            return False
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._queue) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.notify_all()  # wake the flusher early
+                self._cond.wait(remaining)
+            self._queue.append((session_id, user_id, message_data))
+            entry = self._overlay.setdefault(session_id, {"user_id": user_id, "messages": []})
+            entry["messages"].append(message_data)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def pending_messages(self, session_id: str, user_id: str | None = None) -> list[dict]:
+        """Messages of a session that are acknowledged but not yet in Mongo."""
+        with self._cond:
+            entry = self._overlay.get(session_id)
+            if not entry or (user_id is not None and entry["user_id"] != user_id):
+                return []
+            return list(entry["messages"])
+
+    def merge_pending(self, session_id: str, user_id: str | None, messages: list[dict]) -> list[dict]:
+        """
+        Append pending messages to messages read from Mongo (read-your-writes).
+        Messages flushed between the Mongo read and this call are not duplicated.
+        """
+        pending = self.pending_messages(session_id, user_id)
+        if not pending:
+            return messages
+        stored_ids = {m.get("message_id") for m in messages if m.get("message_id")}
+        return messages + [m for m in pending if m.get("message_id") not in stored_ids]
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            self._cond.notify_all()  # room for blocked producers
+            return batch
+
+    def _release(self, batch: list):
+        """Drop flushed messages from the read overlay."""
+        with self._cond:
+            for session_id, _, message_data in batch:
+                entry = self._overlay.get(session_id)
+                if not entry:
+                    continue
+                entry["messages"] = [m for m in entry["messages"] if m is not message_data]
+                if not entry["messages"]:
+                    self._overlay.pop(session_id, None)
+
+    @staticmethod
+    def _push_op(session_id: str, user_id: str, messages: list, upsert: bool) -> UpdateOne:
+        # Matches only while none of these turns is stored: a repeated write is a no-op
+        update = {
+            "$push": {"messages": {"$each": messages}},
+            "$set": {"updated_at": messages[-1]["timestamp"]}
+        }
+        if upsert:
+            update["$setOnInsert"] = {"user_id": user_id, "created_at": messages[0]["timestamp"]}
+        return UpdateOne(
+            {"session_id": session_id, "messages.message_id": {"$nin": [m["message_id"] for m in messages]}},
+            update,
+            upsert=upsert
+        )
+
+    def _write_batch(self, batch: list) -> list:
+        """Write a batch; return the items whose write failed and must be retried."""
+        coll = get_mongo_collection("sessions")
+        if coll is None:
+            raise RuntimeError("sessions collection missing")
+        grouped = {}
+        for session_id, user_id, message_data in batch:
+            grouped.setdefault(session_id, (user_id, []))[1].append(message_data)
+        session_ids = list(grouped)
+        ops = [
+            self._push_op(session_id, user_id, messages, upsert=True)
+            for session_id, (user_id, messages) in grouped.items()
+        ]
+        failed, existing = set(), []
+        try:
+            upserted = coll.bulk_write(ops, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            for err in e.details.get("writeErrors", []):
+                session_id = session_ids[err["index"]]
+                if err.get("code") == 11000:
+                    # Upsert found no match: some of the turns are already stored, or the
+                    # session was created concurrently
+                    existing.append(session_id)
+                else:
+                    failed.add(session_id)
+        if existing:
+            # Push only the turns not stored yet (a retried group may mix stored and new turns)
+            stored = {
+                doc["session_id"]: {m.get("message_id") for m in doc.get("messages", [])}
+                for doc in coll.find({"session_id": {"$in": existing}}, {"session_id": 1, "messages.message_id": 1})
+            }
+            retry_ops = []
+            for session_id in existing:
+                user_id, messages = grouped[session_id]
+                missing = [m for m in messages if m["message_id"] not in stored.get(session_id, set())]
+                if missing:
+                    retry_ops.append(self._push_op(session_id, user_id, missing, upsert=True))
+            if retry_ops:
+                coll.bulk_write(retry_ops, ordered=False)
+        if upserted:
+            # New hot document: the session may be archived, bring its history back
+            try:
+                restore_sessions([session_ids[i] for i in upserted])
+            except Exception as e:
+                print(f"[core.write_buffer] Restore archived sessions error: {e}")
+        return [item for item in batch if item[0] in failed]
+
+    def _requeue(self, items: list):
+        with self._cond:
+            self._queue.extendleft(reversed(items))
+
+    def flush(self) -> int:
+        """Write everything currently queued. Returns the number of messages flushed."""
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                try:
+                    retry = self._write_batch(batch)
+                except Exception as e:
+                    # Outcome unknown (e.g. network timeout): the guarded $push makes a full retry safe
+                    print(f"[core.write_buffer] Flush error, will retry: {e}")
+                    self._requeue(batch)
+                    break
+                retry_ids = {id(item) for item in retry}
+                done = [item for item in batch if id(item) not in retry_ids]
+                self._release(done)
+                flushed += len(done)
+                if retry:
+                    print(f"[core.write_buffer] {len(retry)} messages failed, will retry.")
+                    self._requeue(retry)
+                    break
+        return flushed
+
+    def write_through(self, session_id: str, user_id: str, message_data: dict):
+        """
+        Write a turn synchronously (buffer full) together with the queued turns of the same
+        session, so the newer turn never lands ahead of older ones. If the write fails the
+        turns go back to the queue (past max_pending) and are flushed in order later.
+        """
+        item = (session_id, user_id, message_data)
+        with self._flush_lock:
+            with self._cond:
+                earlier = [queued for queued in self._queue if queued[0] == session_id]
+                if earlier:
+                    self._queue = deque(queued for queued in self._queue if queued[0] != session_id)
+                    self._cond.notify_all()
+                entry = self._overlay.setdefault(session_id, {"user_id": user_id, "messages": []})
+                entry["messages"].append(message_data)
+            batch = earlier + [item]
+            try:
+                retry = self._write_batch(batch)
+            except Exception as e:
+                print(f"[core.write_buffer] Write-through error, queued instead: {e}")
+                retry = batch
+            if retry:
+                self._release([queued for queued in batch if queued not in retry])
+                with self._cond:
+                    # Older turns of this session first, then whatever else is queued
+                    self._queue.extendleft(reversed(retry))
+                return
+            self._release(batch)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            if self.flush() == 0 and self._queue:
+                # Mongo unavailable: back off instead of spinning on a full queue
+                self._stop_event.wait(self.flush_interval)
+
+    def start(self):
+        if self.running: return
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="session-write-buffer")
+        self.thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher and write out whatever is still pending."""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+        self.thread = None
+        self.flush()
+        with self._cond:
+            if self._queue:
+                print(f"[core.write_buffer] {len(self._queue)} messages could not be flushed on shutdown.")
+
+
+# Singleton
+app_session_writer = SessionWriteBuffer(
+    max_pending=app_config.SESSION_WRITE_BUFFER_SIZE,
+    batch_size=app_config.SESSION_WRITE_BATCH_SIZE,
+    flush_interval=app_config.SESSION_WRITE_FLUSH_INTERVAL
+)
@@ -9,6 +9,7 @@ from chatbot.core.db import init_db
 from chatbot.core.history import list_sessions, get_session_history, save_session_message
 from chatbot.core.file_store import save_pdf_to_mongo
 from chatbot.core.watcher import app_watcher
+from chatbot.core.write_buffer import app_session_writer
 from chatbot.core.memory_profile import build_user_memory
 
 from chatbot.services.vision_service import VisionService
@@ -40,6 +41,9 @@ class AppContainer:
         # Start Watcher (Để xử lý file ngầm)
         app_watcher.start()
 
+        # Ghi lịch sử chat theo lô (write-behind)
+        app_session_writer.start()
+
 
 APP = AppContainer()
 
@@ -59,6 +63,7 @@ def handle_pdf_upload(pdf_path: str, session_id: str, user_id: str):
         return
 
     print("✅ [main] Đã lưu file. Hệ thống đang xử lý ngầm (Watcher)...")
+    app_watcher.notify(file_id, user_id)
 
     # (Optional) Chờ một chút để Watcher kịp bắt sự kiện và in log cho đẹp trên CLI
     # Trên thực tế (API) thì return luôn không cần chờ.
@@ -162,8 +167,9 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        app_watcher.stop()
         print("\nGoodbye!")
     except Exception as e:
+        print(f"[main] Fatal Error: {e}")
+    finally:
         app_watcher.stop()
-        print(f"[main] Fatal Error: {e}")
\ No newline at end of file
+        app_session_writer.stop()
\ No newline at end of file
@@ -1,3 +1,5 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import google.genai.types as types
 from chatbot.core.reranker import CohereReranker
 from chatbot.core.query_generator import QueryGenerator
@@ -12,30 +14,94 @@ class AdvancedRagPipeline:
         self.query_gen = QueryGenerator(text_llm_langchain)
         self.evaluator = RelevanceEvaluator(text_llm_langchain)
         self.model_name = app_config.TEXT_MODEL_NAME
+        self.store_group_size = max(1, app_config.RAG_STORE_GROUP_SIZE)
+        self.store_timeout = app_config.RAG_STORE_TIMEOUT
+        self._fanout_pool = ThreadPoolExecutor(max_workers=app_config.RAG_FANOUT_WORKERS, thread_name_prefix="rag-fanout")
+
+    def _fetch_scored_chunks(self, query: str, store_names: list[str], timeout: float | None = None) -> list[tuple[float, str]]:
+        """
+        Helper: Gọi Google lấy chunks kèm điểm.
+        Điểm = confidence cao nhất của grounding_supports trỏ tới chunk; nếu không có thì theo thứ hạng.
+        """
+        config = {"tools": [types.Tool(file_search=types.FileSearch(file_search_store_names=store_names))]}
+        if timeout:
+            config["http_options"] = types.HttpOptions(timeout=int(timeout * 1000))
+        response = self.client.models.generate_content(
+            model=self.model_name,
+            contents=f"Trích xuất thông tin liên quan đến: {query}",
+            config=types.GenerateContentConfig(**config)
+        )
+        scored = []
+        if hasattr(response, 'candidates') and response.candidates:
+            meta = response.candidates[0].grounding_metadata
+            if meta and meta.grounding_chunks:
+                best = {}
+                for support in meta.grounding_supports or []:
+                    for idx, score in zip(support.grounding_chunk_indices or [], support.confidence_scores or []):
+                        best[idx] = max(best.get(idx, 0.0), score)
+                total = len(meta.grounding_chunks)
+                for i, chunk in enumerate(meta.grounding_chunks):
+                    if getattr(chunk, 'retrieved_context', None) and chunk.retrieved_context.text:
+                        scored.append((best.get(i, 0.5 * (total - i) / total), chunk.retrieved_context.text))
+        return scored
 
     def _fetch_chunks(self, query: str, store_names: list[str]) -> list[str]:
-        """Helper: Gọi Google lấy chunks"""
+        """Helper: Gọi Google lấy chunks (một lần gọi cho tất cả store)"""
         try:
-            tool_config = types.Tool(
-                file_search=types.FileSearch(file_search_store_names=store_names)
-            )
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=f"Trích xuất thông tin liên quan đến: {query}",
-                config=types.GenerateContentConfig(tools=[tool_config])
-            )
-            chunks = []
-            if hasattr(response, 'candidates') and response.candidates:
-                cand = response.candidates[0]
-                if cand.grounding_metadata and cand.grounding_metadata.grounding_chunks:
-                    for chunk in cand.grounding_metadata.grounding_chunks:
-                        if hasattr(chunk, 'retrieved_context'):
-                            chunks.append(chunk.retrieved_context.text)
-            return chunks
+            return [text for _, text in self._fetch_scored_chunks(query, store_names)]
         except Exception:
             return []
 
-    def run_pipeline(self, original_query: str, store_names: list[str]) -> str:
+    @staticmethod
+    def _rank_scores(scored: list[tuple[float, str]]) -> list[tuple[float, str]]:
+        """
+        Điểm thô (confidence, hoặc thứ hạng khi thiếu) chỉ so được trong cùng một response.
+        Đổi sang vị trí tương đối trong nhóm: chunk tốt nhất = 1.0, giảm đều tới chunk cuối,
+        để gộp các nhóm với nhau.
+        """
+        ordered = sorted(scored, key=lambda item: item[0], reverse=True)
+        total = len(ordered)
+        return [(1.0 - i / total, text) for i, (_, text) in enumerate(ordered)]
+
+    def _fetch_chunks_fanout(self, query: str, store_names: list[str]) -> list[str]:
+        """
+        Chia store thành nhóm RAG_STORE_GROUP_SIZE, gọi song song, mỗi nhóm có hạn RAG_STORE_TIMEOUT
+        (kể cả khi chỉ có một nhóm). Nhóm chậm/lỗi bị bỏ qua; kết quả các nhóm xong được gộp
+        theo vị trí tương đối trong nhóm (xem _rank_scores), cao trước.
+        """
+        groups = [store_names[i:i + self.store_group_size] for i in range(0, len(store_names), self.store_group_size)]
+        if len(groups) <= 1:
+            try:
+                scored = self._fetch_scored_chunks(query, store_names, self.store_timeout)
+            except Exception as e:
+                print(f"[Pipeline] Store group {store_names} failed: {e}")
+                return []
+            return [text for _, text in sorted(scored, key=lambda item: item[0], reverse=True)]
+
+        started = time.monotonic()
+        futures = {
+            self._fanout_pool.submit(self._fetch_scored_chunks, query, group, self.store_timeout): group
+            for group in groups
+        }
+        done, not_done = wait(futures, timeout=self.store_timeout)
+        for future in not_done:
+            future.cancel()  # chưa chạy thì hủy, đang chạy thì tự dừng theo http timeout
+
+        best = {}
+        for future in done:
+            try:
+                for score, text in self._rank_scores(future.result()):
+                    best[text] = max(best.get(text, 0.0), score)
+            except Exception as e:
+                print(f"[Pipeline] Store group {futures[future]} failed: {e}")
+        print(f"[Pipeline] Fan-out: {len(done)}/{len(groups)} store groups in {time.monotonic() - started:.2f}s")
+        return [text for text, _ in sorted(best.items(), key=lambda item: item[1], reverse=True)]
+
+    def run_pipeline(self, original_query: str, store_names: list[str], fanout: bool = False) -> str:
+        """
+        fanout=True: truy vấn song song theo nhóm store với hạn chót mỗi nhóm
+        (dùng cho phiên có nhiều store upload), thay vì một lần gọi cho mọi store.
+        """
         # 1. Sinh các biến thể câu hỏi (Multi-query)
         queries = self.query_gen.generate_queries(original_query)
         print(f"[Pipeline] Generated queries: {queries}")
@@ -48,11 +114,11 @@ class AdvancedRagPipeline:
             print(f"--- Trying query: {q} ---")
 
             # A. Search
-            raw_chunks = self._fetch_chunks(q, store_names)
+            raw_chunks = self._fetch_chunks_fanout(q, store_names) if fanout else self._fetch_chunks(q, store_names)
             if not raw_chunks: continue
 
-            # B. Rerank (Lọc sơ bộ bằng Cohere trước)
-            top_chunks = self.reranker.rerank(q, list(set(raw_chunks)), top_n=3)
+            # B. Rerank (Lọc sơ bộ bằng Cohere trước); giữ thứ tự điểm khi không có reranker
+            top_chunks = self.reranker.rerank(q, list(dict.fromkeys(raw_chunks)), top_n=3)
 
             # C. Evaluation (Chấm điểm kỹ bằng LLM)
             good_chunks_in_pass = []
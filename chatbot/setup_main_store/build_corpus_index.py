@@ -0,0 +1,192 @@
+"""
+Build the local chunk index of the law corpus (all PDFs under config.DATA_DIR).
+
+PDF parsing is CPU-bound, so extraction + chunking runs in a ProcessPoolExecutor with one
+process per core; files are also hashed in the pool, and the extraction cache is checked
+with one query per batch of hashes. A single writer thread stores the chunks in
+`corpus_chunks` (and new extractions in the extraction cache). Files already in the cache
+are not parsed again.
+
+Run: python -m chatbot.setup_main_store.build_corpus_index [--workers N] [--data-dir PATH]
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from chatbot.config import config
+from chatbot.core.pdf_text import extract_pdf_pages, chunk_pages
+from chatbot.core.utils import compute_file_hash
+
+CORPUS_CHUNKS_COLLECTION = "corpus_chunks"
+WRITE_BATCH_SIZE = 1000
+HASH_BATCH_SIZE = 256  # files hashed per round, and hashes per extraction cache query
+
+
+def _hash_file(file_path: str) -> tuple[str, str | None, int]:
+    """Worker process: MD5 (same as compute_file_hash) and size of one file."""
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return file_path, None, 0
+    return file_path, compute_file_hash(file_path) or None, size  # "" when unreadable
+
+
+def _extract_and_chunk(file_path: str) -> tuple[list[dict], list[dict]]:
+    """Worker process: parse one PDF. Only pure-Python imports, no DB connection."""
+    pages = extract_pdf_pages(file_path)
+    return pages, chunk_pages(pages)
+
+
+class ThroughputMeter:
+    """Đếm file/trang/byte đã ghi và in tốc độ định kỳ."""
+
+    def __init__(self, total_files: int, every: float = 5.0):
+        self.total_files = total_files
+        self.every = every
+        self.files = self.pages = self.bytes = self.errors = 0
+        self.started = self._last_report = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, pages: int, size: int):
+        with self._lock:
+            self.files += 1
+            self.pages += pages
+            self.bytes += size
+            if time.monotonic() - self._last_report >= self.every:
+                self._last_report = time.monotonic()
+                self._print()
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def _print(self, prefix: str = "⏳"):
+        elapsed = max(1e-6, time.monotonic() - self.started)
+        print(f"{prefix} {self.files}/{self.total_files} file | {self.pages} trang | "
+              f"{self.pages / elapsed:.1f} trang/s | {self.bytes / elapsed / 1024 / 1024:.2f} MB/s | "
+              f"{self.errors} lỗi | {elapsed:.0f}s")
+
+    def summary(self) -> dict:
+        with self._lock:
+            self._print("✅")
+            elapsed = time.monotonic() - self.started
+            return {"files": self.files, "pages": self.pages, "bytes": self.bytes,
+                    "errors": self.errors, "seconds": round(elapsed, 1)}
+
+
+def _list_pdfs(data_dir) -> list[str]:
+    paths = []
+    for root, _, files in os.walk(data_dir):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def _writer_loop(coll, items: queue.Queue, meter: ThroughputMeter, data_dir):
+    """Thread ghi: nhận kết quả từ hàng đợi giới hạn, ghi chunk theo lô."""
+    from chatbot.core.local_index import store_cached_pages
+
+    while True:
+        item = items.get()
+        if item is None:
+            break
+        path, file_hash, size, pages, chunks, from_cache = item
+        try:
+            if chunks is None:
+                chunks = chunk_pages(pages)
+            if not from_cache:
+                store_cached_pages(file_hash, pages)
+            source = os.path.relpath(path, data_dir)
+            rows = [
+                {
+                    "source": source,
+                    "category": os.path.dirname(source),
+                    "filename": os.path.basename(path),
+                    "file_hash": file_hash,
+                    "seq": i,
+                    **chunk
+                }
+                for i, chunk in enumerate(chunks)
+            ]
+            coll.delete_many({"source": source})
+            for i in range(0, len(rows), WRITE_BATCH_SIZE):
+                coll.insert_many(rows[i:i + WRITE_BATCH_SIZE], ordered=False)
+            meter.add(len(pages), size)
+        except Exception as e:
+            meter.error()
+            print(f"❌ Lỗi ghi {path}: {e}")
+
+
+def build_corpus_index(data_dir=config.DATA_DIR, workers: int | None = None) -> dict:
+    """
+    (Re)build corpus_chunks for every PDF under data_dir.
+    Returns {"files", "pages", "bytes", "errors", "seconds"}.
+    """
+    from chatbot.core.db import get_mongo_collection
+    from chatbot.core.local_index import get_cached_pages_many
+
+    coll = get_mongo_collection(CORPUS_CHUNKS_COLLECTION)
+    if coll is None:
+        print("❌ Không kết nối được MongoDB.")
+        return {}
+    workers = workers or config.CORPUS_BUILD_WORKERS or os.cpu_count() or 1
+    paths = _list_pdfs(data_dir)
+    print(f"📚 {len(paths)} file PDF trong {data_dir}, {workers} process.")
+
+    meter = ThroughputMeter(len(paths))
+    items = queue.Queue(maxsize=config.CORPUS_WRITE_QUEUE_SIZE)  # đầy -> chặn, tạo backpressure
+    writer = threading.Thread(target=_writer_loop, args=(coll, items, meter, data_dir), daemon=True)
+    writer.start()
+
+    def _collect(done, futures):
+        for future in done:
+            path, file_hash, size = futures.pop(future)
+            try:
+                pages, chunks = future.result()
+                items.put((path, file_hash, size, pages, chunks, False))
+            except Exception as e:
+                meter.error()
+                print(f"❌ Lỗi trích xuất {path}: {e}")
+
+    futures = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), HASH_BATCH_SIZE):
+            # Băm song song trong pool, rồi tra cache 1 lần cho cả lô
+            hashed = []
+            for path, file_hash, size in pool.map(
+                _hash_file, paths[start:start + HASH_BATCH_SIZE],
+                chunksize=max(1, HASH_BATCH_SIZE // (workers * 4))
+            ):
+                if file_hash is None:
+                    meter.error()
+                    print(f"❌ Không đọc được {path}")
+                    continue
+                hashed.append((path, file_hash, size))
+            cached = get_cached_pages_many([file_hash for _, file_hash, _ in hashed])
+            for path, file_hash, size in hashed:
+                if file_hash in cached:
+                    # Chia chunk ở thread ghi, không chặn luồng chính
+                    items.put((path, file_hash, size, cached[file_hash], None, True))
+                    continue
+                futures[pool.submit(_extract_and_chunk, path)] = (path, file_hash, size)
+                # Giới hạn số file đang xử lý để không dồn kết quả vào RAM
+                if len(futures) >= workers * 2:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    _collect(done, futures)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            _collect(done, futures)
+
+    items.put(None)
+    writer.join()
+    return meter.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local chunk index of the law corpus.")
+    parser.add_argument("--workers", type=int, default=None, help="số process (mặc định: số core)")
+    parser.add_argument("--data-dir", default=config.DATA_DIR)
+    args = parser.parse_args()
+    print(build_corpus_index(args.data_dir, args.workers))
@@ -1,17 +1,293 @@
 import google.genai as genai
+import argparse
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
 from chatbot.config import config
+from chatbot.core.utils import compute_file_hash, is_retryable_error
 
 # --- Hằng số từ Config ---
 GOOGLE_API_KEY = config.GOOGLE_API_KEY
 DATA_DIR = config.DATA_DIR
+MANIFEST_PATH = config.MAIN_STORE_MANIFEST
+OPERATION_POLL_INTERVAL = 2  # giây giữa các lần kiểm tra tiến trình index
+OPERATION_TIMEOUT = 900  # giây tối đa chờ 1 file được index
 
 
-def create_and_populate_store(client):
+class TokenBucket:
+    """Giới hạn tốc độ gọi API: `rate` lượt/phút, cho phép dồn tối đa `burst` lượt."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class UploadProgress:
+    """Tiến độ + tốc độ tải lên (in sau mỗi file)."""
+
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.done = self.failed = self.bytes = self.retries = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def finish(self, rel: str, size: int, ok: bool):
+        with self._lock:
+            if ok:
+                self.done += 1
+                self.bytes += size
+            else:
+                self.failed += 1
+            elapsed = max(1e-6, time.monotonic() - self.started)
+            rate = self.done / elapsed
+            remaining = self.total_files - self.done - self.failed
+            eta = remaining / rate if rate else 0
+            print(f"[{self.done + self.failed}/{self.total_files}] {'✅' if ok else '❌'} {rel} | "
+                  f"{rate * 60:.1f} file/phút | {self.bytes / elapsed / 1024 / 1024:.2f} MB/s | "
+                  f"{self.retries} lần thử lại | còn ~{eta:.0f}s")
+
+
+# ==============================================================================
+# MANIFEST: path tương đối -> {size, mtime, hash, document_name, uploaded_at, pending_operation?}
+# Ghi lại sau mỗi file thành công, nên chạy lại sau khi bị ngắt sẽ tiếp tục từ chỗ dừng.
+# pending_operation {name, hash}: upload đã được nhận nhưng hết giờ chờ index.
+# ==============================================================================
+def load_manifest(path=MANIFEST_PATH) -> dict:
+    if not os.path.exists(path):
+        return {"store_name": None, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(manifest: dict, path=MANIFEST_PATH):
+    """Ghi nguyên tử (file tạm + replace) để không hỏng manifest khi bị ngắt giữa chừng."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def scan_data_dir(data_dir=DATA_DIR) -> dict:
+    """Tất cả PDF trong các thư mục con của DATA_DIR: path tương đối -> (path, size, mtime)."""
+    files = {}
+    for dir_ in sorted(os.listdir(data_dir)):
+        data_dir_ = os.path.join(data_dir, dir_)
+        if not os.path.isdir(data_dir_):
+            continue
+        for filename in sorted(os.listdir(data_dir_)):
+            file_path = os.path.join(data_dir_, filename)
+            if os.path.isdir(file_path) or not filename.endswith(".pdf"):
+                continue
+            stat = os.stat(file_path)
+            files[f"{dir_}/{filename}"] = (file_path, stat.st_size, int(stat.st_mtime))
+    return files
+
+
+def plan_sync(manifest: dict, files: dict) -> tuple[list, list]:
+    """
+    So sánh thư mục với manifest.
+    Trả về (to_upload: [(rel, path, size, mtime, hash)], to_delete: [rel]).
+    File có size + mtime như cũ được coi là không đổi (không cần tính lại hash).
+    """
+    to_upload = []
+    entries = manifest["files"]
+    for rel, (file_path, size, mtime) in files.items():
+        entry = entries.get(rel)
+        if entry and entry.get("document_name") and entry.get("size") == size and entry.get("mtime") == mtime:
+            continue
+        file_hash = compute_file_hash(file_path)
+        if entry and entry.get("document_name") and entry.get("hash") == file_hash:
+            entry.update({"size": size, "mtime": mtime})  # chỉ bị touch, nội dung không đổi
+            continue
+        to_upload.append((rel, file_path, size, mtime, file_hash))
+    to_delete = [rel for rel in entries if rel not in files]
+    return to_upload, to_delete
+
+
+def document_source(document) -> str | None:
+    """Path tương đối của file gốc (metadata `source` gắn lúc tải lên)."""
+    return next((m.string_value for m in document.custom_metadata or [] if m.key == "source"), None)
+
+
+def bootstrap_manifest(client, store_name: str, manifest: dict, files: dict):
+    """
+    Store đã được nạp trước khi có manifest: nhận diện tài liệu sẵn có (theo metadata
+    `source`, hoặc display_name nếu không trùng tên) để không tải lại cả kho.
+    """
+    by_name = {}
+    for rel, (file_path, size, mtime) in files.items():
+        by_name.setdefault(os.path.basename(rel), []).append(rel)
+    matched = 0
+    for document in client.file_search_stores.documents.list(parent=store_name):
+        source = document_source(document)
+        candidates = [source] if source in files else by_name.get(document.display_name, [])
+        if len(candidates) != 1 or candidates[0] in manifest["files"]:
+            continue
+        rel = candidates[0]
+        file_path, size, mtime = files[rel]
+        manifest["files"][rel] = {
+            "size": size, "mtime": mtime, "hash": compute_file_hash(file_path),
+            "document_name": document.name, "uploaded_at": None
+        }
+        matched += 1
+    print(f"Đã nhận diện {matched} tài liệu có sẵn trong store.")
+
+
+def call_with_retry(call, rel: str, bucket: TokenBucket, progress: UploadProgress | None = None):
+    """Gọi API qua token bucket; 429/5xx thì thử lại chính lời gọi đó với backoff lũy thừa + jitter."""
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return call()
+        except Exception as e:
+            attempt += 1
+            if attempt > config.MAIN_STORE_UPLOAD_RETRIES or not is_retryable_error(e):
+                raise
+            if progress:
+                progress.retry()
+            delay = min(60.0, 2.0 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"⚠️ {rel}: {e} -> thử lại sau {delay:.1f}s ({attempt}/{config.MAIN_STORE_UPLOAD_RETRIES})")
+            time.sleep(delay)
+
+
+class IndexPending(RuntimeError):
+    """Google đã nhận file nhưng chưa index xong sau OPERATION_TIMEOUT; lần chạy sau chờ tiếp operation này."""
+
+    def __init__(self, rel: str, operation_name: str):
+        super().__init__(f"Index {rel} quá {OPERATION_TIMEOUT}s")
+        self.operation_name = operation_name
+
+
+def wait_operation(client, operation, rel: str, bucket: TokenBucket,
+                   progress: UploadProgress | None = None) -> str | None:
+    """Chờ operation index xong, trả về tên document trong store. Mỗi lần hỏi tiến trình được thử lại riêng."""
+    deadline = time.monotonic() + OPERATION_TIMEOUT
+    while not operation.done:
+        if time.monotonic() > deadline:
+            raise IndexPending(rel, operation.name)
+        time.sleep(OPERATION_POLL_INTERVAL)
+        current = operation
+        operation = call_with_retry(lambda: client.operations.get(current), rel, bucket, progress)
+    if getattr(operation, "error", None):
+        raise RuntimeError(operation.error)
+    return getattr(getattr(operation, "response", None), "document_name", None)
+
+
+def upload_file(client, store_name: str, file_path: str, rel: str,
+                bucket: TokenBucket, progress: UploadProgress | None = None) -> str | None:
     """
-    Tạo File Store, tải file lên, và chờ index.
+    Tải 1 file lên store, chờ index xong, trả về tên document trong store.
+    Chỉ lời gọi upload được thử lại như một khối; lỗi khi hỏi tiến trình chỉ thử lại lời
+    gọi operations.get, không tải lại file (tránh tài liệu trùng trong store).
     """
+    operation = call_with_retry(
+        lambda: client.file_search_stores.upload_to_file_search_store(
+            file=file_path,
+            file_search_store_name=store_name,
+            config={
+                'display_name': os.path.basename(file_path),
+                'custom_metadata': [{'key': 'source', 'string_value': rel}]
+            }
+        ),
+        rel, bucket, progress
+    )
+    return wait_operation(client, operation, rel, bucket, progress)
+
+
+def find_strays(client, store_name: str, manifest: dict, rels: list[str]) -> dict:
+    """
+    Tài liệu trong store có `source` là một file cần tải nhưng không có trong manifest:
+    Google đã nhận file nhưng lần chạy trước bị ngắt (hoặc hết giờ chờ) trước khi ghi manifest.
+    Trả về rel -> [document].
+    """
+    wanted = set(rels)
+    recorded = {entry.get("document_name") for entry in manifest["files"].values()}
+    strays = {}
+    try:
+        for document in client.file_search_stores.documents.list(parent=store_name):
+            source = document_source(document)
+            if source in wanted and document.name not in recorded:
+                strays.setdefault(source, []).append(document)
+    except Exception as e:
+        print(f"⚠️ Không liệt kê được tài liệu trong store, bỏ qua bước dọn tài liệu trùng: {e}")
+    return strays
+
+
+def _adoptable(document, mtime: int) -> bool:
+    """Đã index xong và được tạo sau lần sửa file cuối, tức là chứa đúng nội dung hiện tại."""
+    created = getattr(document, "create_time", None)
+    return (str(getattr(document, "state", "")).endswith("ACTIVE")
+            and created is not None and created.timestamp() >= mtime)
+
+
+def sync_file(client, store_name: str, item: tuple, pending: dict | None, strays: list,
+              bucket: TokenBucket, progress: UploadProgress | None = None) -> str | None:
+    """
+    Đưa 1 file vào store mà không tạo tài liệu trùng, trả về tên document:
+    1. lần trước hết giờ chờ index (cùng nội dung) -> chờ tiếp operation đó;
+    2. có tài liệu sót lại dùng được (xem _adoptable) -> nhận luôn, không tải lại;
+    3. còn lại mới tải lên. Các tài liệu sót lại khác của file bị xóa khỏi store.
+    """
+    rel, file_path, size, mtime, file_hash = item
+    document_name = None
+    if pending and pending.get("hash") == file_hash:
+        current = genai.types.UploadToFileSearchStoreOperation(name=pending["name"])
+        try:
+            operation = call_with_retry(lambda: client.operations.get(current), rel, bucket, progress)
+            document_name = wait_operation(client, operation, rel, bucket, progress)
+        except IndexPending:
+            raise
+        except Exception as e:
+            print(f"⚠️ {rel}: không chờ tiếp được operation {pending['name']} ({e}), tải lại.")
+    if document_name is None:
+        adoptable = [d for d in strays if _adoptable(d, mtime)]
+        if adoptable:
+            document_name = max(adoptable, key=lambda d: d.create_time).name
+            print(f"♻️ {rel}: dùng lại tài liệu đã có trong store {document_name}")
+        else:
+            document_name = upload_file(client, store_name, file_path, rel, bucket, progress)
+    for document in strays:
+        if document.name != document_name:
+            delete_document(client, document.name)
+    return document_name
+
+
+def delete_document(client, document_name: str):
+    try:
+        client.file_search_stores.documents.delete(name=document_name, config={"force": True})
+    except Exception as e:
+        print(f"Lỗi khi xóa tài liệu {document_name}: {e}")
+
+
+def create_store(client) -> str | None:
     print("Đang tạo File Store mới trên Google...")
     try:
         file_store = client.file_search_stores.create(
@@ -19,68 +295,115 @@ def create_and_populate_store(client):
                 'display_name': 'Law Knowledge'
             }
         )
-        store_name = file_store.name
-
-        # In ra hướng dẫn CỰC KỲ QUAN TRỌNG
-        print("\n" + "=" * 50)
-        print(f"✅ TẠO THÀNH CÔNG STORE: {store_name}")
-        print(f'LAW_MAIN_STORE_NAME="{store_name}"')
-        print("=" * 50 + "\n")
-
     except Exception as e:
         print(f"Lỗi khi tạo File Store: {e}")
         return None
+    store_name = file_store.name
 
-    # 3. Tải các file lên
-    for dir_ in os.listdir(DATA_DIR):
-        data_dir_ = os.path.join(DATA_DIR, dir_)
-
-        if not os.path.isdir(data_dir_):
-            continue
-
-        print(f"Bắt đầu tải file từ thư mục: {data_dir_}...")
-        file_count = 0
-        files_to_upload = []
-
-        for filename in os.listdir(data_dir_):
-            if os.path.isdir(os.path.join(data_dir_, filename)):
-                continue
+    # In ra hướng dẫn CỰC KỲ QUAN TRỌNG
+    print("\n" + "=" * 50)
+    print(f"✅ TẠO THÀNH CÔNG STORE: {store_name}")
+    print(f'LAW_MAIN_STORE_NAME="{store_name}"')
+    print("=" * 50 + "\n")
+    return store_name
 
-            if filename.endswith(".pdf"):
-                files_to_upload.append(filename)
 
-        total_files = len(files_to_upload)
-        if total_files == 0:
-            print("Cảnh báo: Không tìm thấy file nào trong DATA_DIR.")
-            return store_name
+def sync_store(client, store_name: str | None = None, manifest_path=MANIFEST_PATH, data_dir=DATA_DIR):
+    """
+    Đồng bộ tăng dần DATA_DIR với store: chỉ tải file mới/đã đổi, xóa tài liệu của file đã bị xóa.
+    Store lấy theo thứ tự: tham số -> manifest -> LAW_MAIN_STORE_NAME -> tạo mới.
+    """
+    manifest = load_manifest(manifest_path)
+    files = scan_data_dir(data_dir)
+    store_name = store_name or manifest.get("store_name") or config.LAW_MAIN_STORE_NAME
+    if store_name and manifest.get("store_name") not in (None, store_name):
+        manifest["files"] = {}  # manifest của store khác
+    if not store_name:
+        store_name = create_store(client)
+        if not store_name:
+            return None
+    elif not manifest["files"]:
+        bootstrap_manifest(client, store_name, manifest, files)
+    manifest["store_name"] = store_name
+    save_manifest(manifest, manifest_path)
 
-        print(f"Tìm thấy {total_files} file để tải lên.")
+    to_upload, to_delete = plan_sync(manifest, files)
+    save_manifest(manifest, manifest_path)  # mtime của file chỉ bị touch
+    print(f"Đồng bộ {store_name}: {len(files)} file, {len(to_upload)} cần tải lên, {len(to_delete)} cần xóa.")
 
-        for i, filename in enumerate(files_to_upload):
-            file_path = os.path.join(data_dir_, filename)
+    strays = find_strays(client, store_name, manifest, [item[0] for item in to_upload]) if to_upload else {}
+    uploaded = 0
+    concurrency = max(1, config.MAIN_STORE_UPLOAD_CONCURRENCY)
+    bucket = TokenBucket(config.MAIN_STORE_UPLOADS_PER_MINUTE, burst=concurrency)
+    progress = UploadProgress(len(to_upload), sum(item[2] for item in to_upload))
+    # Nhiều luồng tải lên song song; manifest chỉ được ghi ở luồng chính
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="store-upload") as pool:
+        futures = {
+            pool.submit(
+                sync_file, client, store_name, item,
+                manifest["files"].get(item[0], {}).get("pending_operation"),
+                strays.get(item[0], []), bucket, progress
+            ): item
+            for item in to_upload
+        }
+        for future in as_completed(futures):
+            rel, file_path, size, mtime, file_hash = futures[future]
             try:
-                print(f"Đang tải lên file {i + 1}/{total_files}: {filename}...")
-                client.file_search_stores.upload_to_file_search_store(
-                    file=file_path,
-                    file_search_store_name=store_name,
-                    config={
-                        'display_name': filename
-                    }
-                )
-                file_count += 1
+                document_name = future.result()
+            except IndexPending as e:
+                # Giữ tên operation (bản cũ trong manifest, nếu có, vẫn dùng tới khi index xong)
+                print(f"⏳ {rel}: {e}, lần chạy sau sẽ chờ tiếp {e.operation_name}")
+                entry = manifest["files"].setdefault(rel, {"document_name": None})
+                entry["pending_operation"] = {"name": e.operation_name, "hash": file_hash}
+                save_manifest(manifest, manifest_path)
+                progress.finish(rel, size, ok=False)
+                continue
             except Exception as e:
-                print(f"Lỗi khi tải file {filename}: {e}")
+                print(f"Lỗi khi tải file {rel}: {e}")
+                progress.finish(rel, size, ok=False)
+                continue
+            old = manifest["files"].get(rel)
+            if old and old.get("document_name"):
+                delete_document(client, old["document_name"])  # bản cũ của file đã sửa
+            manifest["files"][rel] = {
+                "size": size, "mtime": mtime, "hash": file_hash, "document_name": document_name,
+                "uploaded_at": datetime.now(timezone.utc).isoformat()
+            }
+            save_manifest(manifest, manifest_path)
+            uploaded += 1
+            progress.finish(rel, size, ok=True)
 
-        print(f"\nHoàn tất! Đã tải {file_count} / {total_files} của thư mục {dir_} file lên Store.")
+    for rel in to_delete:
+        entry = manifest["files"].pop(rel)
+        if entry.get("document_name"):
+            delete_document(client, entry["document_name"])
+        save_manifest(manifest, manifest_path)
 
+    print(f"\nHoàn tất! Đã tải {uploaded} / {len(to_upload)} file, xóa {len(to_delete)} file khỏi Store.")
     print("\n✅ QUY TRÌNH SETUP HOÀN TẤT.")
     return store_name
 
 
+def create_and_populate_store(client):
+    """
+    Tạo File Store mới, tải toàn bộ file lên và chờ index (manifest mới).
+    """
+    store_name = create_store(client)
+    if not store_name:
+        return None
+    save_manifest({"store_name": store_name, "files": {}})
+    return sync_store(client, store_name)
+
+
 # ==============================================================================
-# MAIN LOGIC (Chỉ để chạy hàm setup)
+# MAIN LOGIC
 # ==============================================================================
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Nạp/đồng bộ kho văn bản luật lên Google File Search Store.")
+    parser.add_argument("--new", action="store_true", help="tạo store mới và tải lại toàn bộ")
+    parser.add_argument("--store", default=None, help="tên store (mặc định: manifest hoặc LAW_MAIN_STORE_NAME)")
+    args = parser.parse_args()
+
     print("Đang khởi tạo Google Client...")
     try:
         client = genai.Client(api_key=GOOGLE_API_KEY)
@@ -88,5 +411,7 @@ if __name__ == '__main__':
         print(f"Lỗi nghiêm trọng khi tạo client: {e}")
         exit()
 
-    # Chạy hàm tạo mới
-    create_and_populate_store(client)
\ No newline at end of file
+    if args.new:
+        create_and_populate_store(client)
+    else:
+        sync_store(client, args.store)
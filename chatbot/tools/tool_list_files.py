@@ -22,7 +22,7 @@ def tool_list_uploaded_files(user_id: str = None):
         return cached
 
     try:
-        cursor = coll.find({"user_id": user_id}, {"filename": 1, "status": 1, "session_id": 1}).sort("created_at", -1)
+        cursor = coll.find({"user_id": user_id, "deleted_at": {"$exists": False}}, {"filename": 1, "status": 1, "session_id": 1}).sort("created_at", -1)
         files = []
         for d in cursor:
             fn = d.get("filename") or "<unknown>"
@@ -1,5 +1,7 @@
 from langchain_core.tools import tool
 from chatbot.core.db import DB_COLLECTION
+from chatbot.core.history import get_recent_messages
+from chatbot.core.recent_turns import app_recent_turns
 
 
 @tool
@@ -20,15 +22,15 @@ def tool_recall_chat_history(user_id: str, session_id: str):
 
     try:
         # --- QUERY CHÍNH XÁC 1 SESSION ---
-        session = DB_COLLECTION.find_one({
-            "user_id": user_id,
-            "session_id": session_id
-        })
+        # Redis recent-turns cache trước, Mongo khi cache miss (kèm các lượt chưa flush).
+        # Chỉ lấy trong cửa sổ cache: phiên dài vẫn trúng cache thay vì đọc cả lịch sử từ Mongo
+        session = get_recent_messages(session_id, user_id, limit=app_recent_turns.max_turns)
 
         if not session:
             return f"Không tìm thấy dữ liệu cho phiên làm việc {session_id}."
 
-        messages = session.get("messages", [])
+        messages = session.get("messages", [])[-app_recent_turns.max_turns:]
+        older = max(0, session.get("total", len(messages)) - len(messages))
 
         # Đếm và lọc tin nhắn
         question_count = sum(1 for m in messages if m.get("question"))
@@ -37,6 +39,9 @@ def tool_recall_chat_history(user_id: str, session_id: str):
             return "Phiên này chưa có câu hỏi nào."
 
         summary = f"Trong phiên làm việc {session_id}, bạn đã hỏi {question_count} câu:\n"
+        if older:
+            summary = (f"Trong phiên làm việc {session_id}, {question_count} câu hỏi gần nhất "
+                       f"(bỏ qua {older} lượt cũ hơn):\n")
 
         for m in messages:
             q = m.get("question", "")
@@ -1,5 +1,7 @@
 from langchain_core.tools import StructuredTool
-from chatbot.core.file_store import get_session_file_stores
+from chatbot.core.file_store import get_session_file_stores, get_session_pending_documents
+from chatbot.core.store_liveness import app_store_liveness
+from chatbot.core.local_index import search_session_chunks, format_chunks
 from chatbot.core.cache import app_cache
 from chatbot.core.utils import safe_json_parse
 
@@ -8,27 +10,9 @@ def build_tool_search_uploaded(rag_pipeline, genai_client):
     """
     Factory function:
     - rag_pipeline: Dùng để search & rerank.
-    - genai_client: Dùng để kiểm tra xem Store có còn sống không (Verify).
+    - genai_client: Dùng để kiểm tra xem Store có còn sống không (Verify, chạy nền).
     """
 
-    def _validate_stores(stores: list[str]) -> list[str]:
-        """
-        Helper: Kiểm tra danh sách store_name có thực sự tồn tại trên Google không.
-        """
-        valid_stores = []
-        if not genai_client:
-            return stores  # Fallback nếu client chưa sẵn sàng
-
-        for name in stores:
-            try:
-                # Thử lấy thông tin store. Nếu store bị xóa/lỗi -> Ném Exception
-                genai_client.file_search_stores.get(name=name)
-                valid_stores.append(name)
-            except Exception as e:
-                print(f"[ToolUpload] Store '{name}' không truy cập được (đã bị xóa?): {e}")
-                # Không thêm vào valid_stores
-        return valid_stores
-
     def search_uploaded_logic(query: str = None, session_id: str = None, **kwargs):
         q_in = query if query else kwargs.get("query")
         parsed = safe_json_parse(q_in)
@@ -40,32 +24,49 @@ def build_tool_search_uploaded(rag_pipeline, genai_client):
         if not q_in or not session_id:
             return "Thiếu query hoặc session_id."
 
+        # 1. Index cục bộ (Mongo text index) chỉ cho các file chưa vào store (vừa upload,
+        #    đang xử lý): file đã processed đi qua file search + rerank bên dưới
+        local_hits = search_session_chunks(session_id, str(q_in), doc_ids=get_session_pending_documents(session_id))
+        local_text = format_chunks(local_hits) if local_hits else ""
+
+        # 2. Google file search store (Store đã bị đánh dấu chết không còn trong danh sách)
         user_stores = get_session_file_stores(session_id)
         if not user_stores:
-            return "Chưa có file nào trong phiên này."
+            if local_text:
+                return local_text
+            return "Chưa có file nào trong phiên này hoặc các file không còn khả dụng (có thể đã bị xóa hoặc hết hạn)."
 
-        valid_stores = _validate_stores(user_stores)
+        def _merge(result):
+            if not local_text:
+                return result
+            return f"{result}\n\n---\n\n[File đang xử lý - trích đoạn cục bộ]\n{local_text}"
 
-        if not valid_stores:
-            return "Các file trong phiên này không còn khả dụng (có thể đã bị xóa hoặc hết hạn)."
-
-        cache_k = app_cache.generate_key("file", session_id, q_in)
+        # Cache trước, không gọi API kiểm tra store trên đường nóng
+        cache_k = app_cache.generate_key("file", session_id, ",".join(sorted(user_stores)), q_in)
         cached = app_cache.get(cache_k)
         if cached:
-            return cached
+            return _merge(cached)
+
+        # Kiểm tra lại các store quá hạn (last_verified_at) ở luồng nền
+        app_store_liveness.schedule(session_id, genai_client)
 
         try:
             result = rag_pipeline.run_pipeline(
                 original_query=str(q_in),
-                store_names=valid_stores
+                store_names=user_stores,
+                fanout=True
             )
             app_cache.set(cache_k, result, ttl=1800)
-            return result
+            return _merge(result)
         except Exception as e:
+            # Có thể một store vừa bị xóa: kiểm tra lại ngay (nền) để lần sau loại nó ra
+            app_store_liveness.schedule(session_id, genai_client, max_age=0)
+            if local_text:
+                return local_text
             return f"Lỗi tra cứu file: {e}"
 
     return StructuredTool.from_function(
         func=search_uploaded_logic,
         name="tool_search_uploaded_file",
         description="Tìm kiếm trong tài liệu upload (PDF)."
-    )
\ No newline at end of file
+    )
@@ -337,8 +337,54 @@ export default function ChatPage() {
         }
     };
 
-    // Poll PDF file status from database
+    // Apply a file status; returns true once the status is final
+    const applyFileStatus = (fileId: string, fileName: string, status: string) => {
+        if (status === "processed") {
+            setUploadedFile({ name: fileName, status: "processed", fileType: "pdf", fileId });
+            return true;
+        } else if (["dead_letter", "error_processing", "error"].includes(status)) {
+            setUploadedFile({ name: fileName, status: "error", fileType: "pdf", fileId });
+            alert("File processing failed.");
+            return true;
+        }
+        return false;
+    };
+
+    // Follow PDF file status over Server-Sent Events, falling back to polling
     const pollFileStatus = async (fileId: string, fileName: string) => {
+        try {
+            const res = await fetch(`${API_URL}/chat/files/events?file_id=${fileId}`, {
+                headers: authHeaders(),
+            });
+            if (res.ok && res.body) {
+                const reader = res.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = "";
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split("\n\n");
+                    buffer = events.pop() || "";
+                    for (const event of events) {
+                        const dataLine = event.split("\n").find((line) => line.startsWith("data: "));
+                        if (!dataLine) continue;
+                        const data = JSON.parse(dataLine.slice(6));
+                        if (applyFileStatus(fileId, fileName, data.status)) {
+                            reader.cancel();
+                            return;
+                        }
+                    }
+                }
+            }
+        } catch (error) {
+            console.error("Error streaming file status:", error);
+        }
+        pollFileStatusFallback(fileId, fileName);
+    };
+
+    // Poll PDF file status from database
+    const pollFileStatusFallback = async (fileId: string, fileName: string) => {
         const maxAttempts = 60; // 2 minutes max
         let attempts = 0;
 
@@ -349,14 +395,7 @@ export default function ChatPage() {
                 });
                 if (res.ok) {
                     const data = await res.json();
-                    if (data.status === "processed") {
-                        setUploadedFile({ name: fileName, status: "processed", fileType: "pdf", fileId });
-                        return;
-                    } else if (data.status === "error_processing") {
-                        setUploadedFile({ name: fileName, status: "error", fileType: "pdf", fileId });
-                        alert("File processing failed.");
-                        return;
-                    }
+                    if (applyFileStatus(fileId, fileName, data.status)) return;
                 }
                 // Continue polling
                 attempts++;
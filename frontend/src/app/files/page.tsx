@@ -132,6 +132,7 @@ export default function FilesPage() {
             "processed": { color: "bg-emerald-500/20 text-emerald-400", text: "PROCESSED" },
             "uploaded": { color: "bg-amber-500/20 text-amber-400", text: "UPLOADED" },
             "error_processing": { color: "bg-red-500/20 text-red-400", text: "ERROR" },
+            "dead_letter": { color: "bg-red-500/20 text-red-400", text: "FAILED" },
         };
         const s = statusMap[status] || { color: "bg-zinc-500/20 text-zinc-400", text: status.toUpperCase() };
         return (